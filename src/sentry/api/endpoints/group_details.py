@@ -231,8 +231,8 @@ class GroupDetailsEndpoint(GroupEndpoint, EnvironmentMixin):
         if last_release:
             last_release = self._get_release_info(request, group, last_release)
 
-        get_range = functools.partial(tsdb.get_range,
-                                      environment_ids=environment_ids)
+        get_range_rollup = functools.partial(tsdb.get_range_rollup,
+                                             environment_ids=environment_ids)
 
         tags = tagstore.get_group_tag_keys(
             group.project_id, group.id, environment_ids, limit=100)
@@ -244,21 +244,19 @@ class GroupDetailsEndpoint(GroupEndpoint, EnvironmentMixin):
             )
 
         now = timezone.now()
-        hourly_stats = tsdb.rollup(
-            get_range(
-                model=tsdb.models.group,
-                keys=[group.id],
-                end=now,
-                start=now - timedelta(days=1),
-            ), 3600
+        hourly_stats = get_range_rollup(
+            model=tsdb.models.group,
+            keys=[group.id],
+            end=now,
+            start=now - timedelta(days=1),
+            interval=3600,
         )[group.id]
-        daily_stats = tsdb.rollup(
-            get_range(
-                model=tsdb.models.group,
-                keys=[group.id],
-                end=now,
-                start=now - timedelta(days=30),
-            ), 3600 * 24
+        daily_stats = get_range_rollup(
+            model=tsdb.models.group,
+            keys=[group.id],
+            end=now,
+            start=now - timedelta(days=30),
+            interval=3600 * 24,
         )[group.id]
 
         participants = list(
@@ -409,6 +407,7 @@ class GroupDetailsEndpoint(GroupEndpoint, EnvironmentMixin):
                 project_id=group.project_id,
                 group__id=group.id,
             ).delete()
+            GroupHash.invalidate_cache(group.project_id)
 
             delete_groups.apply_async(
                 kwargs={
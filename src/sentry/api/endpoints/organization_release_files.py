@@ -180,4 +180,8 @@ class OrganizationReleaseFilesEndpoint(OrganizationReleasesBaseEndpoint):
             file.delete()
             return Response({'detail': ERR_FILE_EXISTS}, status=409)
 
+        # Saving the file bumped the cache version before the transaction
+        # committed, an index of the release may have been cached since.
+        ReleaseFile.bump_cache_version(release.id)
+
         return Response(serialize(releasefile, request.user), status=201)
@@ -213,6 +213,9 @@ class ProjectReleaseFileDetailsEndpoint(ProjectEndpoint):
         # TODO(dcramer): this doesnt handle a failure from file.deletefile() to
         # the actual deletion of the db row
         releasefile.delete()
+        # The row is deleted in a transaction, which committed only after the
+        # cache version was bumped.
+        ReleaseFile.bump_cache_version(release.id)
         file.delete()
 
         return Response(status=204)
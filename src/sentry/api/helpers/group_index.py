@@ -316,6 +316,7 @@ def handle_discard(request, group_list, projects, user):
                     group=None,
                     group_tombstone_id=tombstone.id,
                 )
+                GroupHash.invalidate_cache(group.project_id)
 
     for project in projects:
         _delete_groups(request, project, groups_to_delete.get(project.id), delete_type='discard')
@@ -346,6 +347,7 @@ def _delete_groups(request, project, group_list, delete_type):
         project_id=project.id,
         group__id__in=group_ids,
     ).delete()
+    GroupHash.invalidate_cache(project.id)
 
     delete_groups_task.apply_async(
         kwargs={
@@ -10,10 +10,15 @@ from __future__ import absolute_import
 import logging
 import six
 
-from django.db.models import F
+from collections import OrderedDict, defaultdict
+from django.db import router
+from django.db.models import F, Model
 
+from sentry.db.models.query import bulk_increment
 from sentry.signals import buffer_incr_complete
 from sentry.tasks.process_buffer import process_incr
+from sentry.utils import metrics
+from sentry.utils.db import is_postgres
 from sentry.utils.services import Service
 
 
@@ -38,7 +43,7 @@ class Buffer(Service):
     This is useful in situations where a single event might be happening so fast that the queue cant
     keep up with the updates.
     """
-    __all__ = ('incr', 'process', 'process_pending', 'validate')
+    __all__ = ('incr', 'process', 'process_pending', 'flush', 'validate')
 
     def incr(self, model, columns, filters, extra=None):
         """
@@ -56,6 +61,12 @@ class Buffer(Service):
     def process_pending(self, partition=None):
         return []
 
+    def flush(self):
+        """
+        Writes out anything held locally by the buffer. A no-op unless the
+        buffer combines writes in process.
+        """
+
     def process(self, model, columns, filters, extra=None):
         from sentry.models import Group
         from sentry.event_manager import ScoreClause
@@ -83,3 +94,90 @@ class Buffer(Service):
             created=created,
             sender=model,
         )
+
+    def process_batch(self, batch):
+        """
+        Processes a sequence of ``(model, columns, filters, extra)`` tuples.
+
+        Increments targeting the same row are merged first (counters are
+        summed, ``extra`` is last write wins). On PostgreSQL, rows of the same
+        model that share their column names are then written with a single
+        multi-row UPDATE. Rows which don't exist yet fall back to ``process``
+        so they can be created.
+        """
+        merged = OrderedDict()
+        for model, columns, filters, extra in batch:
+            key = (model, tuple(sorted(
+                (k, v.pk if isinstance(v, Model) else v) for k, v in six.iteritems(filters)
+            )))
+            if key not in merged:
+                merged[key] = (model, dict(columns), filters, dict(extra or {}))
+                continue
+            _, merged_columns, _, merged_extra = merged[key]
+            for column, amount in six.iteritems(columns):
+                merged_columns[column] = merged_columns.get(column, 0) + amount
+            if extra:
+                merged_extra.update(extra)
+
+        shapes = defaultdict(list)
+        for model, columns, filters, extra in six.itervalues(merged):
+            shape = (model, tuple(sorted(filters)), tuple(sorted(columns)), tuple(sorted(extra)))
+            shapes[shape].append((filters, columns, extra))
+
+        statements = 0
+        for (model, _, _, _), rows in six.iteritems(shapes):
+            statements += self._process_rows(model, rows)
+
+        metrics.timing('buffer.batch.size', len(batch))
+        metrics.timing('buffer.batch.coalesced', len(batch) - statements)
+
+    def _process_rows(self, model, rows):
+        """
+        Writes rows which share a shape, returning the number of statements
+        issued (not counting creates).
+        """
+        from sentry.models import Group
+
+        filters, columns, extra = rows[0]
+        expressions = None
+        if model is Group and 'last_seen' in extra and 'times_seen' in columns:
+            # mirrors the ScoreClause computed in ``process``
+            expressions = {
+                'score': 'log({t[times_seen]} + {v[times_seen]}) * 600 + '
+                         'extract(epoch from {v[last_seen]})::int',
+            }
+            rows = [
+                (f, c, dict((k, v) for k, v in six.iteritems(e) if k != 'score'))
+                for f, c, e in rows
+            ]
+
+        can_bulk = (
+            len(rows) > 1 and columns and
+            is_postgres(router.db_for_write(model)) and
+            not any(
+                hasattr(v, 'resolve_expression')
+                for _, _, e in rows for v in six.itervalues(e)
+            )
+        )
+
+        # Subclasses override ``process`` to flush their own keys (see
+        # ``RedisBuffer``), so rows are written with this implementation.
+        if not can_bulk:
+            for filters, columns, extra in rows:
+                Buffer.process(self, model, columns, filters, extra or None)
+            return len(rows)
+
+        updated = bulk_increment(model, rows, expressions=expressions)
+        for idx, (filters, columns, extra) in enumerate(rows):
+            if idx not in updated:
+                Buffer.process(self, model, columns, filters, extra or None)
+                continue
+            buffer_incr_complete.send_robust(
+                model=model,
+                columns=columns,
+                filters=filters,
+                extra=extra or None,
+                created=False,
+                sender=model,
+            )
+        return 1
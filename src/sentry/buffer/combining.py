@@ -0,0 +1,131 @@
+"""
+sentry.buffer.combining
+~~~~~~~~~~~~~~~~~~~~~~~
+
+:copyright: (c) 2010-2019 by the Sentry Team, see AUTHORS for more details.
+:license: BSD, see LICENSE for more details.
+"""
+from __future__ import absolute_import
+
+import atexit
+import six
+import threading
+
+from collections import OrderedDict
+from django.db.models import Model
+from time import time
+
+from sentry.buffer.base import Buffer
+from sentry.utils import metrics
+from sentry.utils.imports import import_string
+
+
+class CombiningBuffer(Buffer):
+    """
+    Combines increments in process before handing them to another buffer.
+
+    Increments to the same ``(model, filters)`` are summed and their ``extra``
+    values merged (last write wins) locally, and only written to the backend
+    once ``max_size`` distinct rows are pending, ``max_age`` seconds have
+    passed since the oldest pending write, or ``flush`` is called. Pending
+    writes are also flushed at the end of every task and request, and when
+    the process exits.
+
+    >>> SENTRY_BUFFER = 'sentry.buffer.combining.CombiningBuffer'
+    >>> SENTRY_BUFFER_OPTIONS = {
+    >>>     'backend': 'sentry.buffer.redis.RedisBuffer',
+    >>>     'options': {},
+    >>>     'max_size': 1000,
+    >>>     'max_age': 1,
+    >>> }
+    """
+    def __init__(self, backend='sentry.buffer.redis.RedisBuffer', options=None,
+                 max_size=1000, max_age=1):
+        self.backend = import_string(backend)(**(options or {}))
+        self.max_size = max_size
+        self.max_age = max_age
+        assert self.max_size > 0
+        self._lock = threading.Lock()
+        self._pending = OrderedDict()
+        self._deadline = None
+
+    def validate(self):
+        self.backend.validate()
+
+    def setup(self):
+        from celery.signals import task_postrun, worker_process_shutdown
+        from django.core.signals import request_finished
+
+        self.backend.setup()
+        task_postrun.connect(self._flush_on_signal, weak=False)
+        request_finished.connect(self._flush_on_signal, weak=False)
+        worker_process_shutdown.connect(self._flush_on_signal, weak=False)
+        atexit.register(self.flush)
+
+    def _flush_on_signal(self, **kwargs):
+        self.flush()
+
+    def _make_key(self, model, filters):
+        return (model, tuple(sorted(
+            (k, v.pk if isinstance(v, Model) else v) for k, v in six.iteritems(filters)
+        )))
+
+    def _merge(self, model, columns, filters, extra, stale=False):
+        # must be called while holding the lock
+        key = self._make_key(model, filters)
+        if key not in self._pending:
+            self._pending[key] = (model, dict(columns), filters, dict(extra or {}))
+            return
+        _, pending_columns, _, pending_extra = self._pending[key]
+        for column, amount in six.iteritems(columns):
+            pending_columns[column] = pending_columns.get(column, 0) + amount
+        if extra:
+            if stale:
+                # anything written since is newer than these values
+                for column, value in six.iteritems(extra):
+                    pending_extra.setdefault(column, value)
+            else:
+                pending_extra.update(extra)
+
+    def incr(self, model, columns, filters, extra=None):
+        with self._lock:
+            self._merge(model, columns, filters, extra)
+            if self._deadline is None:
+                self._deadline = time() + self.max_age
+            should_flush = len(self._pending) >= self.max_size or time() >= self._deadline
+
+        metrics.incr('buffer.combined-incr', skip_internal=True, tags={
+            'module': model.__module__,
+            'model': model.__name__,
+        })
+
+        if should_flush:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, OrderedDict()
+            self._deadline = None
+
+        items = list(six.itervalues(pending))
+        metrics.timing('buffer.combined-flush', len(items))
+        for idx, (model, columns, filters, extra) in enumerate(items):
+            try:
+                self.backend.incr(model, columns, filters, extra or None)
+            except Exception:
+                # Put everything that has not been written yet back, so that
+                # it is retried on the next flush rather than lost.
+                with self._lock:
+                    for model, columns, filters, extra in items[idx:]:
+                        self._merge(model, columns, filters, extra, stale=True)
+                    if self._deadline is None:
+                        self._deadline = time() + self.max_age
+                raise
+
+    def process_pending(self, partition=None):
+        return self.backend.process_pending(partition=partition)
+
+    def process(self, *args, **kwargs):
+        return self.backend.process(*args, **kwargs)
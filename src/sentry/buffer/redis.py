@@ -11,6 +11,7 @@ import six
 
 from time import time
 from binascii import crc32
+from collections import OrderedDict
 
 from datetime import datetime
 from django.db import models
@@ -58,12 +59,35 @@ class RedisBuffer(Buffer):
     key_expire = 60 * 60  # 1 hour
     pending_key = 'b:p'
 
-    def __init__(self, pending_partitions=1, incr_batch_size=2, **options):
+    def __init__(self, pending_partitions=1, incr_batch_size=2, batch_flush=False,
+                 pending_chunk_size=1000, pending_time_budget=30, pending_max_queue_depth=None,
+                 pending_queues=None, value_encoding='pickle', **options):
         self.cluster, options = get_cluster_from_options('SENTRY_BUFFER_OPTIONS', options)
         self.pending_partitions = pending_partitions
         self.incr_batch_size = incr_batch_size
+        self.batch_flush = batch_flush
+        # Filters and extra values are pickled by default. With 'json' they
+        # are written with the typed JSON encoding instead (falling back to
+        # pickle for values it can't represent). Reads always accept both,
+        # but older workers can't read the newer JSON value types, so only
+        # switch to 'json' once every process that flushes the buffer has
+        # been upgraded.
+        assert value_encoding in ('json', 'pickle')
+        self.value_encoding = value_encoding
+        # process_pending drains the pending set in chunks of this many keys
+        # per host, stopping early once the time budget (in seconds) is spent
+        # or the deepest of the queues process_incr is routed to (or the
+        # pending_queues, if set) holds more than pending_max_queue_depth
+        # tasks.
+        self.pending_chunk_size = pending_chunk_size
+        self.pending_time_budget = pending_time_budget
+        self.pending_max_queue_depth = pending_max_queue_depth
+        self.pending_queues = pending_queues
         assert self.pending_partitions > 0
         assert self.incr_batch_size > 0
+        assert self.pending_chunk_size > 0
+        # the time budget must fit inside the pending lock below
+        assert 0 < self.pending_time_budget < 60
 
     def validate(self):
         try:
@@ -119,19 +143,58 @@ class RedisBuffer(Buffer):
         return result
 
     def _dump_value(self, value):
-        if isinstance(value, six.string_types):
+        if value is None:
+            return ('n', '')
+        elif isinstance(value, six.string_types):
             type_ = 's'
         elif isinstance(value, datetime):
             type_ = 'd'
             value = value.strftime('%s.%f')
-        elif isinstance(value, int):
+        elif isinstance(value, bool):
+            type_ = 'b'
+            value = int(value)
+        elif isinstance(value, six.integer_types):
             type_ = 'i'
         elif isinstance(value, float):
             type_ = 'f'
+        elif isinstance(value, (dict, list)) and self._is_json_safe(value):
+            # stored as-is, rather than as text
+            return ('j', value)
         else:
             raise TypeError(type(value))
         return (type_, six.text_type(value))
 
+    def _is_json_safe(self, value):
+        """
+        Returns whether ``value`` survives a JSON round trip unchanged.
+        """
+        if value is None or isinstance(value, six.string_types + (bool, float) + six.integer_types):
+            return True
+        if isinstance(value, list):
+            return all(self._is_json_safe(v) for v in value)
+        if isinstance(value, dict):
+            return all(
+                isinstance(k, six.string_types) and self._is_json_safe(v)
+                for k, v in six.iteritems(value)
+            )
+        return False
+
+    def _encode_filters(self, filters):
+        if self.value_encoding == 'json':
+            try:
+                return json.dumps(self._dump_values(filters))
+            except (TypeError, ValueError):
+                pass
+        return pickle.dumps(filters)
+
+    def _encode_value(self, value):
+        if self.value_encoding == 'json':
+            try:
+                return json.dumps(self._dump_value(value))
+            except (TypeError, ValueError):
+                pass
+        return pickle.dumps(value)
+
     def _load_values(self, payload):
         result = {}
         for k, (t, v) in six.iteritems(payload):
@@ -150,6 +213,12 @@ class RedisBuffer(Buffer):
             return int(value)
         elif type_ == 'f':
             return float(value)
+        elif type_ == 'b':
+            return value == '1'
+        elif type_ == 'n':
+            return None
+        elif type_ == 'j':
+            return value
         else:
             raise TypeError('invalid type: {}'.format(type_))
 
@@ -162,8 +231,6 @@ class RedisBuffer(Buffer):
             - Perform a set (last write wins) on extra
         - Add hashmap key to pending flushes
         """
-        # TODO(dcramer): longer term we'd rather not have to serialize values
-        # here (unless it's to JSON)
         key = self._make_key(model, filters)
         pending_key = self._make_pending_key_from_key(key)
         # We can't use conn.map() due to wanting to support multiple pending
@@ -172,10 +239,7 @@ class RedisBuffer(Buffer):
 
         pipe = conn.pipeline()
         pipe.hsetnx(key, 'm', '%s.%s' % (model.__module__, model.__name__))
-        # TODO(dcramer): once this goes live in production, we can kill the pickle path
-        # (this is to ensure a zero downtime deploy where we can transition event processing)
-        pipe.hsetnx(key, 'f', pickle.dumps(filters))
-        # pipe.hsetnx(key, 'f', json.dumps(self._dump_values(filters)))
+        pipe.hsetnx(key, 'f', self._encode_filters(filters))
         for column, amount in six.iteritems(columns):
             pipe.hincrby(key, 'i+' + column, amount)
 
@@ -183,11 +247,10 @@ class RedisBuffer(Buffer):
             # Group tries to serialize 'score', so we'd need some kind of processing
             # hook here
             # e.g. "update score if last_seen or times_seen is changed"
+            # Until then, values we can't type (like 'score') still go
+            # through pickle.
             for column, value in six.iteritems(extra):
-                # TODO(dcramer): once this goes live in production, we can kill the pickle path
-                # (this is to ensure a zero downtime deploy where we can transition event processing)
-                pipe.hset(key, 'e+' + column, pickle.dumps(value))
-                # pipe.hset(key, 'e+' + column, json.dumps(self._dump_value(value)))
+                pipe.hset(key, 'e+' + column, self._encode_value(value))
         pipe.expire(key, self.key_expire)
         pipe.zadd(pending_key, time(), key)
         pipe.execute()
@@ -197,6 +260,33 @@ class RedisBuffer(Buffer):
             'model': model.__name__,
         })
 
+    def _get_incr_queues(self):
+        from django.conf import settings
+        from sentry.queue.routers import get_counter_queues
+
+        if self.pending_queues is not None:
+            return self.pending_queues
+        # SplitQueueRouter spreads process_incr over the counters-* queues.
+        return get_counter_queues() or [process_incr.queue or settings.CELERY_DEFAULT_QUEUE]
+
+    def _get_incr_queue_depth(self):
+        from sentry.monitoring.queues import backend
+
+        if backend is None:
+            return None
+
+        try:
+            return max(size for _, size in backend.bulk_get_sizes(self._get_incr_queues()))
+        except Exception:
+            self.logger.warning('buffer.queue-depth.failed', exc_info=True)
+            return None
+
+    def _should_backoff(self):
+        if self.pending_max_queue_depth is None:
+            return False
+        depth = self._get_incr_queue_depth()
+        return depth is not None and depth > self.pending_max_queue_depth
+
     def process_pending(self, partition=None):
         if partition is None and self.pending_partitions > 1:
             # If we're using partitions, this one task fans out into
@@ -215,26 +305,45 @@ class RedisBuffer(Buffer):
             return
 
         pending_buffer = PendingBuffer(self.incr_batch_size)
+        deadline = time() + self.pending_time_budget
 
         try:
             keycount = 0
-            with self.cluster.all() as conn:
-                results = conn.zrange(pending_key, 0, -1)
-
-            with self.cluster.all() as conn:
-                for host_id, keys in six.iteritems(results.value):
-                    if not keys:
-                        continue
-                    keycount += len(keys)
-                    for key in keys:
-                        pending_buffer.append(key)
-                        if pending_buffer.full():
-                            process_incr.apply_async(
-                                kwargs={
-                                    'batch_keys': pending_buffer.flush(),
-                                }
-                            )
-                    conn.target([host_id]).zrem(pending_key, *keys)
+            chunks = 0
+            # Drain the oldest keys a chunk at a time from every host in
+            # parallel, rather than loading the entire set into memory. Hosts
+            # drop out once they return a partial chunk.
+            hosts = list(self.cluster.hosts)
+            while hosts:
+                if self._should_backoff():
+                    metrics.incr('buffer.pending-truncated', tags={'reason': 'backpressure'})
+                    break
+
+                with self.cluster.fanout(hosts=hosts) as conn:
+                    results = conn.zrange(pending_key, 0, self.pending_chunk_size - 1)
+
+                hosts = []
+                with self.cluster.fanout(hosts=list(results.value)) as conn:
+                    for host_id, keys in six.iteritems(results.value):
+                        if not keys:
+                            continue
+                        keycount += len(keys)
+                        for key in keys:
+                            pending_buffer.append(key)
+                            if pending_buffer.full():
+                                process_incr.apply_async(
+                                    kwargs={
+                                        'batch_keys': pending_buffer.flush(),
+                                    }
+                                )
+                        conn.target([host_id]).zrem(pending_key, *keys)
+                        if len(keys) == self.pending_chunk_size:
+                            hosts.append(host_id)
+                chunks += 1
+
+                if hosts and time() > deadline:
+                    metrics.incr('buffer.pending-truncated', tags={'reason': 'time'})
+                    break
 
             # queue up remainder of pending keys
             if not pending_buffer.empty():
@@ -243,6 +352,7 @@ class RedisBuffer(Buffer):
                 })
 
             metrics.timing('buffer.pending-size', keycount)
+            metrics.timing('buffer.pending-chunks', chunks)
         finally:
             client.delete(lock_key)
 
@@ -253,9 +363,38 @@ class RedisBuffer(Buffer):
         if key is not None:
             batch_keys = [key]
 
+        if self.batch_flush and len(batch_keys) > 1:
+            self._process_batch_incr(batch_keys)
+            return
+
         for key in batch_keys:
             self._process_single_incr(key)
 
+    def _load_incr(self, values):
+        """
+        Decodes a buffer hash into ``(model, columns, filters, extra)``.
+        """
+        model = import_string(values.pop('m'))
+        if values['f'].startswith('{'):
+            filters = self._load_values(json.loads(values.pop('f')))
+        else:
+            # legacy pickle support, and filters that can't be typed
+            filters = pickle.loads(values.pop('f'))
+
+        incr_values = {}
+        extra_values = {}
+        for k, v in six.iteritems(values):
+            if k.startswith('i+'):
+                incr_values[k[2:]] = int(v)
+            elif k.startswith('e+'):
+                if v.startswith('['):
+                    extra_values[k[2:]] = self._load_value(json.loads(v))
+                else:
+                    # legacy pickle support, and values that can't be typed
+                    extra_values[k[2:]] = pickle.loads(v)
+
+        return model, incr_values, filters, extra_values
+
     def _process_single_incr(self, key):
         client = self.cluster.get_routing_client()
         lock_key = self._make_lock_key(key)
@@ -281,25 +420,59 @@ class RedisBuffer(Buffer):
                 self.logger.debug('buffer.revoked.empty', extra={'redis_key': key})
                 return
 
-            model = import_string(values.pop('m'))
-            if values['f'].startswith('{'):
-                filters = self._load_values(json.loads(values.pop('f')))
-            else:
-                # TODO(dcramer): legacy pickle support - remove in Sentry 9.1
-                filters = pickle.loads(values.pop('f'))
-
-            incr_values = {}
-            extra_values = {}
-            for k, v in six.iteritems(values):
-                if k.startswith('i+'):
-                    incr_values[k[2:]] = int(v)
-                elif k.startswith('e+'):
-                    if v.startswith('['):
-                        extra_values[k[2:]] = self._load_value(json.loads(v))
-                    else:
-                        # TODO(dcramer): legacy pickle support - remove in Sentry 9.1
-                        extra_values[k[2:]] = pickle.loads(v)
+            model, incr_values, filters, extra_values = self._load_incr(values)
 
             super(RedisBuffer, self).process(model, incr_values, filters, extra_values)
         finally:
             client.delete(lock_key)
+
+    def _process_batch_incr(self, batch_keys):
+        """
+        Flushes a batch of keys at once: locks are taken and released in one
+        round trip, all hashes are fetched (and removed) with a single
+        pipeline per host, and the decoded increments are handed to
+        ``Buffer.process_batch`` to be merged and written together.
+        """
+        # the same key may have been queued more than once
+        batch_keys = list(OrderedDict.fromkeys(batch_keys))
+
+        with self.cluster.map() as conn:
+            locks = [
+                (key, conn.set(self._make_lock_key(key), '1', nx=True, ex=10))
+                for key in batch_keys
+            ]
+
+        keys = []
+        for key, result in locks:
+            if result.value:
+                keys.append(key)
+            else:
+                metrics.incr('buffer.revoked', tags={'reason': 'locked'}, skip_internal=False)
+                self.logger.debug('buffer.revoked.locked', extra={'redis_key': key})
+
+        if not keys:
+            return
+
+        try:
+            with self.cluster.map() as conn:
+                results = []
+                for key in keys:
+                    results.append((key, conn.hgetall(key)))
+                    conn.zrem(self._make_pending_key_from_key(key), key)
+                    conn.delete(key)
+
+            batch = []
+            for key, result in results:
+                values = result.value
+                if not values:
+                    metrics.incr('buffer.revoked', tags={'reason': 'empty'}, skip_internal=False)
+                    self.logger.debug('buffer.revoked.empty', extra={'redis_key': key})
+                    continue
+                batch.append(self._load_incr(values))
+
+            metrics.timing('buffer.batch.keys', len(keys))
+            super(RedisBuffer, self).process_batch(batch)
+        finally:
+            with self.cluster.map() as conn:
+                for key in keys:
+                    conn.delete(self._make_lock_key(key))
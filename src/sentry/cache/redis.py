@@ -8,6 +8,8 @@ sentry.cache.redis
 
 from __future__ import absolute_import
 
+import six
+
 from sentry.utils import json
 from sentry.utils.redis import get_cluster_from_options, redis_clusters
 
@@ -26,15 +28,21 @@ class CommonRedisCache(BaseCache):
         self.client = client
         BaseCache.__init__(self, **options)
 
-    def set(self, key, value, timeout, version=None, raw=False):
-        key = self.make_key(key, version=version)
+    def _encode(self, key, value, raw):
         v = json.dumps(value) if not raw else value
         if len(v) > self.max_size:
             raise ValueTooLarge('Cache key too large: %r %r' % (key, len(v)))
+        return v
+
+    def _set(self, client, key, value, timeout):
         if timeout:
-            self.client.setex(key, int(timeout), v)
+            client.setex(key, int(timeout), value)
         else:
-            self.client.set(key, v)
+            client.set(key, value)
+
+    def set(self, key, value, timeout, version=None, raw=False):
+        key = self.make_key(key, version=version)
+        self._set(self.client, key, self._encode(key, value, raw), timeout)
 
     def delete(self, key, version=None):
         key = self.make_key(key, version=version)
@@ -47,15 +55,57 @@ class CommonRedisCache(BaseCache):
             result = json.loads(result)
         return result
 
+    def _set_many(self, values, timeout):
+        pipe = self.client.pipeline(transaction=False)
+        for key, value in six.iteritems(values):
+            self._set(pipe, key, value, timeout)
+        pipe.execute()
+
+    def _get_many(self, keys):
+        return self.client.mget(keys)
+
+    def set_many(self, values, timeout, version=None, raw=False):
+        encoded = {}
+        for key, value in six.iteritems(values):
+            key = self.make_key(key, version=version)
+            encoded[key] = self._encode(key, value, raw)
+        if encoded:
+            self._set_many(encoded, timeout)
+
+    def get_many(self, keys, version=None, raw=False):
+        keys = list(keys)
+        if not keys:
+            return {}
+
+        rv = {}
+        results = self._get_many([self.make_key(key, version=version) for key in keys])
+        for key, result in zip(keys, results):
+            if result is not None:
+                rv[key] = json.loads(result) if not raw else result
+        return rv
+
 
 class RbCache(CommonRedisCache):
 
     def __init__(self, **options):
         cluster, options = get_cluster_from_options(
             'SENTRY_CACHE_OPTIONS', options)
+        self.cluster = cluster
         client = cluster.get_routing_client()
         CommonRedisCache.__init__(self, client, **options)
 
+    # The routing client does not support commands with multiple keys, so
+    # the commands are sent to every host in parallel instead.
+    def _set_many(self, values, timeout):
+        with self.cluster.map() as client:
+            for key, value in six.iteritems(values):
+                self._set(client, key, value, timeout)
+
+    def _get_many(self, keys):
+        with self.cluster.map() as client:
+            results = [client.get(key) for key in keys]
+        return [result.value for result in results]
+
 
 # Confusing legacy name for RbCache.  We don't actually have a pure redis cache
 RedisCache = RbCache
@@ -1024,6 +1024,20 @@ SENTRY_ALLOW_ORIGIN = None
 # Enable scraping of javascript context for source code
 SENTRY_SCRAPE_JAVASCRIPT_CONTEXT = True
 
+# The number of scripts (and their sourcemaps) that are fetched concurrently
+# for an event
+SENTRY_SCRAPE_JAVASCRIPT_CONCURRENCY = 5
+
+# The size (in bytes of the files they were parsed from) of the parsed
+# sources and sourcemaps that are kept in memory by every process
+SENTRY_SOURCEMAP_CACHE_SIZE = 128 * 1024 * 1024
+
+# A local directory in which the contents of release files are kept, so that
+# they do not need to be read from the file storage again. Files are stored
+# by checksum and are never removed by Sentry, they can be deleted at any
+# time.
+SENTRY_RELEASE_FILE_CACHE_DIR = None
+
 # Buffer backend
 SENTRY_BUFFER = 'sentry.buffer.Buffer'
 SENTRY_BUFFER_OPTIONS = {}
@@ -1063,12 +1077,45 @@ SENTRY_QUOTA_OPTIONS = {}
 SENTRY_RATELIMITER = 'sentry.ratelimits.base.RateLimiter'
 SENTRY_RATELIMITER_OPTIONS = {}
 
+# Probabilistic set of recently saved events, used to skip the lookup of
+# duplicate events on save (see ``sentry.seenevents.redis.RedisSeenEvents``.)
+# The default backend remembers nothing, so every event is looked up.
+SENTRY_SEEN_EVENTS = 'sentry.seenevents.base.SeenEvents'
+SENTRY_SEEN_EVENTS_OPTIONS = {}
+
 # The default value for project-level quotas
 SENTRY_DEFAULT_MAX_EVENTS_PER_MINUTE = '90%'
 
 # Snuba configuration
 SENTRY_SNUBA = os.environ.get('SNUBA', 'http://localhost:1218')
 
+# Encoding of the dictionaries stored by ``GzippedDictField`` and ``NodeField``
+# (see ``sentry.utils.codecs``.) Values in any known encoding, including the
+# legacy compressed pickles, can always be read, but versions before the codec
+# was introduced can only read the legacy format. Switch to
+# ``{'serializer': 'msgpack', 'compressor': 'zlib'}`` once every web, worker
+# and consumer process has been upgraded, then run
+# ``sentry django backfill_field_codec``. ``zstd`` compression requires the
+# ``zstandard`` package.
+SENTRY_FIELD_CODEC = {
+    'serializer': 'legacy',
+    'compressor': 'zlib',
+}
+
+# The size of the process local cache in front of the default cache, which
+# holds the rows that are looked up or created for every event (such as
+# releases and environments), and the number of seconds for which values are
+# kept in it. Changes are published through the default Redis cluster, every
+# process subscribes to them in a thread. A size of 0 disables the local cache
+# (the rows are still cached for the duration of a request or task.)
+SENTRY_LOCAL_CACHE_SIZE = 0
+SENTRY_LOCAL_CACHE_TTL = 60
+
+# The number of seconds for which every process caches the group that a hash
+# belongs to (0 disables the cache.) Changes made when issues are merged,
+# unmerged, discarded or deleted are picked up within a second.
+SENTRY_GROUPHASH_CACHE_TTL = 10
+
 # Node storage backend
 SENTRY_NODESTORE = 'sentry.nodestore.django.DjangoNodeStorage'
 SENTRY_NODESTORE_OPTIONS = {}
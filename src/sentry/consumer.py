@@ -5,6 +5,7 @@ from batching_kafka_consumer import AbstractBatchWorker
 from django.conf import settings
 
 import sentry.tasks.store as store_tasks
+from sentry import tsdb
 from sentry.utils import json
 
 
@@ -19,6 +20,10 @@ class ConsumerWorker(AbstractBatchWorker):
             topic = settings.KAFKA_TOPICS[key]['topic']
             self.dispatch[topic] = handler
 
+        # time series writes for saved events are collected across the batch
+        # and written out in ``flush_batch`` (through ``SaveBatch.flush``)
+        self.tsdb_session = tsdb.write_session()
+
     def handle_preprocess(self, message):
         data = message['data']
         event_id = data['event_id']
@@ -47,12 +52,15 @@ class ConsumerWorker(AbstractBatchWorker):
 
     def handle_save(self, message):
         data = message['data']
-        event_id = data['event_id']
-        cache_key = message['cache_key']
-        start_time = message['start_time']
-        project_id = data['project']
 
-        store_tasks._do_save_event(cache_key, data, start_time, event_id, project_id)
+        # events are saved together in ``flush_batch``
+        return {
+            'cache_key': message['cache_key'],
+            'data': data,
+            'start_time': message['start_time'],
+            'event_id': data['event_id'],
+            'project_id': data['project'],
+        }
 
     def process_message(self, message):
         topic = message.topic()
@@ -63,7 +71,10 @@ class ConsumerWorker(AbstractBatchWorker):
         return handler(message)
 
     def flush_batch(self, batch):
-        pass
+        store_tasks._do_save_event_batch(
+            [event for event in batch if event is not None],
+            tsdb_session=self.tsdb_session,
+        )
 
     def shutdown(self):
-        pass
+        self.tsdb_session.flush()
@@ -15,8 +15,7 @@ from django.conf import settings
 from django.db.models import TextField
 
 from sentry.db.models.utils import Creator
-from sentry.utils.compat import pickle
-from sentry.utils.strings import decompress, compress
+from sentry.utils.codecs import get_field_codec
 
 __all__ = ('GzippedDictField', )
 
@@ -27,6 +26,8 @@ class GzippedDictField(TextField):
     """
     Slightly different from a JSONField in the sense that the default
     value is a dictionary.
+
+    Values are encoded with the codec configured by ``SENTRY_FIELD_CODEC``.
     """
 
     def contribute_to_class(self, cls, name):
@@ -40,7 +41,7 @@ class GzippedDictField(TextField):
     def to_python(self, value):
         if isinstance(value, six.string_types) and value:
             try:
-                value = pickle.loads(decompress(value))
+                value = get_field_codec().decode(value)
             except Exception as e:
                 logger.exception(e)
                 return {}
@@ -56,7 +57,7 @@ class GzippedDictField(TextField):
         if isinstance(value, six.binary_type):
             value = six.text_type(value)
         # db values need to be in unicode
-        return compress(pickle.dumps(value))
+        return get_field_codec().encode(value)
 
     def value_to_string(self, obj):
         value = self._get_val_from_obj(obj)
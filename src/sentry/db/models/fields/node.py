@@ -21,8 +21,7 @@ from django.db.models.signals import post_delete
 
 from sentry import nodestore
 from sentry.utils.cache import memoize
-from sentry.utils.compat import pickle
-from sentry.utils.strings import decompress, compress
+from sentry.utils.codecs import get_field_codec
 from sentry.utils.canonical import CANONICAL_TYPES, CanonicalKeyDict
 
 from .gzippeddict import GzippedDictField
@@ -189,11 +188,10 @@ class NodeField(GzippedDictField):
     def to_python(self, value):
         node_id = None
         # If value is a string, we assume this is a value we've loaded from the
-        # database, it should be decompressed/unpickled, and we should end up
-        # with a dict.
+        # database, it should be decoded, and we should end up with a dict.
         if value and isinstance(value, six.string_types):
             try:
-                value = pickle.loads(decompress(value))
+                value = get_field_codec().decode(value)
             except Exception as e:
                 # TODO this is a bit dangerous as a failure to read/decode the
                 # node_id will end up with this record being replaced with an
@@ -236,7 +234,7 @@ class NodeField(GzippedDictField):
             value.id = self.id_func()
 
         value.save()
-        return compress(pickle.dumps({'node_id': value.id}))
+        return get_field_codec().encode({'node_id': value.id})
 
 
 if hasattr(models, 'SubfieldBase'):
@@ -11,15 +11,15 @@ from __future__ import absolute_import
 import itertools
 import six
 
-from django.db import IntegrityError, router, transaction
-from django.db.models import Model, Q
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import AutoField, ForeignKey, Model, Q
 from django.db.models.expressions import CombinedExpression
 from django.db.models.signals import post_save
 from six.moves import reduce
 
 from .utils import resolve_combined_expression
 
-__all__ = ('update', 'create_or_update')
+__all__ = ('update', 'create_or_update', 'bulk_increment')
 
 
 def update(self, using=None, **kwargs):
@@ -101,6 +101,112 @@ def create_or_update(model, using=None, **kwargs):
     return affected, False
 
 
+def _get_cast_type(field, connection):
+    # serial types are not valid in a cast, so resolve them (and any foreign
+    # key pointing at them) to the underlying integer type
+    if isinstance(field, ForeignKey):
+        return _get_cast_type(field.rel.get_related_field(), connection)
+    if isinstance(field, AutoField):
+        if field.get_internal_type() == 'BigIntegerField':
+            return 'bigint'
+        return 'integer'
+    return field.db_type(connection)
+
+
+def bulk_increment(model, rows, using=None, expressions=None):
+    """
+    Applies many ``create_or_update`` style increments to existing rows using
+    a single ``UPDATE ... FROM (VALUES ...)`` statement. PostgreSQL only.
+
+    ``rows`` is a sequence of ``(filters, columns, extra)`` tuples which must
+    all share the same filter, column and extra names. Values in ``columns``
+    are added to the current value, values in ``extra`` replace it. Each row
+    should target a distinct database row.
+
+    ``expressions`` maps additional column names to SQL templates, which may
+    refer to the current row as ``{t[column]}`` and to the incoming values as
+    ``{v[column]}``.
+
+    Returns the set of indexes into ``rows`` that matched an existing row.
+    Rows that did not match anything are not created.
+
+    >>> bulk_increment(Group, [
+    >>>     ({'id': 1}, {'times_seen': 2}, {'last_seen': now}),
+    >>>     ({'id': 2}, {'times_seen': 1}, {'last_seen': now}),
+    >>> ])
+    """
+    if not rows:
+        return set()
+
+    if not using:
+        using = router.db_for_write(model)
+
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    opts = model._meta
+
+    filters, columns, extra = rows[0]
+    names = (
+        [('f', n) for n in sorted(filters)] +
+        [('c', n) for n in sorted(columns)] +
+        [('e', n) for n in sorted(extra or ())]
+    )
+
+    fields = []
+    for kind, name in names:
+        field = opts.pk if name == 'pk' else opts.get_field(name)
+        fields.append((kind, name, field, '%s%d' % (kind, len(fields))))
+
+    placeholder = '(%s)' % ', '.join(
+        ['%s::integer'] + ['%%s::%s' % _get_cast_type(f, connection) for _, _, f, _ in fields]
+    )
+
+    params = []
+    for idx, (filters, columns, extra) in enumerate(rows):
+        params.append(idx)
+        for kind, name, field, _ in fields:
+            if kind == 'f':
+                value = filters[name]
+            elif kind == 'c':
+                value = columns[name]
+            else:
+                value = extra[name]
+            if isinstance(value, Model):
+                value = value.pk
+            params.append(field.get_db_prep_save(value, connection=connection))
+
+    t = {name: 't.%s' % qn(field.column) for _, name, field, _ in fields}
+    v = {name: 'v.%s' % alias for kind, name, _, alias in fields if kind != 'f'}
+
+    assignments = []
+    for kind, name, field, alias in fields:
+        if kind == 'c':
+            assignments.append('%s = t.%s + v.%s' % (qn(field.column), qn(field.column), alias))
+        elif kind == 'e':
+            assignments.append('%s = v.%s' % (qn(field.column), alias))
+    for name, template in sorted(six.iteritems(expressions or {})):
+        column = opts.get_field(name).column
+        assignments.append('%s = %s' % (qn(column), template.format(t=t, v=v)))
+
+    sql = 'UPDATE %s AS t SET %s FROM (VALUES %s) AS v(%s) WHERE %s RETURNING v.idx' % (
+        qn(opts.db_table),
+        ', '.join(assignments),
+        ', '.join([placeholder] * len(rows)),
+        ', '.join(['idx'] + [alias for _, _, _, alias in fields]),
+        ' AND '.join(
+            't.%s = v.%s' % (qn(field.column), alias)
+            for kind, _, field, alias in fields if kind == 'f'
+        ),
+    )
+
+    cursor = connection.cursor()
+    try:
+        cursor.execute(sql, params)
+        return set(r[0] for r in cursor.fetchall())
+    finally:
+        cursor.close()
+
+
 def in_iexact(column, values):
     """Operator to test if any of the given values are (case-insentive) matches
        to values in the given column."""
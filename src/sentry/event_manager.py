@@ -19,7 +19,7 @@ from django.db.models import Func
 from django.utils import timezone
 from django.utils.encoding import force_text
 
-from sentry import buffer, eventtypes, eventstream, features, tagstore, tsdb
+from sentry import buffer, eventtypes, eventstream, features, seenevents, tagstore, tsdb
 from sentry.constants import (
     DEFAULT_STORE_NORMALIZER_ARGS, LOG_LEVELS, LOG_LEVELS_MAP,
     MAX_TAG_VALUE_LENGTH, MAX_SECS_IN_FUTURE, MAX_SECS_IN_PAST,
@@ -192,6 +192,83 @@ class HashDiscarded(Exception):
     pass
 
 
+class SaveBatch(object):
+    """
+    State shared by a batch of events that are saved together (see
+    ``sentry.tasks.store._do_save_event_batch``.)
+
+    Projects (with their organizations), releases and environments are only
+    resolved once per batch, and group hashes that already belong to a group
+    or a tombstone are remembered for the rest of the batch, so that events
+    of the same issue only look up their hashes once. Time series writes are
+    collected in ``tsdb_session``, and both the session and the buffer are
+    written out by ``flush``.
+    """
+
+    def __init__(self, tsdb_session=None):
+        self.tsdb_session = tsdb_session if tsdb_session is not None else tsdb.write_session()
+        self._projects = {}
+        self._releases = {}
+        self._environments = {}
+        self._grouphashes = {}
+
+    def get_project(self, project_id):
+        project = self._projects.get(project_id)
+        if project is None:
+            project = Project.objects.get_from_cache(id=project_id)
+            project._organization_cache = Organization.objects.get_from_cache(
+                id=project.organization_id)
+            self._projects[project_id] = project
+        return project
+
+    def get_release(self, project, version, date_added):
+        key = (project.id, version)
+        release = self._releases.get(key)
+        if release is None:
+            release = self._releases[key] = Release.get_or_create(
+                project=project,
+                version=version,
+                date_added=date_added,
+            )
+        return release
+
+    def get_environment(self, project, name):
+        key = (project.id, name)
+        environment = self._environments.get(key)
+        if environment is None:
+            environment = self._environments[key] = Environment.get_or_create(
+                project=project,
+                name=name,
+            )
+        return environment
+
+    def find_hashes(self, project, hash_list, find):
+        """
+        Return the ``GroupHash`` of every hash in ``hash_list``, using ``find``
+        to look up the hashes that are not known to belong to a group yet.
+        """
+        found = {}
+        missing = [hash for hash in hash_list if (project.id, hash) not in self._grouphashes]
+        if missing:
+            for grouphash in find(project, missing):
+                found[grouphash.hash] = grouphash
+                if grouphash.group_id is not None or grouphash.group_tombstone_id is not None:
+                    self._grouphashes[(project.id, grouphash.hash)] = grouphash
+        return [self._grouphashes.get((project.id, hash)) or found[hash] for hash in hash_list]
+
+    def forget_hashes(self, project, hash_list):
+        """
+        Drop the remembered ``GroupHash`` of every hash in ``hash_list``, so
+        that the next ``find_hashes`` looks them up again.
+        """
+        for hash in hash_list:
+            self._grouphashes.pop((project.id, hash), None)
+
+    def flush(self):
+        self.tsdb_session.flush()
+        buffer.flush()
+
+
 class ScoreClause(Func):
     def __init__(self, group=None, last_seen=None, times_seen=None, *args, **kwargs):
         self.group = group
@@ -292,6 +369,7 @@ class EventManager(object):
         self._is_renormalize = is_renormalize
         self._remove_other = remove_other
         self._normalized = False
+        self._batch = None
         self.relay_config = relay_config
 
     def process_csp_report(self):
@@ -493,7 +571,14 @@ class EventManager(object):
 
         return trim(message.strip(), settings.SENTRY_MAX_MESSAGE_LENGTH)
 
-    def save(self, project_id, raw=False, assume_normalized=False):
+    def save(self, project_id, raw=False, assume_normalized=False, tsdb_session=None,
+             batch=None):
+        """
+        Saves the event. When a ``tsdb_session`` (see ``tsdb.write_session``)
+        is provided, time series writes are collected there instead of being
+        written immediately. When the event is saved as part of a
+        ``SaveBatch``, the batch's session is used.
+        """
         # Normalize if needed
         if not self._normalized:
             if not assume_normalized:
@@ -502,23 +587,46 @@ class EventManager(object):
 
         data = self._data
 
-        project = Project.objects.get_from_cache(id=project_id)
-        project._organization_cache = Organization.objects.get_from_cache(
-            id=project.organization_id)
+        self._batch = batch
+        if batch is not None:
+            tsdb_session = batch.tsdb_session
+            project = batch.get_project(project_id)
+        else:
+            project = Project.objects.get_from_cache(id=project_id)
+            project._organization_cache = Organization.objects.get_from_cache(
+                id=project.organization_id)
 
         # Check to make sure we're not about to do a bunch of work that's
         # already been done if we've processed an event with this ID. (This
         # isn't a perfect solution -- this doesn't handle ``EventMapping`` and
         # there's a race condition between here and when the event is actually
-        # saved, but it's an improvement. See GH-7677.)
+        # saved, but it's an improvement. See GH-7677.) Events that were not
+        # saved recently are not looked up at all. If the filter can not be
+        # read the event may have been seen, so it is looked up.
         try:
-            event = Event.objects.get(
-                project_id=project.id,
-                event_id=data['event_id'],
-            )
-        except Event.DoesNotExist:
-            pass
+            may_contain = seenevents.may_contain(project.id, data['event_id'])
+        except Exception:
+            logger.warning('seenevents.may-contain-failed', exc_info=True)
+            metrics.incr('events.seen_filter', tags={'result': 'error'}, skip_internal=True)
+            may_contain = True
+
+        if not may_contain:
+            metrics.incr('events.seen_filter', tags={'result': 'miss'}, skip_internal=True)
+            event = None
         else:
+            try:
+                event = Event.objects.get(
+                    project_id=project.id,
+                    event_id=data['event_id'],
+                )
+            except Event.DoesNotExist:
+                metrics.incr('events.seen_filter', tags={'result': 'false_positive'},
+                             skip_internal=True)
+                event = None
+            else:
+                metrics.incr('events.seen_filter', tags={'result': 'hit'}, skip_internal=True)
+
+        if event is not None:
             # Make sure we cache on the project before returning
             event._project_cache = project
             logger.info(
@@ -582,11 +690,14 @@ class EventManager(object):
         if release:
             # dont allow a conflicting 'release' tag
             pop_tag(data, 'release')
-            release = Release.get_or_create(
-                project=project,
-                version=release,
-                date_added=date,
-            )
+            if batch is not None:
+                release = batch.get_release(project, release, date)
+            else:
+                release = Release.get_or_create(
+                    project=project,
+                    version=release,
+                    date_added=date,
+                )
             set_tag(data, 'sentry:release', release.version)
 
         if dist and release:
@@ -731,10 +842,13 @@ class EventManager(object):
                 )
                 return event
 
-        environment = Environment.get_or_create(
-            project=project,
-            name=environment,
-        )
+        if batch is not None:
+            environment = batch.get_environment(project, environment)
+        else:
+            environment = Environment.get_or_create(
+                project=project,
+                name=environment,
+            )
 
         group_environment, is_new_group_environment = GroupEnvironment.get_or_create(
             group_id=group.id,
@@ -774,7 +888,9 @@ class EventManager(object):
         if release:
             counters.append((tsdb.models.release, release.id))
 
-        tsdb.incr_multi(counters, timestamp=event.datetime, environment_id=environment.id)
+        tsdb_writer = tsdb_session if tsdb_session is not None else tsdb
+
+        tsdb_writer.incr_multi(counters, timestamp=event.datetime, environment_id=environment.id)
 
         frequencies = [
             # (tsdb.models.frequent_projects_by_organization, {
@@ -803,7 +919,7 @@ class EventManager(object):
                 })
             )
 
-        tsdb.record_frequency_multi(frequencies, timestamp=event.datetime)
+        tsdb_writer.record_frequency_multi(frequencies, timestamp=event.datetime)
 
         UserReport.objects.filter(
             project=project,
@@ -839,6 +955,21 @@ class EventManager(object):
                 )
                 return event
 
+            try:
+                seenevents.add(project.id, event_id)
+            except Exception:
+                # A later duplicate of this event is then only caught by the
+                # unique constraint on ``Event``.
+                logger.warning(
+                    'seenevents.add-failed',
+                    exc_info=True,
+                    extra={
+                        'event_uuid': event_id,
+                        'project_id': project.id,
+                    }
+                )
+                metrics.incr('events.seen_filter.add_failed', skip_internal=True)
+
             tagstore.delay_index_event_tags(
                 organization_id=project.organization_id,
                 project_id=project.id,
@@ -850,7 +981,7 @@ class EventManager(object):
             )
 
         if event_user:
-            tsdb.record_multi(
+            tsdb_writer.record_multi(
                 (
                     (tsdb.models.users_affected_by_group, group.id, (event_user.tag_value, )),
                     (tsdb.models.users_affected_by_project, project.id, (event_user.tag_value, )),
@@ -964,32 +1095,47 @@ class EventManager(object):
         return euser
 
     def _find_hashes(self, project, hash_list):
-        return map(
-            lambda hash: GroupHash.objects.get_or_create(
-                project=project,
-                hash=hash,
-            )[0],
-            hash_list,
-        )
+        return GroupHash.get_or_create_many(project, hash_list)
 
-    def _save_aggregate(self, event, hashes, release, **kwargs):
-        project = event.project
+    def _find_batched_hashes(self, project, hash_list):
+        if self._batch is not None:
+            return self._batch.find_hashes(project, hash_list, self._find_hashes)
+        return self._find_hashes(project, hash_list)
 
-        # attempt to find a matching hash
-        all_hashes = self._find_hashes(project, hashes)
-
-        existing_group_id = None
+    def _get_existing_group_id(self, all_hashes):
         for h in all_hashes:
             if h.group_id is not None:
-                existing_group_id = h.group_id
-                break
+                return h.group_id
             if h.group_tombstone_id is not None:
                 raise HashDiscarded('Matches group tombstone %s' % h.group_tombstone_id)
+        return None
+
+    def _save_aggregate(self, event, hashes, release, **kwargs):
+        project = event.project
+
+        # attempt to find a matching hash
+        all_hashes = self._find_batched_hashes(project, hashes)
+
+        existing_group_id = self._get_existing_group_id(all_hashes)
+        group = None
+        if existing_group_id is not None:
+            try:
+                group = Group.objects.get(id=existing_group_id)
+            except Group.DoesNotExist:
+                # The group of the hashes was deleted (or merged away) after
+                # the hashes were cached, so look them up in the database.
+                GroupHash.invalidate_cache(project.id)
+                if self._batch is not None:
+                    self._batch.forget_hashes(project, hashes)
+                all_hashes = self._find_batched_hashes(project, hashes)
+                existing_group_id = self._get_existing_group_id(all_hashes)
+                if existing_group_id is not None:
+                    group = Group.objects.get(id=existing_group_id)
 
         # XXX(dcramer): this has the opportunity to create duplicate groups
         # it should be resolved by the hash merging function later but this
         # should be better tested/reviewed
-        if existing_group_id is None:
+        if group is None:
             # it's possible the release was deleted between
             # when we queried for the release and now, so
             # make sure it still exists
@@ -1013,8 +1159,6 @@ class EventManager(object):
             )
 
         else:
-            group = Group.objects.get(id=existing_group_id)
-
             group_is_new = False
 
         # If all hashes are brand new we treat this event as new
@@ -1035,6 +1179,10 @@ class EventManager(object):
             ).exclude(
                 state=GroupHash.State.LOCKED_IN_MIGRATION,
             ).update(group=group)
+            # Later events of the batch must not use the instances that were
+            # just rewritten.
+            if self._batch is not None:
+                self._batch.forget_hashes(project, [h.hash for h in new_hashes])
 
             if group_is_new and len(new_hashes) == len(all_hashes):
                 is_new = True
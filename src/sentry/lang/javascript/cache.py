@@ -1,10 +1,13 @@
 from __future__ import absolute_import, print_function
 
+import threading
+
+from collections import OrderedDict
 from six import text_type
 from symbolic import SourceView
 from sentry.utils.strings import codec_lookup
 
-__all__ = ['SourceCache', 'SourceMapCache']
+__all__ = ['SourceCache', 'SourceMapCache', 'ViewCache']
 
 
 def is_utf8(codec):
@@ -12,6 +15,20 @@ def is_utf8(codec):
     return name in ('utf-8', 'ascii')
 
 
+def make_source_view(source, encoding=None):
+    if isinstance(source, text_type):
+        source = source.encode('utf-8')
+    # If an encoding is provided and it's not utf-8 compatible
+    # we try to re-encoding the source and create a source view
+    # from it.
+    elif encoding is not None and not is_utf8(encoding):
+        try:
+            source = source.decode(encoding).encode('utf-8')
+        except UnicodeError:
+            pass
+    return SourceView.from_bytes(source)
+
+
 class SourceCache(object):
     def __init__(self):
         self._cache = {}
@@ -42,17 +59,7 @@ class SourceCache(object):
         url = self._get_canonical_url(url)
 
         if not isinstance(source, SourceView):
-            if isinstance(source, text_type):
-                source = source.encode('utf-8')
-            # If an encoding is provided and it's not utf-8 compatible
-            # we try to re-encoding the source and create a source view
-            # from it.
-            elif encoding is not None and not is_utf8(encoding):
-                try:
-                    source = source.decode(encoding).encode('utf-8')
-                except UnicodeError:
-                    pass
-            source = SourceView.from_bytes(source)
+            source = make_source_view(source, encoding)
         self._cache[url] = source
 
     def add_error(self, url, error):
@@ -84,3 +91,48 @@ class SourceMapCache(object):
             sourcemap = self.get(sourcemap_url)
             return (sourcemap_url, sourcemap)
         return (None, None)
+
+
+class ViewCache(object):
+    """
+    A thread safe LRU of parsed source and sourcemap views, that is shared by
+    all events processed in a process. It holds views of at most ``max_size``
+    bytes in total, as measured by the size of the files they were parsed
+    from.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return None
+            self._data[key] = entry
+            return entry[0]
+
+    def set(self, key, view, size):
+        if size > self.max_size:
+            return
+
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self.size -= entry[1]
+            self._data[key] = (view, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evicted) = self._data.popitem(last=False)
+                self.size -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
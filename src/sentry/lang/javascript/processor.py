@@ -3,13 +3,18 @@ from __future__ import absolute_import, print_function
 __all__ = ['JavaScriptStacktraceProcessor']
 
 import logging
+import os
 import re
 import sys
 import base64
 import six
+import tempfile
+import threading
 import zlib
 
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from django.conf import settings
+from django.db import close_old_connections
 from os.path import splitext
 from requests.utils import get_encoding_from_headers
 from six.moves.urllib.parse import urljoin, urlsplit
@@ -26,16 +31,16 @@ except ImportError:
 
 from sentry import http
 from sentry.interfaces.stacktrace import Stacktrace
-from sentry.models import EventError, ReleaseFile, Organization
+from sentry.models import EventError, File, ReleaseFile, Organization
 from sentry.utils.cache import cache
 from sentry.utils.files import compress_file
-from sentry.utils.hashlib import md5_text
+from sentry.utils.hashlib import md5_text, sha1_text
 from sentry.utils.http import is_valid_origin
 from sentry.utils.safe import get_path
 from sentry.utils import metrics
 from sentry.stacktraces.processing import StacktraceProcessor
 
-from .cache import SourceCache, SourceMapCache
+from .cache import SourceCache, SourceMapCache, ViewCache, make_source_view
 
 # number of surrounding lines (on each side) to fetch
 LINES_OF_CONTEXT = 5
@@ -64,9 +69,100 @@ CACHE_CONTROL_MIN = 60
 # the maximum number of remote resources (i.e. source files) that should be
 # fetched
 MAX_RESOURCE_FETCHES = 100
+# the number of threads (per process) that fetch remote resources for all
+# events
+FETCH_THREADS = 20
 
 logger = logging.getLogger(__name__)
 
+_fetch_executor = (None, None)
+_fetch_executor_lock = threading.Lock()
+
+# key -> ``Future`` of every fetch that is in progress in this process
+_fetches_in_flight = {}
+_fetches_in_flight_lock = threading.Lock()
+
+_view_cache = None
+
+
+def get_fetch_executor():
+    # Threads do not survive a fork, so every process gets its own pool.
+    global _fetch_executor
+    with _fetch_executor_lock:
+        pid, executor = _fetch_executor
+        if pid != os.getpid():
+            executor = ThreadPoolExecutor(max_workers=FETCH_THREADS)
+            _fetch_executor = (os.getpid(), executor)
+        return executor
+
+
+def fetch_once(key, function, *args, **kwargs):
+    """
+    Call ``function``, unless a call with the same ``key`` is already in
+    progress in another thread, in which case its result (or exception) is
+    returned instead.
+    """
+    with _fetches_in_flight_lock:
+        future = _fetches_in_flight.get(key)
+        owner = future is None
+        if owner:
+            future = _fetches_in_flight[key] = Future()
+
+    if not owner:
+        metrics.incr('sourcemaps.fetch.deduplicated', skip_internal=True)
+        return future.result()
+
+    try:
+        result = function(*args, **kwargs)
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        with _fetches_in_flight_lock:
+            del _fetches_in_flight[key]
+
+
+def get_view_cache():
+    global _view_cache
+    max_size = settings.SENTRY_SOURCEMAP_CACHE_SIZE
+    if not max_size:
+        return None
+    view_cache = _view_cache
+    if view_cache is None or view_cache.max_size != max_size:
+        view_cache = _view_cache = ViewCache(max_size)
+    return view_cache
+
+
+def get_cached_view(kind, url, body, parse, release=None, dist=None, encoding=None):
+    """
+    Return ``parse(body)``, reusing the view of an earlier event if the same
+    file was already parsed in this process. Views are keyed by the checksum
+    of the file, so a file that changed is always parsed again.
+    """
+    view_cache = get_view_cache()
+    if view_cache is None:
+        return parse(body)
+
+    key = (
+        kind, release.id if release else None, dist.id if dist else None, url, encoding,
+        sha1_text(body).hexdigest(),
+    )
+    view = view_cache.get(key)
+    if view is not None:
+        metrics.incr('sourcemaps.view_cache', tags={'kind': kind, 'result': 'hit'},
+                     skip_internal=True)
+        return view
+
+    view = parse(body)
+    view_cache.set(key, view, len(body))
+    metrics.incr('sourcemaps.view_cache', tags={'kind': kind, 'result': 'miss'},
+                 skip_internal=True)
+    metrics.timing('sourcemaps.view_cache.bytes', view_cache.size)
+    return view
+
 
 class UnparseableSourcemap(http.BadSource):
     error_type = EventError.JS_INVALID_SOURCEMAP
@@ -199,8 +295,90 @@ def discover_sourcemap(result):
     return sourcemap
 
 
+def find_release_file(release, dist, filename_idents):
+    """
+    Return the ``File`` of the release file that matches the first of
+    ``filename_idents``, or ``None``.
+    """
+    index = ReleaseFile.get_index(release.id, dist.id if dist else None)
+    if index is not None:
+        for ident in filename_idents:
+            entry = index.get(ident)
+            if entry is not None:
+                return File.objects.filter(id=entry[1]).first()
+        return None
+
+    possible_files = list(
+        ReleaseFile.objects.filter(
+            release=release,
+            dist=dist,
+            ident__in=filename_idents,
+        ).select_related('file')
+    )
+
+    if len(possible_files) == 0:
+        return None
+    elif len(possible_files) == 1:
+        return possible_files[0].file
+
+    # Pick first one that matches in priority order.
+    # This is O(N*M) but there are only ever at most 4 things here
+    # so not really worth optimizing.
+    return next((
+        rf.file
+        for ident in filename_idents
+        for rf in possible_files
+        if rf.ident == ident
+    ))
+
+
+def read_release_file(file):
+    """
+    Return the compressed and the uncompressed contents of a release file.
+
+    If ``SENTRY_RELEASE_FILE_CACHE_DIR`` is set, the contents are kept in
+    that directory (by checksum), and read from there by later calls.
+    """
+    cache_dir = settings.SENTRY_RELEASE_FILE_CACHE_DIR
+    if not cache_dir or not file.checksum:
+        with file.getfile() as fp:
+            return compress_file(fp)
+
+    path = os.path.join(cache_dir, file.checksum[:2], file.checksum)
+    try:
+        with open(path, 'rb') as fp:
+            body = fp.read()
+    except IOError:
+        pass
+    else:
+        metrics.incr('sourcemaps.release_file_disk_cache', tags={'result': 'hit'},
+                     skip_internal=True)
+        return zlib.compress(body), body
+
+    metrics.incr('sourcemaps.release_file_disk_cache', tags={'result': 'miss'},
+                 skip_internal=True)
+    with file.getfile() as fp:
+        z_body, body = compress_file(fp)
+
+    # Write to a temporary file first, so that other processes never read a
+    # partial file.
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(body)
+        os.rename(temp_path, path)
+    except (IOError, OSError):
+        logger.warning('sourcemap.disk_cache_write_failed', exc_info=True)
+
+    return z_body, body
+
+
 def fetch_release_file(filename, release, dist=None):
-    cache_key = 'releasefile:v1:%s:%s' % (release.id, md5_text(filename).hexdigest(), )
+    cache_key = 'releasefile:v2:%s:%s:%s' % (
+        release.id, ReleaseFile.get_cache_version(release.id), md5_text(filename).hexdigest(),
+    )
 
     logger.debug('Checking cache for release artifact %r (release_id=%s)', filename, release.id)
     result = cache.get(cache_key)
@@ -215,45 +393,25 @@ def fetch_release_file(filename, release, dist=None):
             'Checking database for release artifact %r (release_id=%s)', filename, release.id
         )
 
-        possible_files = list(
-            ReleaseFile.objects.filter(
-                release=release,
-                dist=dist,
-                ident__in=filename_idents,
-            ).select_related('file')
-        )
-
-        if len(possible_files) == 0:
+        file = find_release_file(release, dist, filename_idents)
+        if file is None:
             logger.debug(
                 'Release artifact %r not found in database (release_id=%s)', filename, release.id
             )
             cache.set(cache_key, -1, 60)
             return None
-        elif len(possible_files) == 1:
-            releasefile = possible_files[0]
-        else:
-            # Pick first one that matches in priority order.
-            # This is O(N*M) but there are only ever at most 4 things here
-            # so not really worth optimizing.
-            releasefile = next((
-                rf
-                for ident in filename_idents
-                for rf in possible_files
-                if rf.ident == ident
-            ))
 
         logger.debug(
-            'Found release artifact %r (id=%s, release_id=%s)', filename, releasefile.id, release.id
+            'Found release artifact %r (file_id=%s, release_id=%s)', filename, file.id, release.id
         )
         try:
             with metrics.timer('sourcemaps.release_file_read'):
-                with releasefile.file.getfile() as fp:
-                    z_body, body = compress_file(fp)
+                z_body, body = read_release_file(file)
         except Exception:
             logger.error('sourcemap.compress_read_failed', exc_info=sys.exc_info())
             result = None
         else:
-            headers = {k.lower(): v for k, v in releasefile.file.headers.items()}
+            headers = {k.lower(): v for k, v in file.headers.items()}
             encoding = get_encoding_from_headers(headers)
             result = http.UrlResult(filename, headers, body, 200, encoding)
             cache.set(cache_key, (headers, z_body, 200, encoding), 3600)
@@ -414,13 +572,17 @@ def fetch_sourcemap(url, project=None, release=None, dist=None, allow_scraping=T
                 'url': '<base64>',
                 'reason': e.message,
             })
+        url_key = None
     else:
         result = fetch_file(
             url, project=project, release=release, dist=dist, allow_scraping=allow_scraping
         )
         body = result.body
+        url_key = url
     try:
-        return SourceMapView.from_json_bytes(body)
+        return get_cached_view(
+            'sourcemap', url_key, body, SourceMapView.from_json_bytes, release=release, dist=dist,
+        )
     except Exception as exc:
         # This is in debug because the product shows an error already.
         logger.debug(six.text_type(exc), exc_info=True)
@@ -493,6 +655,9 @@ class JavaScriptStacktraceProcessor(StacktraceProcessor):
         self.sourcemaps_touched = set()
         self.cache = SourceCache()
         self.sourcemaps = SourceMapCache()
+        # sourcemap URL -> (sourcemap view, error) of the sourcemaps that
+        # were fetched for this event
+        self.fetched_sourcemaps = {}
         self.release = None
         self.dist = None
 
@@ -765,22 +930,25 @@ class JavaScriptStacktraceProcessor(StacktraceProcessor):
             self.cache_source(filename)
         return self.cache.get(filename)
 
-    def cache_source(self, filename):
-        sourcemaps = self.sourcemaps
-        cache = self.cache
-
-        self.fetch_count += 1
-
-        if self.fetch_count > self.max_fetches:
-            cache.add_error(filename, {
-                'type': EventError.JS_TOO_MANY_REMOTE_SOURCES,
-            })
-            return
+    def _get_fetch_key(self, kind, url):
+        return (
+            kind, url, self.project.id, self.release.id if self.release else None,
+            self.dist.id if self.dist else None, self.allow_scraping,
+        )
 
+    def fetch_source(self, filename):
+        """
+        Fetch a script and its sourcemap, without changing any state of the
+        processor (this runs on the fetch threads.) Returns the result of the
+        script, the sourcemap URL, the sourcemap view, and the error that
+        stopped the fetch (if any.)
+        """
         # TODO: respect cache-control/max-age headers to some extent
         logger.debug('Fetching remote source %r', filename)
         try:
-            result = fetch_file(
+            result = fetch_once(
+                self._get_fetch_key('file', filename),
+                fetch_file,
                 filename,
                 project=self.project,
                 release=self.release,
@@ -788,32 +956,91 @@ class JavaScriptStacktraceProcessor(StacktraceProcessor):
                 allow_scraping=self.allow_scraping
             )
         except http.BadSource as exc:
-            cache.add_error(filename, exc.data)
-            return
-
-        cache.add(filename, result.body, result.encoding)
-        cache.alias(result.url, filename)
+            return None, None, None, exc.data
 
         sourcemap_url = discover_sourcemap(result)
-        if not sourcemap_url:
-            return
+        if not sourcemap_url or sourcemap_url in self.sourcemaps:
+            return result, sourcemap_url, None, None
 
-        logger.debug('Found sourcemap %r for minified script %r', sourcemap_url[:256], result.url)
-        sourcemaps.link(filename, sourcemap_url)
-        if sourcemap_url in sourcemaps:
-            return
+        # Scripts of the same event often share a sourcemap.
+        fetched = self.fetched_sourcemaps.get(sourcemap_url)
+        if fetched is not None:
+            return (result, sourcemap_url) + fetched
 
         # pull down sourcemap
         try:
-            sourcemap_view = fetch_sourcemap(
+            fetched = fetch_once(
+                self._get_fetch_key('sourcemap', sourcemap_url),
+                fetch_sourcemap,
                 sourcemap_url,
                 project=self.project,
                 release=self.release,
                 dist=self.dist,
                 allow_scraping=self.allow_scraping,
-            )
+            ), None
         except http.BadSource as exc:
-            cache.add_error(filename, exc.data)
+            fetched = None, exc.data
+
+        self.fetched_sourcemaps[sourcemap_url] = fetched
+        return (result, sourcemap_url) + fetched
+
+    def _fetch_source_in_thread(self, filename):
+        # Release files are looked up in the database, and every fetch thread
+        # holds its own connections, which would otherwise never be closed.
+        close_old_connections()
+        try:
+            return self.fetch_source(filename)
+        finally:
+            close_old_connections()
+
+    def fetch_sources(self, filenames):
+        """
+        Fetch the scripts (and their sourcemaps) in ``filenames``, at most
+        ``SENTRY_SCRAPE_JAVASCRIPT_CONCURRENCY`` at a time, and return the
+        results of ``fetch_source`` in the same order.
+        """
+        concurrency = settings.SENTRY_SCRAPE_JAVASCRIPT_CONCURRENCY
+        executor = get_fetch_executor()
+        futures = []
+        running = set()
+        for filename in filenames:
+            if len(running) >= concurrency:
+                _, running = wait(running, return_when=FIRST_COMPLETED)
+            future = executor.submit(self._fetch_source_in_thread, filename)
+            futures.append(future)
+            running.add(future)
+        return [future.result() for future in futures]
+
+    def add_source(self, filename, fetched):
+        """
+        Add the script and sourcemap returned by ``fetch_source`` to the
+        caches of this processor.
+        """
+        sourcemaps = self.sourcemaps
+        cache = self.cache
+
+        result, sourcemap_url, sourcemap_view, error = fetched
+        if result is None:
+            cache.add_error(filename, error)
+            return
+
+        cache.add(filename, get_cached_view(
+            'source', result.url, result.body,
+            lambda body: make_source_view(body, result.encoding),
+            release=self.release, dist=self.dist, encoding=result.encoding,
+        ))
+        cache.alias(result.url, filename)
+
+        if not sourcemap_url:
+            return
+
+        logger.debug('Found sourcemap %r for minified script %r', sourcemap_url[:256], result.url)
+        sourcemaps.link(filename, sourcemap_url)
+        if sourcemap_url in sourcemaps:
+            return
+
+        if error is not None:
+            cache.add_error(filename, error)
             return
 
         sourcemaps.add(sourcemap_url, sourcemap_view)
@@ -827,6 +1054,24 @@ class JavaScriptStacktraceProcessor(StacktraceProcessor):
                     source_view
                 )
 
+    def consume_fetch(self, filename):
+        """
+        Count a fetch against ``max_fetches``, and return whether it may be
+        done.
+        """
+        self.fetch_count += 1
+
+        if self.fetch_count > self.max_fetches:
+            self.cache.add_error(filename, {
+                'type': EventError.JS_TOO_MANY_REMOTE_SOURCES,
+            })
+            return False
+        return True
+
+    def cache_source(self, filename):
+        if self.consume_fetch(filename):
+            self.add_source(filename, self.fetch_source(filename))
+
     def populate_source_cache(self, frames):
         """
         Fetch all sources that we know are required (being referenced directly
@@ -849,10 +1094,14 @@ class JavaScriptStacktraceProcessor(StacktraceProcessor):
                 continue
             pending_file_list.add(f['abs_path'])
 
-        for idx, filename in enumerate(pending_file_list):
-            self.cache_source(
-                filename=filename,
-            )
+        filenames = [filename for filename in pending_file_list if self.consume_fetch(filename)]
+        if settings.SENTRY_SCRAPE_JAVASCRIPT_CONCURRENCY > 1 and len(filenames) > 1:
+            fetched = self.fetch_sources(filenames)
+        else:
+            fetched = (self.fetch_source(filename) for filename in filenames)
+
+        for filename, result in zip(filenames, fetched):
+            self.add_source(filename, result)
 
     def close(self):
         StacktraceProcessor.close(self)
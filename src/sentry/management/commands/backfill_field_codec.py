@@ -0,0 +1,105 @@
+"""
+sentry.management.commands.backfill_field_codec
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+:copyright: (c) 2010-2019 by the Sentry Team, see AUTHORS for more details.
+:license: BSD, see LICENSE for more details.
+"""
+from __future__ import absolute_import, print_function
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router
+
+from sentry.db.models.fields.gzippeddict import GzippedDictField
+from sentry.utils.codecs import FORMATS, get_field_codec
+
+
+def get_fields(labels):
+    """
+    Return ``(model, field)`` pairs for every ``GzippedDictField`` (including
+    ``NodeField``) of the given models, or of all models.
+    """
+    if labels:
+        try:
+            models = [apps.get_model(label) for label in labels]
+        except (LookupError, ValueError) as e:
+            raise CommandError(e)
+    else:
+        models = apps.get_models()
+
+    return [
+        (model, field) for model in models for field in model._meta.local_fields
+        if isinstance(field, GzippedDictField)
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Re-encode dictionary fields with the codec configured by SENTRY_FIELD_CODEC.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', metavar='app_label.Model',
+                            help='Only backfill these models (default: all models).')
+        parser.add_argument('--batch-size', dest='batch_size', type=int, default=500,
+                            help='Number of rows to read and update at a time.')
+        parser.add_argument('--dry-run', action='store_true', dest='dry_run',
+                            help='Only count the rows that would be re-encoded.')
+
+    def backfill(self, model, field, codec, batch_size, dry_run):
+        using = router.db_for_write(model)
+        connection = connections[using]
+        pk = model._meta.pk
+        sql = 'UPDATE {table} SET {column} = %s WHERE {pk} = %s AND {column} = %s'.format(
+            table=connection.ops.quote_name(model._meta.db_table),
+            column=connection.ops.quote_name(field.column),
+            pk=connection.ops.quote_name(pk.column),
+        )
+
+        queryset = model._base_manager.using(using).exclude(
+            **{'%s__isnull' % field.attname: True}
+        ).order_by('pk').values_list('pk', field.attname)
+
+        last = None
+        seen = updated = 0
+        while True:
+            page = queryset.filter(pk__gt=last) if last is not None else queryset
+            rows = list(page[:batch_size])
+            if not rows:
+                break
+            last = rows[-1][0]
+            seen += len(rows)
+
+            params = []
+            for id, value in rows:
+                if not value:
+                    continue
+                # Skip values that are already up to date, and values that
+                # are not written by the codec at all (such as sectioned
+                # nodes written by ``DjangoNodeStorage``.)
+                type = codec.get_type(value)
+                if type == codec.type or (type is not None and type not in FORMATS):
+                    continue
+                encoded = codec.encode(codec.decode(value))
+                # Values the codec pickles on purpose (because the serializer
+                # can not represent them) would be rewritten on every run.
+                if codec.get_type(encoded) == type:
+                    continue
+                params.append((encoded, id, value))
+
+            # Rows that were changed since they were read are left alone.
+            if params and not dry_run:
+                with connection.cursor() as cursor:
+                    cursor.executemany(sql, params)
+            updated += len(params)
+
+        return seen, updated
+
+    def handle(self, **options):
+        codec = get_field_codec()
+        for model, field in get_fields(options['models']):
+            seen, updated = self.backfill(
+                model, field, codec, options['batch_size'], options['dry_run'])
+            self.stdout.write('%s.%s.%s: %s of %s rows %s' % (
+                model._meta.app_label, model.__name__, field.name, updated, seen,
+                'need to be re-encoded' if options['dry_run'] else 're-encoded',
+            ))
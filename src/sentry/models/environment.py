@@ -15,7 +15,7 @@ from sentry.constants import (
     ENVIRONMENT_NAME_MAX_LENGTH
 )
 from sentry.db.models import (BoundedPositiveIntegerField, FlexibleForeignKey, Model, sane_repr)
-from sentry.utils.cache import cache
+from sentry.utils.cache import local_cache
 from sentry.utils.hashlib import md5_text
 import re
 
@@ -77,13 +77,13 @@ class Environment(Model):
 
         cache_key = cls.get_cache_key(organization_id, name)
 
-        env = cache.get(cache_key)
+        env = local_cache.get(cache_key)
         if env is None:
             env = cls.objects.get(
                 name=name,
                 organization_id=organization_id,
             )
-            cache.set(cache_key, env, 3600)
+            local_cache.set(cache_key, env, 3600)
 
         return env
 
@@ -93,13 +93,13 @@ class Environment(Model):
 
         cache_key = cls.get_cache_key(project.organization_id, name)
 
-        env = cache.get(cache_key)
+        env = local_cache.get(cache_key)
         if env is None:
             env = cls.objects.get_or_create(
                 name=name,
                 organization_id=project.organization_id,
             )[0]
-            cache.set(cache_key, env, 3600)
+            local_cache.set(cache_key, env, 3600)
 
         env.add_project(project)
 
@@ -108,7 +108,7 @@ class Environment(Model):
     def add_project(self, project, is_hidden=None):
         cache_key = 'envproj:c:%s:%s' % (self.id, project.id)
 
-        if cache.get(cache_key) is None:
+        if local_cache.get(cache_key) is None:
             try:
                 with transaction.atomic():
                     EnvironmentProject.objects.create(
@@ -116,10 +116,10 @@ class Environment(Model):
                         environment=self,
                         is_hidden=is_hidden,
                     )
-                cache.set(cache_key, 1, 3600)
+                local_cache.set(cache_key, 1, 3600)
             except IntegrityError:
                 # We've already created the object, should still cache the action.
-                cache.set(cache_key, 1, 3600)
+                local_cache.set(cache_key, 1, 3600)
 
     @staticmethod
     def get_name_from_path_segment(segment):
@@ -34,6 +34,7 @@ from sentry.db.models import (
 )
 from sentry.db.models.manager import EventManager, SnubaEventManager
 from sentry.interfaces.base import get_interfaces
+from sentry.nodestore.sectioned import SectionedData
 from sentry.utils import json
 from sentry.utils.cache import memoize
 from sentry.utils.canonical import CanonicalKeyDict, CanonicalKeyView
@@ -49,12 +50,16 @@ class EventDict(CanonicalKeyDict):
     This is used as a wrapper type for `Event.data` such that creating an event
     object (or loading it from the DB) will ensure the data fits the type
     schema.
+
+    Sectioned nodes are not re-normalized: they are only written for events
+    that were normalized when they were saved, and re-normalizing would
+    decode all of their sections.
     """
 
     def __init__(self, data, skip_renormalization=False, **kwargs):
         is_renormalized = (
-            isinstance(data, EventDict) or
-            (isinstance(data, NodeData) and isinstance(data.data, EventDict))
+            isinstance(data, (EventDict, SectionedData)) or
+            (isinstance(data, NodeData) and isinstance(data.data, (EventDict, SectionedData)))
         )
 
         if not skip_renormalization and not is_renormalized:
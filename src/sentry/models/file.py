@@ -8,14 +8,16 @@ sentry.models.file
 
 from __future__ import absolute_import
 
+import io
 import os
 import six
 import mmap
 import tempfile
 
+from collections import deque
 from hashlib import sha1
 from uuid import uuid4
-from threading import Semaphore
+from threading import Lock, Semaphore
 from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 
@@ -44,6 +46,13 @@ UPLOAD_RETRY_TIME = getattr(settings, 'SENTRY_UPLOAD_RETRY_TIME', 60)  # 1min
 DEFAULT_BLOB_SIZE = 1024 * 1024  # one mb
 CHUNK_STATE_HEADER = '__state'
 MULTI_BLOB_UPLOAD_CONCURRENCY = 8
+# The number of blobs that are fetched ahead of the blob that is being read
+# by a streaming reader
+READ_AHEAD_BLOBS = 4
+# The number of threads (per process) that fetch blobs for streaming readers
+READ_AHEAD_THREADS = 16
+# The number of blobs that are fetched concurrently into a prefetched file
+PREFETCH_CONCURRENCY = 4
 MAX_FILE_SIZE = 2 ** 31  # 2GB is the maximum offset supported by fileblob
 
 
@@ -91,6 +100,26 @@ class AssembleChecksumMismatch(Exception):
     pass
 
 
+_read_ahead_executor = (None, None)
+_read_ahead_executor_lock = Lock()
+
+
+def get_read_ahead_executor():
+    # Threads do not survive a fork, so every process gets its own pool.
+    global _read_ahead_executor
+    with _read_ahead_executor_lock:
+        pid, executor = _read_ahead_executor
+        if pid != os.getpid():
+            executor = ThreadPoolExecutor(max_workers=READ_AHEAD_THREADS)
+            _read_ahead_executor = (os.getpid(), executor)
+        return executor
+
+
+def _read_blob(blob):
+    with blob.getfile() as f:
+        return f.read()
+
+
 def get_storage():
     from sentry import options
     backend = options.get('filestore.backend')
@@ -492,6 +521,13 @@ class ChunkedFileBlobIndexWrapper(object):
         self._indexes = list(indexes)
         self._curfile = None
         self._curidx = None
+        # (index, future of the contents of its blob) of the blobs that are
+        # fetched ahead of the current one, or ``None`` if blobs are read one
+        # at a time.
+        if len(self._indexes) > 1 and READ_AHEAD_BLOBS > 0 and not prefetch:
+            self._readahead = deque()
+        else:
+            self._readahead = None
         if prefetch:
             self.prefetched = True
             self._prefetch(prefetch_to, delete)
@@ -519,6 +555,17 @@ class ChunkedFileBlobIndexWrapper(object):
         assert not self.prefetched, 'this makes no sense'
         old_file = self._curfile
         try:
+            if self._readahead is not None:
+                self._fill_readahead()
+                if self._readahead:
+                    self._curidx, future = self._readahead.popleft()
+                    self._curfile = io.BytesIO(future.result())
+                    self._fill_readahead()
+                else:
+                    self._curidx = None
+                    self._curfile = None
+                return
+
             try:
                 self._curidx = six.next(self._idxiter)
                 self._curfile = self._curidx.blob.getfile()
@@ -529,6 +576,22 @@ class ChunkedFileBlobIndexWrapper(object):
             if old_file is not None:
                 old_file.close()
 
+    def _fill_readahead(self):
+        # At most READ_AHEAD_BLOBS blobs (in addition to the current one) are
+        # held in memory.
+        executor = get_read_ahead_executor()
+        while len(self._readahead) < READ_AHEAD_BLOBS:
+            idx = next(self._idxiter, None)
+            if idx is None:
+                break
+            self._readahead.append((idx, executor.submit(_read_blob, idx.blob)))
+
+    def _clear_readahead(self):
+        if self._readahead:
+            for _, future in self._readahead:
+                future.cancel()
+            self._readahead.clear()
+
     @property
     def size(self):
         return sum(i.blob.size for i in self._indexes)
@@ -548,7 +611,7 @@ class ChunkedFileBlobIndexWrapper(object):
 
         # Zero out the file
         f.seek(size - 1)
-        f.write('\x00')
+        f.write(b'\x00')
         f.flush()
 
         mem = mmap.mmap(f.fileno(), size)
@@ -562,16 +625,30 @@ class ChunkedFileBlobIndexWrapper(object):
                     mem[offset:offset + len(chunk)] = chunk
                     offset += len(chunk)
 
-        with ThreadPoolExecutor(max_workers=4) as exe:
-            for idx in self._indexes:
-                exe.submit(fetch_file, idx.offset, idx.blob.getfile)
-
-        mem.flush()
+        try:
+            with ThreadPoolExecutor(max_workers=PREFETCH_CONCURRENCY) as exe:
+                futures = [
+                    exe.submit(fetch_file, idx.offset, idx.blob.getfile)
+                    for idx in self._indexes
+                ]
+            # Raise the first error instead of returning a partial file.
+            for future in futures:
+                future.result()
+            mem.flush()
+        except BaseException:
+            f.close()
+            if not delete:
+                os.remove(f.name)
+            raise
+        finally:
+            mem.close()
         self._curfile = f
 
     def close(self):
         if self._curfile:
             self._curfile.close()
+        if self._readahead is not None:
+            self._clear_readahead()
         self._curfile = None
         self._curidx = None
         self.closed = True
@@ -588,6 +665,8 @@ class ChunkedFileBlobIndexWrapper(object):
         for n, idx in enumerate(self._indexes[::-1]):
             if idx.offset <= pos:
                 if idx != self._curidx:
+                    if self._readahead is not None:
+                        self._clear_readahead()
                     self._idxiter = iter(self._indexes[-(n + 1):])
                     self._nextidx()
                 break
@@ -611,28 +690,29 @@ class ChunkedFileBlobIndexWrapper(object):
         if self.prefetched:
             return self._curfile.read(n)
 
-        result = bytearray()
+        # The parts are only copied once, when they are joined.
+        parts = []
 
         # Read to the end of the file
         if n < 0:
             while self._curfile is not None:
-                blob_result = self._curfile.read(32768)
+                blob_result = self._curfile.read()
                 if not blob_result:
                     self._nextidx()
                 else:
-                    result.extend(blob_result)
+                    parts.append(blob_result)
 
         # Read until a certain number of bytes are read
         else:
             while n > 0 and self._curfile is not None:
-                blob_result = self._curfile.read(min(n, 32768))
+                blob_result = self._curfile.read(n)
                 if not blob_result:
                     self._nextidx()
                 else:
                     n -= len(blob_result)
-                    result.extend(blob_result)
+                    parts.append(blob_result)
 
-        return bytes(result)
+        return b''.join(parts)
 
 
 class FileBlobOwner(Model):
@@ -9,7 +9,7 @@ from sentry.db.models import (
     Model,
     sane_repr,
 )
-from sentry.utils.cache import cache
+from sentry.utils.cache import local_cache
 
 
 class GroupEnvironment(Model):
@@ -46,14 +46,14 @@ class GroupEnvironment(Model):
     @classmethod
     def get_or_create(cls, group_id, environment_id, defaults=None):
         cache_key = cls._get_cache_key(group_id, environment_id)
-        instance = cache.get(cache_key)
+        instance = local_cache.get(cache_key)
         if instance is None:
             instance, created = cls.objects.get_or_create(
                 group_id=group_id,
                 environment_id=environment_id,
                 defaults=defaults,
             )
-            cache.set(cache_key, instance, 3600)
+            local_cache.set(cache_key, instance, 3600)
         else:
             created = False
 
@@ -61,7 +61,7 @@ class GroupEnvironment(Model):
 
 
 post_delete.connect(
-    lambda instance, **kwargs: cache.delete(
+    lambda instance, **kwargs: local_cache.delete(
         GroupEnvironment._get_cache_key(
             instance.group_id,
             instance.environment_id,
@@ -7,13 +7,154 @@ sentry.models.grouphash
 """
 from __future__ import absolute_import
 
+import logging
+import six
+import threading
+import time
+
 from django.conf import settings
-from django.db import models
+from django.db import connections, models, router
 from django.db.models.signals import post_delete
 from django.utils.translation import ugettext_lazy as _
+from uuid import uuid4
 
 from sentry.db.models import BoundedPositiveIntegerField, FlexibleForeignKey, Model
 from sentry.utils import redis
+from sentry.utils.db import is_postgres
+
+logger = logging.getLogger(__name__)
+
+
+class GroupHashCache(object):
+    """
+    A process local cache of the group (or tombstone) that the hashes of a
+    project belong to, so that events of hot issues do not have to query
+    ``GroupHash`` at all. Only hashes that belong to a group or tombstone are
+    cached.
+
+    Entries expire after ``SENTRY_GROUPHASH_CACHE_TTL`` seconds (a TTL of 0
+    disables the cache.) ``invalidate`` drops the entries of a project in this
+    process, and changes a version stored in Redis, so that other processes
+    drop theirs the next time they check it (at most every ``check_interval``
+    seconds.) Nothing is cached for a project while its version can not be
+    read.
+    """
+
+    version_ttl = 86400
+
+    def __init__(self, cluster='default', check_interval=1, max_size=10000):
+        self.cluster = cluster
+        self.check_interval = check_interval
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        # project_id -> {hash: (expires, id, group_id, group_tombstone_id)}
+        self._entries = {}
+        # project_id -> (version, time of the last check)
+        self._versions = {}
+        self._size = 0
+
+    @property
+    def ttl(self):
+        return settings.SENTRY_GROUPHASH_CACHE_TTL
+
+    def _get_version_key(self, project_id):
+        return 'grouphash:v:%s' % (project_id, )
+
+    def _drop(self, project_id):
+        self._size -= len(self._entries.pop(project_id, ()))
+
+    def _get_client(self, key):
+        return redis.clusters.get(self.cluster).get_local_client_for_key(key)
+
+    def _check_version(self, project_id, now):
+        """
+        Drop the entries of a project if its version changed, and return
+        whether the entries can be used.
+        """
+        version, checked = self._versions.get(project_id, (None, 0))
+        if now - checked < self.check_interval:
+            return True
+        key = self._get_version_key(project_id)
+        try:
+            current = self._get_client(key).get(key)
+        except Exception:
+            logger.warning('grouphash-cache.version-failed', exc_info=True)
+            with self._lock:
+                self._drop(project_id)
+                self._versions.pop(project_id, None)
+            return False
+        with self._lock:
+            if current != version:
+                self._drop(project_id)
+            self._versions[project_id] = (current, now)
+        return True
+
+    def get_many(self, project_id, hash_list):
+        """
+        Return ``{hash: (id, group_id, group_tombstone_id)}`` for the hashes in
+        ``hash_list`` that are cached.
+        """
+        if not self.ttl:
+            return {}
+
+        now = time.time()
+        if not self._check_version(project_id, now):
+            return {}
+        with self._lock:
+            entries = self._entries.get(project_id)
+            if not entries:
+                return {}
+            rv = {}
+            for hash in hash_list:
+                entry = entries.get(hash)
+                if entry is not None and entry[0] > now:
+                    rv[hash] = entry[1:]
+            return rv
+
+    def set_many(self, project_id, grouphashes):
+        ttl = self.ttl
+        if not ttl:
+            return
+
+        expires = time.time() + ttl
+        with self._lock:
+            # Only cache entries of projects whose version is known.
+            if project_id not in self._versions:
+                return
+            entries = self._entries.setdefault(project_id, {})
+            for grouphash in grouphashes:
+                if grouphash.group_id is None and grouphash.group_tombstone_id is None:
+                    continue
+                if grouphash.hash not in entries:
+                    self._size += 1
+                entries[grouphash.hash] = (
+                    expires, grouphash.id, grouphash.group_id, grouphash.group_tombstone_id,
+                )
+            if self._size > self.max_size:
+                self._clear()
+
+    def invalidate(self, project_id):
+        key = self._get_version_key(project_id)
+        try:
+            self._get_client(key).set(key, uuid4().hex, ex=self.version_ttl)
+        except Exception:
+            # Other processes keep their entries until they expire.
+            logger.warning('grouphash-cache.invalidate-failed', exc_info=True)
+        with self._lock:
+            self._drop(project_id)
+            self._versions.pop(project_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        self._entries = {}
+        self._versions = {}
+        self._size = 0
+
+
+grouphash_cache = GroupHashCache()
 
 
 class GroupHash(Model):
@@ -39,6 +180,93 @@ class GroupHash(Model):
         db_table = 'sentry_grouphash'
         unique_together = (('project', 'hash'), )
 
+    @classmethod
+    def get_or_create_many(cls, project, hash_list):
+        """
+        Return the ``GroupHash`` of every hash in ``hash_list`` (in order),
+        creating the hashes that do not exist yet.
+
+        Hashes that are known to belong to a group or tombstone are returned
+        from ``grouphash_cache`` (as unsaved instances), all other hashes are
+        queried at once, and the missing ones are inserted at once.
+        """
+        rows = {
+            hash: cls(
+                id=id,
+                project_id=project.id,
+                hash=hash,
+                group_id=group_id,
+                group_tombstone_id=group_tombstone_id,
+            ) for hash, (id, group_id, group_tombstone_id)
+            in six.iteritems(grouphash_cache.get_many(project.id, hash_list))
+        }
+
+        missing = [hash for hash in set(hash_list) if hash not in rows]
+        if missing:
+            found = cls._get_or_create_many(project, missing)
+            grouphash_cache.set_many(project.id, six.itervalues(found))
+            rows.update(found)
+
+        return [rows[hash] for hash in hash_list]
+
+    @classmethod
+    def _get_or_create_many(cls, project, hash_list):
+        rows = {
+            grouphash.hash: grouphash
+            for grouphash in cls.objects.filter(project=project, hash__in=hash_list)
+        }
+
+        new = [hash for hash in hash_list if hash not in rows]
+        if not new:
+            return rows
+
+        using = router.db_for_write(cls)
+        connection = connections[using]
+
+        # ``INSERT ... ON CONFLICT`` requires PostgreSQL 9.5.
+        if not is_postgres(using) or connection.pg_version < 90500:
+            for hash in new:
+                rows[hash] = cls.objects.get_or_create(project=project, hash=hash)[0]
+            return rows
+
+        opts = cls._meta
+        qn = connection.ops.quote_name
+        project_column = qn(opts.get_field('project').column)
+        hash_column = qn(opts.get_field('hash').column)
+        sql = (
+            'INSERT INTO %s (%s, %s) VALUES %s ON CONFLICT (%s, %s) DO NOTHING RETURNING %s, %s'
+        ) % (
+            qn(opts.db_table), project_column, hash_column,
+            ', '.join(['(%s, %s)'] * len(new)),
+            project_column, hash_column, qn(opts.pk.column), hash_column,
+        )
+        params = []
+        for hash in new:
+            params.extend((project.id, hash))
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            for id, hash in cursor.fetchall():
+                rows[hash] = cls(id=id, project_id=project.id, hash=hash)
+
+        # Hashes that were inserted concurrently are not returned by the
+        # insert, so they are queried again.
+        conflicts = [hash for hash in new if hash not in rows]
+        if conflicts:
+            rows.update(
+                (grouphash.hash, grouphash)
+                for grouphash in cls.objects.filter(project=project, hash__in=conflicts)
+            )
+        return rows
+
+    @classmethod
+    def invalidate_cache(cls, project_id):
+        """
+        Drop the cached groups of the hashes of a project. This must be called
+        whenever hashes are moved to another group or tombstone, or deleted.
+        """
+        grouphash_cache.invalidate(project_id)
+
     @classmethod
     def __get_last_processed_event_id_cluster(cls):
         cluster_name = getattr(settings, 'GROUP_HASH_LAST_PROCESSED_EVENT_CLUSTER_NAME', 'default')
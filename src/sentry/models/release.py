@@ -28,7 +28,7 @@ from sentry.models import CommitFileChange
 from sentry.signals import issue_resolved
 
 from sentry.utils import metrics
-from sentry.utils.cache import cache
+from sentry.utils.cache import local_cache
 from sentry.utils.hashlib import md5_text
 from sentry.utils.retries import TimedRetryPolicy
 
@@ -111,7 +111,7 @@ class Release(Model):
     def get(cls, project, version):
         cache_key = cls.get_cache_key(project.organization_id, version)
 
-        release = cache.get(cache_key)
+        release = local_cache.get(cache_key)
         if release is None:
             try:
                 release = cls.objects.get(
@@ -121,7 +121,7 @@ class Release(Model):
                 )
             except cls.DoesNotExist:
                 release = -1
-            cache.set(cache_key, release, 300)
+            local_cache.set(cache_key, release, 300)
 
         if release == -1:
             return
@@ -137,7 +137,7 @@ class Release(Model):
 
         cache_key = cls.get_cache_key(project.organization_id, version)
 
-        release = cache.get(cache_key)
+        release = local_cache.get(cache_key)
         if release in (None, -1):
             # TODO(dcramer): if the cache result is -1 we could attempt a
             # default create here instead of default get
@@ -174,7 +174,7 @@ class Release(Model):
 
             # TODO(dcramer): upon creating a new release, check if it should be
             # the new "latest release" for this project
-            cache.set(cache_key, release, 3600)
+            local_cache.set(cache_key, release, 3600)
 
         return release
 
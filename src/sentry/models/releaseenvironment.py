@@ -4,7 +4,7 @@ from datetime import timedelta
 from django.db import models
 from django.utils import timezone
 
-from sentry.utils.cache import cache
+from sentry.utils.cache import local_cache
 from sentry.db.models import (
     BoundedPositiveIntegerField,
     FlexibleForeignKey,
@@ -43,7 +43,7 @@ class ReleaseEnvironment(Model):
     def get_or_create(cls, project, release, environment, datetime, **kwargs):
         cache_key = cls.get_cache_key(project.id, release.id, environment.id)
 
-        instance = cache.get(cache_key)
+        instance = local_cache.get(cache_key)
         if instance is None:
             instance, created = cls.objects.get_or_create(
                 release_id=release.id,
@@ -54,7 +54,7 @@ class ReleaseEnvironment(Model):
                     'last_seen': datetime,
                 }
             )
-            cache.set(cache_key, instance, 3600)
+            local_cache.set(cache_key, instance, 3600)
         else:
             created = False
 
@@ -69,5 +69,5 @@ class ReleaseEnvironment(Model):
                 last_seen=datetime,
             )
             instance.last_seen = datetime
-            cache.set(cache_key, instance, 3600)
+            local_cache.set(cache_key, instance, 3600)
         return instance
@@ -8,12 +8,83 @@ sentry.models.releasefile
 
 from __future__ import absolute_import
 
+import binascii
+import struct
+
 from django.db import models
+from django.db.models.signals import post_delete, post_save
 from six.moves.urllib.parse import urlsplit, urlunsplit
+from uuid import uuid4
 
 from sentry.db.models import BoundedPositiveIntegerField, FlexibleForeignKey, Model, sane_repr
+from sentry.utils.cache import local_cache
 from sentry.utils.hashlib import sha1_text
 
+# The maximum number of files of a release (and dist) that are indexed. The
+# index of this many files takes about 800KB.
+MAX_INDEX_SIZE = 15000
+
+# ident, release file id, file id and checksum of an indexed file
+_index_entry = struct.Struct('>20sQQ20s')
+_no_checksum = b'\x00' * 20
+
+
+class ReleaseFileIndex(object):
+    """
+    A compact index of the files of a release (and dist), that maps the ident
+    of a release file to the ids of the release file and its file, and the
+    checksum of the file.
+
+    Entries are packed in a string sorted by ident, and looked up with a
+    binary search, so that the index does not need to be decoded.
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+    def __len__(self):
+        return len(self.data) // _index_entry.size
+
+    def get(self, ident):
+        """
+        Return ``(release file id, file id, checksum)`` of the file with the
+        given ident, or ``None``.
+        """
+        key = binascii.unhexlify(ident)
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = mid * _index_entry.size
+            if self.data[offset:offset + 20] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        if lo == len(self):
+            return None
+        entry_ident, id, file_id, checksum = _index_entry.unpack_from(
+            self.data, lo * _index_entry.size)
+        if entry_ident != key:
+            return None
+        if checksum == _no_checksum:
+            checksum = None
+        else:
+            checksum = binascii.hexlify(checksum).decode('ascii')
+        return id, file_id, checksum
+
+    @classmethod
+    def build(cls, entries):
+        """
+        Build an index from ``(ident, release file id, file id, checksum)``
+        tuples.
+        """
+        return cls(b''.join(
+            _index_entry.pack(
+                binascii.unhexlify(ident), id, file_id,
+                binascii.unhexlify(checksum) if checksum else _no_checksum,
+            ) for ident, id, file_id, checksum in sorted(entries)
+        ))
+
 
 class ReleaseFile(Model):
     r"""
@@ -85,3 +156,85 @@ class ReleaseFile(Model):
         if query:
             urls.append('~' + urlunsplit(uri_relative_without_query))
         return urls
+
+    @classmethod
+    def get_cache_version(cls, release_id):
+        """
+        Return a version that changes whenever a file of the release is
+        created, changed or deleted, for the cache keys of release files.
+        """
+        cache_key = 'releasefile:version:%s' % (release_id, )
+        version = local_cache.get(cache_key)
+        if version is None:
+            # The version is unknown (or was evicted), so nothing cached with
+            # any previous version can be trusted. ``add`` does not replace a
+            # version set by a concurrent ``bump_cache_version``.
+            version = uuid4().hex[:8]
+            if not local_cache.add(cache_key, version, None):
+                version = local_cache.get(cache_key) or version
+        return version
+
+    @classmethod
+    def get_index(cls, release_id, dist_id=None):
+        """
+        Return the ``ReleaseFileIndex`` of the files of a release and dist,
+        or ``None`` if the release has too many files to be indexed.
+        """
+        cache_key = 'releasefile:index:%s:%s:%s' % (
+            release_id, dist_id or '', cls.get_cache_version(release_id),
+        )
+        data = local_cache.get(cache_key)
+        if data is None:
+            return cls.cache_index(release_id, dist_id)
+        return ReleaseFileIndex(data) if data is not False else None
+
+    @classmethod
+    def cache_index(cls, release_id, dist_id=None):
+        """
+        Build the index of the files of a release and dist, and cache it
+        until the files of the release change.
+        """
+        # The version must be read first, so that an index that misses a file
+        # which is saved concurrently is not cached with the new version.
+        cache_key = 'releasefile:index:%s:%s:%s' % (
+            release_id, dist_id or '', cls.get_cache_version(release_id),
+        )
+        entries = list(
+            cls.objects.filter(
+                release_id=release_id,
+                dist_id=dist_id,
+            ).values_list('ident', 'id', 'file_id', 'file__checksum')[:MAX_INDEX_SIZE + 1]
+        )
+
+        if len(entries) > MAX_INDEX_SIZE:
+            index = None
+            local_cache.set(cache_key, False, 3600)
+        else:
+            index = ReleaseFileIndex.build(entries)
+            local_cache.set(cache_key, index.data, 3600)
+        return index
+
+    @classmethod
+    def bump_cache_version(cls, release_id):
+        """
+        Change the cache version of a release. This is done whenever a file
+        is saved or deleted, but that happens before the transaction the
+        file is written in commits, and an index may be cached in the
+        meantime. Code that changes files in a transaction must call this
+        again after it committed.
+        """
+        # Kept until it is evicted, as it must outlive everything cached with
+        # the previous version.
+        local_cache.set('releasefile:version:%s' % (release_id, ), uuid4().hex[:8], None)
+
+
+post_save.connect(
+    lambda instance, **kwargs: ReleaseFile.bump_cache_version(instance.release_id),
+    sender=ReleaseFile,
+    weak=False,
+)
+post_delete.connect(
+    lambda instance, **kwargs: ReleaseFile.bump_cache_version(instance.release_id),
+    sender=ReleaseFile,
+    weak=False,
+)
@@ -4,7 +4,7 @@ from datetime import timedelta
 from django.db import models
 from django.utils import timezone
 
-from sentry.utils.cache import cache
+from sentry.utils.cache import local_cache
 from sentry.db.models import (BoundedPositiveIntegerField, FlexibleForeignKey, Model, sane_repr)
 
 
@@ -38,7 +38,7 @@ class ReleaseProjectEnvironment(Model):
     def get_or_create(cls, release, project, environment, datetime, **kwargs):
         cache_key = cls.get_cache_key(project.id, release.id, environment.id)
 
-        instance = cache.get(cache_key)
+        instance = local_cache.get(cache_key)
         if instance is None:
             instance, created = cls.objects.get_or_create(
                 release=release,
@@ -49,7 +49,7 @@ class ReleaseProjectEnvironment(Model):
                     'last_seen': datetime,
                 }
             )
-            cache.set(cache_key, instance, 3600)
+            local_cache.set(cache_key, instance, 3600)
         else:
             created = False
 
@@ -62,5 +62,5 @@ class ReleaseProjectEnvironment(Model):
                 last_seen=datetime,
             )
             instance.last_seen = datetime
-            cache.set(cache_key, instance, 3600)
+            local_cache.set(cache_key, instance, 3600)
         return instance
@@ -1,8 +1,12 @@
 from __future__ import absolute_import, print_function
 
 import os
+import six
 import struct
-from threading import Lock
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from six.moves.queue import Queue
+from threading import Condition, Lock
 from zlib import compress as zlib_compress, decompress as zlib_decompress
 
 from google.cloud import bigtable
@@ -11,6 +15,9 @@ from simplejson import JSONEncoder, _default_decoder
 from django.utils import timezone
 
 from sentry.nodestore.base import NodeStorage
+from sentry.nodestore.sectioned import SectionedFormat
+from sentry.utils.codecs import ZstdCodec
+from sentry.utils.iterators import chunked
 
 # Cache an instance of the encoder we want to use
 json_dumps = JSONEncoder(
@@ -26,6 +33,8 @@ json_dumps = JSONEncoder(
 
 json_loads = _default_decoder.decode
 
+sectioned_format = SectionedFormat(dumps=json_dumps, loads=json_loads)
+
 
 _connection_lock = Lock()
 _connection_cache = {}
@@ -53,6 +62,54 @@ def get_connection(project, instance, table, options):
     return _connection_cache[key]
 
 
+_executor_lock = Lock()
+_executor_cache = {}
+
+
+def get_executor(max_workers):
+    # Node storage instances are thread local, so the executors are shared
+    # here instead of being created per instance.
+    with _executor_lock:
+        executor = _executor_cache.get(max_workers)
+        if executor is None:
+            executor = _executor_cache[max_workers] = ThreadPoolExecutor(max_workers=max_workers)
+        return executor
+
+
+class ByteBudget(object):
+    """
+    Limits the number of bytes that are held at the same time. A reservation
+    that does not fit blocks until enough bytes are released, unless nothing
+    is reserved at all (so that a single large value can always proceed.)
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.closed = False
+        self._condition = Condition()
+
+    def acquire(self, size):
+        with self._condition:
+            while not self.closed and self.used and self.used + size > self.limit:
+                self._condition.wait()
+            self.used += size
+            return not self.closed
+
+    def release(self, size):
+        with self._condition:
+            self.used -= size
+            self._condition.notify_all()
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+
+_done = object()
+
+
 class BigtableNodeStorage(NodeStorage):
     """
     A Bigtable-based backend for storing node data.
@@ -62,8 +119,26 @@ class BigtableNodeStorage(NodeStorage):
     ...     instance='sentry',
     ...     table='nodestore',
     ...     default_ttl=timedelta(days=30),
-    ...     compression=True,
+    ...     compression='zstd',
+    ...     sectioned=False,
+    ...     thread_pool_size=5,
+    ...     batch_size=25,
+    ...     max_inflight_bytes=64 * 1024 * 1024,
     ... )
+
+    ``compression`` can be ``True`` (or ``'zlib'``) or ``'zstd'``, which
+    requires the ``zstandard`` package. Rows written with any compression can
+    always be read, as long as the package is installed.
+
+    With ``sectioned=True`` nodes are written in the sectioned format (see
+    ``sentry.nodestore.sectioned``), which compresses every top-level key
+    separately and is only decoded as far as it is accessed.
+
+    ``get_multi`` and ``delete_multi`` split their ids into batches of
+    ``batch_size`` rows which are sent concurrently from a pool of
+    ``thread_pool_size`` threads. Rows are decoded by the calling thread as
+    soon as they are received, and at most ``max_inflight_bytes`` of rows
+    that have been received but not yet decoded are held in memory.
     """
 
     max_size = 1024 * 1024 * 10
@@ -73,10 +148,12 @@ class BigtableNodeStorage(NodeStorage):
     data_column = b'0'
 
     _FLAG_COMPRESSED = 1 << 0
+    _FLAG_SECTIONED = 1 << 1
+    _FLAG_COMPRESSED_ZSTD = 1 << 2
 
     def __init__(self, project=None, instance='sentry', table='nodestore',
-                 automatic_expiry=False, default_ttl=None, compression=False,
-                 thread_pool_size=5,  # TODO(mattrobenolt): Remove this
+                 automatic_expiry=False, default_ttl=None, compression=False, sectioned=False,
+                 thread_pool_size=5, batch_size=25, max_inflight_bytes=64 * 1024 * 1024,
                  **kwargs):
         self.project = project
         self.instance = instance
@@ -84,7 +161,15 @@ class BigtableNodeStorage(NodeStorage):
         self.options = kwargs
         self.automatic_expiry = automatic_expiry
         self.default_ttl = default_ttl
+        if compression is True:
+            compression = 'zlib'
+        assert compression in (False, None, 'zlib', 'zstd')
         self.compression = compression
+        self.zstd = ZstdCodec() if compression == 'zstd' else None
+        self.sectioned = sectioned
+        self.thread_pool_size = thread_pool_size
+        self.batch_size = batch_size
+        self.max_inflight_bytes = max_inflight_bytes
         self.skip_deletes = automatic_expiry and '_SENTRY_CLEANUP' in os.environ
 
     @property
@@ -99,16 +184,71 @@ class BigtableNodeStorage(NodeStorage):
             id = id_list[0]
             return {id: self.get(id)}
 
-        rv = {}
+        rv = {id: None for id in id_list}
+
+        batches = list(chunked(id_list, self.batch_size))
+        if len(batches) == 1 or self.thread_pool_size <= 1:
+            for row in self._read_rows(id_list):
+                rv[row.row_key] = self.decode_row(row)
+            return rv
+
+        for row in self._read_rows_concurrently(batches):
+            rv[row.row_key] = self.decode_row(row)
+        return rv
+
+    def _read_rows(self, id_list):
         rows = RowSet()
         for id in id_list:
             rows.add_row_key(id)
-            rv[id] = None
+        return self.connection.read_rows(row_set=rows)
 
-        for row in self.connection.read_rows(row_set=rows):
-            rv[row.row_key] = self.decode_row(row)
+    def _row_size(self, row):
+        return sum(
+            len(cell.value) for cells in six.itervalues(row.cells.get(self.column_family, {}))
+            for cell in cells
+        )
 
-        return rv
+    def _read_rows_concurrently(self, batches):
+        """
+        Read every batch of ids on the thread pool, yielding rows as they are
+        received.
+        """
+        budget = ByteBudget(self.max_inflight_bytes)
+        queue = Queue()
+
+        def read(id_list):
+            try:
+                for row in self._read_rows(id_list):
+                    size = self._row_size(row)
+                    if not budget.acquire(size):
+                        break
+                    queue.put((row, size))
+            except Exception:
+                queue.put((_done, sys.exc_info()))
+            else:
+                queue.put((_done, None))
+
+        executor = get_executor(self.thread_pool_size)
+        for batch in batches:
+            executor.submit(read, batch)
+
+        pending = len(batches)
+        try:
+            while pending:
+                row, value = queue.get()
+                if row is _done:
+                    pending -= 1
+                    if value is not None:
+                        six.reraise(*value)
+                    continue
+                try:
+                    yield row
+                finally:
+                    budget.release(value)
+        finally:
+            # Stop any requests that are still running if the caller gave up
+            # early (for example because one of the requests failed.)
+            budget.close()
 
     def decode_row(self, row):
         if row is None:
@@ -143,6 +283,11 @@ class BigtableNodeStorage(NodeStorage):
         # decompress the data.
         if flags & self._FLAG_COMPRESSED:
             data = zlib_decompress(data)
+        elif flags & self._FLAG_COMPRESSED_ZSTD:
+            data = (self.zstd or ZstdCodec()).decode(data)
+
+        if flags & self._FLAG_SECTIONED:
+            return sectioned_format.decode(data)
 
         return json_loads(data)
 
@@ -151,7 +296,10 @@ class BigtableNodeStorage(NodeStorage):
         row.commit()
 
     def encode_row(self, id, data, ttl=None):
-        data = json_dumps(data)
+        if self.sectioned:
+            data = sectioned_format.encode(data)
+        else:
+            data = json_dumps(data)
 
         row = self.connection.row(id)
         # Call to delete is just a state mutation,
@@ -184,10 +332,16 @@ class BigtableNodeStorage(NodeStorage):
             )
 
         # Track flags for metadata about this row.
-        # This only flag we're tracking now is whether compression
-        # is on or not for the data column.
+        # The flags track whether (and how) the data column is
+        # compressed, and whether it is in the sectioned format.
         flags = 0
-        if self.compression:
+        if self.sectioned:
+            # Every section is already compressed on its own.
+            flags |= self._FLAG_SECTIONED
+        elif self.compression == 'zstd':
+            flags |= self._FLAG_COMPRESSED_ZSTD
+            data = self.zstd.encode(data)
+        elif self.compression:
             flags |= self._FLAG_COMPRESSED
             data = zlib_compress(data)
 
@@ -227,13 +381,23 @@ class BigtableNodeStorage(NodeStorage):
             self.delete(id_list[0])
             return
 
-        rows = []
-        for id in id_list:
-            row = self.connection.row(id)
-            row.delete()
-            rows.append(row)
+        batches = []
+        for id_batch in chunked(id_list, self.batch_size):
+            rows = []
+            for id in id_batch:
+                row = self.connection.row(id)
+                row.delete()
+                rows.append(row)
+            batches.append(rows)
+
+        if len(batches) == 1 or self.thread_pool_size <= 1:
+            for rows in batches:
+                self.connection.mutate_rows(rows)
+            return
 
-        self.connection.mutate_rows(rows)
+        executor = get_executor(self.thread_pool_size)
+        for future in [executor.submit(self.connection.mutate_rows, rows) for rows in batches]:
+            future.result()
 
     def cleanup(self, cutoff_timestamp):
         raise NotImplementedError
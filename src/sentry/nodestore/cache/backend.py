@@ -0,0 +1,181 @@
+"""
+sentry.nodestore.cache.backend
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+:copyright: (c) 2010-2019 by the Sentry Team, see AUTHORS for more details.
+:license: BSD, see LICENSE for more details.
+"""
+from __future__ import absolute_import
+
+import logging
+import six
+import threading
+
+from time import time
+
+from sentry.nodestore.base import NodeStorage
+from sentry.utils import metrics
+from sentry.utils.cache import LRUCache
+from sentry.utils.compat import pickle
+from sentry.utils.imports import import_string
+
+logger = logging.getLogger(__name__)
+
+
+# ``NodeStorage`` instances are thread local, so the in-process caches are
+# kept here to be shared by all threads.
+_local_caches = {}
+_local_caches_lock = threading.Lock()
+
+
+def get_local_cache(name, max_size):
+    with _local_caches_lock:
+        cache = _local_caches.get(name)
+        if cache is None or cache.max_size != max_size:
+            cache = _local_caches[name] = LRUCache(max_size)
+        return cache
+
+
+class CachingNodeStorage(NodeStorage):
+    """
+    A read-through cache in front of another nodestore backend.
+
+    Nodes are cached in a per-process LRU cache of ``max_size`` nodes for
+    ``local_ttl`` seconds and, if ``cache`` is set, in a shared cache (any
+    ``sentry.cache`` backend) for ``cache_ttl`` seconds. Writes go to the
+    backend first and are then written through to both tiers, deletes
+    invalidate both tiers. Other processes are not told about writes and
+    deletes, so they may return a stale node until it expires from their
+    local cache.
+
+    Nodes are cached in their pickled form (without the compression and
+    encoding used by the backends), so every read returns a new copy that
+    can be safely mutated by the caller.
+
+    >>> SENTRY_NODESTORE = 'sentry.nodestore.cache.CachingNodeStorage'
+    >>> SENTRY_NODESTORE_OPTIONS = {
+    >>>     'backend': 'sentry.nodestore.django.DjangoNodeStorage',
+    >>>     'options': {},
+    >>>     'max_size': 1000,
+    >>>     'local_ttl': 10,
+    >>>     'cache': 'sentry.cache.redis.RedisCache',
+    >>>     'cache_options': {},
+    >>>     'cache_ttl': 3600,
+    >>> }
+    """
+
+    def __init__(self, backend='sentry.nodestore.django.DjangoNodeStorage', options=None,
+                 max_size=1000, local_ttl=10, cache=None, cache_options=None,
+                 cache_ttl=60 * 60, name='default'):
+        self.backend = import_string(backend)(**(options or {}))
+        self.local_cache = get_local_cache(name, max_size)
+        self.local_ttl = local_ttl
+        if cache is not None:
+            self.shared_cache = import_string(cache)(
+                **dict({'prefix': 'nodestore'}, **(cache_options or {})))
+        else:
+            self.shared_cache = None
+        self.cache_ttl = cache_ttl
+
+    def validate(self):
+        self.backend.validate()
+
+    def setup(self):
+        self.backend.setup()
+
+    def _record(self, tier, hits, misses):
+        if hits:
+            metrics.incr('nodestore.cache.hit', amount=hits, tags={'tier': tier})
+        if misses:
+            metrics.incr('nodestore.cache.miss', amount=misses, tags={'tier': tier})
+
+    def _get_cached(self, id_list):
+        results = {}
+        missing = []
+        now = time()
+        for id in id_list:
+            entry = self.local_cache.get(id)
+            if entry is not None and entry[0] > now:
+                results[id] = entry[1]
+            else:
+                missing.append(id)
+        self._record('local', len(results), len(missing))
+
+        if self.shared_cache is not None and missing:
+            try:
+                values = self.shared_cache.get_many(missing, raw=True)
+            except Exception:
+                logger.exception('Failed to read nodes from shared cache')
+                values = {}
+            expires = now + self.local_ttl
+            for id, value in six.iteritems(values):
+                self.local_cache.set(id, (expires, value))
+                results[id] = value
+            self._record('shared', len(values), len(missing) - len(values))
+            missing = [id for id in missing if id not in values]
+
+        return {id: pickle.loads(value) for id, value in six.iteritems(results)}, missing
+
+    def _set_cached(self, values):
+        expires = time() + self.local_ttl
+        encoded = {}
+        for id, data in six.iteritems(values):
+            if data is None:
+                continue
+            value = encoded[id] = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+            self.local_cache.set(id, (expires, value))
+        if self.shared_cache is not None and encoded:
+            try:
+                self.shared_cache.set_many(encoded, self.cache_ttl, raw=True)
+            except Exception:
+                logger.exception('Failed to write nodes to shared cache')
+
+    def _delete_cached(self, id_list):
+        for id in id_list:
+            self.local_cache.delete(id)
+            if self.shared_cache is not None:
+                try:
+                    self.shared_cache.delete(id)
+                except Exception:
+                    # The node was deleted from the backend, but it may be
+                    # read from the shared cache until it expires there.
+                    logger.exception('Failed to delete node from shared cache')
+
+    def get(self, id):
+        results, missing = self._get_cached([id])
+        if not missing:
+            return results[id]
+
+        data = self.backend.get(id)
+        self._set_cached({id: data})
+        return data
+
+    def get_multi(self, id_list):
+        results, missing = self._get_cached(id_list)
+        if missing:
+            values = self.backend.get_multi(missing)
+            self._set_cached(values)
+            results.update(values)
+        return results
+
+    def set(self, id, data, ttl=None):
+        self.backend.set(id, data, ttl=ttl)
+        self._set_cached({id: data})
+
+    def set_multi(self, values):
+        self.backend.set_multi(values)
+        self._set_cached(values)
+
+    def delete(self, id):
+        self.backend.delete(id)
+        self._delete_cached([id])
+
+    def delete_multi(self, id_list):
+        self.backend.delete_multi(id_list)
+        self._delete_cached(id_list)
+
+    def generate_id(self):
+        return self.backend.generate_id()
+
+    def cleanup(self, cutoff_timestamp):
+        self.backend.cleanup(cutoff_timestamp)
@@ -9,41 +9,144 @@ sentry.nodestore.django.backend
 from __future__ import absolute_import
 
 import math
+import six
 
+from base64 import b64decode, b64encode
+from django.db import connections, router, transaction
 from django.utils import timezone
 
 from sentry.db.models import create_or_update
 from sentry.nodestore.base import NodeStorage
+from sentry.nodestore.sectioned import MAGIC, SectionedFormat
+from sentry.utils.codecs import get_field_codec
+from sentry.utils.db import is_postgres
+from sentry.utils.iterators import chunked
 
 from .models import Node
 
 
+# Sections are encoded with the codec of ``NodeField`` (see
+# ``SENTRY_FIELD_CODEC``), which also reads the zlib compressed pickles that
+# sections used to be written as.
+sectioned_format = SectionedFormat(
+    dumps=lambda value: get_field_codec().dumps(value),
+    loads=lambda value: get_field_codec().loads(value),
+    compress=False,
+)
+
+# Sectioned nodes are stored base64 encoded, like the values written by
+# ``GzippedDictField``, which never start with the same characters (see
+# ``sentry.utils.codecs``.)
+SECTIONED_PREFIX = b64encode(MAGIC).decode('ascii')
+
+
 class DjangoNodeStorage(NodeStorage):
+    """
+    Stores nodes in the ``nodestore_node`` table.
+
+    With ``sectioned=True`` nodes are written in the sectioned format (see
+    ``sentry.nodestore.sectioned``) and only the parts of a node that are
+    actually accessed are decoded. Nodes in either format can always be read.
+    """
+
+    def __init__(self, batch_size=100, sectioned=False):
+        self.batch_size = batch_size
+        self.sectioned = sectioned
+
+    def encode(self, data, connection):
+        if self.sectioned:
+            return b64encode(sectioned_format.encode(data)).decode('ascii')
+        return Node._meta.get_field('data').get_db_prep_save(data, connection=connection)
+
+    def decode(self, value):
+        if value and value.startswith(SECTIONED_PREFIX):
+            return sectioned_format.decode(b64decode(value))
+        return Node._meta.get_field('data').to_python(value)
+
     def delete(self, id):
         Node.objects.filter(id=id).delete()
 
     def get(self, id):
         try:
-            return Node.objects.get(id=id).data
+            return self.decode(Node.objects.filter(id=id).values_list('data', flat=True).get())
         except Node.DoesNotExist:
             return None
 
     def get_multi(self, id_list):
-        return {n.id: n.data for n in Node.objects.filter(id__in=id_list)}
+        if not id_list:
+            return {}
+
+        # Fetch the raw column values rather than model instances and decode
+        # them one row at a time, so that the compressed payloads of all rows
+        # are never held in memory at the same time as the decoded ones.
+        return {
+            id: self.decode(data)
+            for id, data in Node.objects.filter(id__in=id_list).values_list(
+                'id', 'data').iterator()
+        }
 
     def delete_multi(self, id_list):
         Node.objects.filter(id__in=id_list).delete()
 
     def set(self, id, data, ttl=None):
-        create_or_update(
-            Node,
-            id=id,
-            values={
-                'data': data,
-                'timestamp': timezone.now(),
-            },
+        self.set_multi({id: data})
+
+    def set_multi(self, values):
+        if not values:
+            return
+
+        using = router.db_for_write(Node)
+        connection = connections[using]
+        timestamp = timezone.now()
+
+        # ``INSERT ... ON CONFLICT`` requires PostgreSQL 9.5. (Nodes are
+        # always written in the legacy format here.)
+        if not is_postgres(using) or connection.pg_version < 90500:
+            for id, data in six.iteritems(values):
+                create_or_update(
+                    Node,
+                    id=id,
+                    values={
+                        'data': data,
+                        'timestamp': timestamp,
+                    },
+                )
+            return
+
+        opts = Node._meta
+        id_field = opts.get_field('id')
+        data_field = opts.get_field('data')
+        timestamp_field = opts.get_field('timestamp')
+
+        # Serialize and compress everything before a connection is used.
+        rows = [
+            (
+                id_field.get_db_prep_save(id, connection=connection),
+                self.encode(data, connection),
+                timestamp_field.get_db_prep_save(timestamp, connection=connection),
+            ) for id, data in six.iteritems(values)
+        ]
+
+        qn = connection.ops.quote_name
+        sql = 'INSERT INTO %s (%s, %s, %s) VALUES {} ON CONFLICT (%s) DO UPDATE SET %s' % (
+            qn(opts.db_table),
+            qn(id_field.column),
+            qn(data_field.column),
+            qn(timestamp_field.column),
+            qn(id_field.column),
+            ', '.join(
+                '{0} = EXCLUDED.{0}'.format(qn(f.column)) for f in (data_field, timestamp_field)
+            ),
         )
 
+        with transaction.atomic(using=using):
+            cursor = connection.cursor()
+            for chunk in chunked(rows, self.batch_size):
+                cursor.execute(
+                    sql.format(', '.join(['(%s, %s, %s)'] * len(chunk))),
+                    [value for row in chunk for value in row],
+                )
+
     def cleanup(self, cutoff_timestamp):
         from sentry.db.deletion import BulkDeleteQuery
 
@@ -0,0 +1,606 @@
+"""
+sentry.nodestore.filesystem.backend
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Stores nodes in local files, for single node installations that do not
+want to keep nodes in the database.
+
+Nodes are appended to the active segment file. Once it grows too large (or
+too old) it is sealed: a hash index of the keys it contains is written next
+to it, and a new segment is started. Deleting a node appends a tombstone, so
+segment files are never modified once written. Reads go through memory
+mapped segment and index files, newest segment first.
+
+Every file is named after the number of its segment and a generation, e.g.
+``00000012-0000.log`` and ``00000012-0000.idx``. Compaction rewrites the
+live records of a sealed segment into its next generation, and the index of
+the new generation is written last (atomically), so a crash leaves either
+the old or the new generation in place.
+
+Writers (in any process) are serialized with a lock file; readers never
+take it.
+
+:copyright: (c) 2010-2019 by the Sentry Team, see AUTHORS for more details.
+:license: BSD, see LICENSE for more details.
+"""
+from __future__ import absolute_import
+
+import errno
+import fcntl
+import logging
+import mmap
+import mmh3
+import os
+import re
+import six
+import struct
+import threading
+import time
+import zlib
+
+from contextlib import contextmanager
+
+from sentry.nodestore.base import NodeStorage
+from sentry.utils.codecs import get_field_codec
+from sentry.utils.dates import to_timestamp
+
+__all__ = ('FilesystemNodeStorage', )
+
+logger = logging.getLogger(__name__)
+
+# A record is the CRC32 of the rest of the record, followed by a header
+# (flags, key length, value length, write timestamp), the key and the value.
+RECORD_CRC = struct.Struct('>I')
+RECORD_HEADER = struct.Struct('>BHId')
+RECORD_PREFIX_SIZE = RECORD_CRC.size + RECORD_HEADER.size
+
+FLAG_TOMBSTONE = 1 << 0
+
+# An index is a header (magic, number of slots, number of keys, oldest and
+# newest write timestamp) followed by an open addressing hash table of
+# ``(key hash, record offset + 1)`` slots. Empty slots are all zeros.
+INDEX_MAGIC = b'SNI\x01'
+INDEX_HEADER = struct.Struct('>4sIIdd')
+INDEX_SLOT = struct.Struct('>QQ')
+
+SEGMENT_RE = re.compile(r'^(\d{8})-(\d{4})\.(log|idx)$')
+
+LOCK_NAME = 'LOCK'
+
+
+def _hash(key):
+    return mmh3.hash64(key)[0] & 0xffffffffffffffff
+
+
+def _encode_key(id):
+    if isinstance(id, six.text_type):
+        return id.encode('utf-8')
+    return id
+
+
+def encode_record(key, value, timestamp, flags=0):
+    body = RECORD_HEADER.pack(flags, len(key), len(value), timestamp) + key + value
+    return RECORD_CRC.pack(zlib.crc32(body) & 0xffffffff) + body
+
+
+def _map(path):
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return None, 0
+        return mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ), size
+
+
+def _fsync_directory(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_file(path, chunks, atomic=False):
+    target = path + '.tmp' if atomic else path
+    with open(target, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    if atomic:
+        os.rename(target, path)
+    _fsync_directory(os.path.dirname(path))
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+class Segment(object):
+    """
+    A segment log, and its index once the segment has been sealed.
+    """
+
+    def __init__(self, directory, number, generation, sealed):
+        self.number = number
+        self.generation = generation
+        self.sealed = sealed
+        self.path = os.path.join(directory, '%08d-%04d' % (number, generation))
+        self.data = None
+        self.size = 0
+        # The end of the last complete record.
+        self.end = 0
+        self.index = None
+        self.slots = 0
+        # Unsealed segments keep their index in memory.
+        self.keys = {}
+        self.count = 0
+        self.min_timestamp = None
+        self.max_timestamp = None
+
+    @property
+    def log_path(self):
+        return self.path + '.log'
+
+    @property
+    def index_path(self):
+        return self.path + '.idx'
+
+    def open(self):
+        if self.sealed:
+            self.data, self.size = _map(self.log_path)
+            self.end = self.size
+            self.index, _ = _map(self.index_path)
+            magic, self.slots, self.count, self.min_timestamp, self.max_timestamp = \
+                INDEX_HEADER.unpack_from(self.index, 0)
+            if magic != INDEX_MAGIC:
+                raise ValueError('Invalid index: %s' % (self.index_path, ))
+        else:
+            self.update()
+        return self
+
+    def update(self):
+        """
+        Map and index the records that were appended to an unsealed segment
+        since the last update. Returns the size of the file.
+        """
+        size = os.path.getsize(self.log_path)
+        if size == self.size:
+            return size
+        if size < self.end:
+            # The segment was truncated, which only happens when incomplete
+            # records are removed after a crash.
+            self.keys.clear()
+            self.end = self.count = 0
+            self.min_timestamp = self.max_timestamp = None
+
+        self.data, self.size = _map(self.log_path)
+        offset = self.end
+        while True:
+            record = self.read_record(offset)
+            if record is None:
+                break
+            _, key, _, timestamp, end = record
+            self.keys[key] = offset
+            self.count += 1
+            if self.min_timestamp is None:
+                self.min_timestamp = timestamp
+            self.max_timestamp = timestamp
+            offset = end
+        self.end = offset
+        return size
+
+    def read_record(self, offset, verify=True):
+        """
+        Return ``(flags, key, value, timestamp, end)`` for the record at
+        ``offset``, or ``None`` if there is no complete record there.
+        """
+        data = self.data
+        if data is None or offset + RECORD_PREFIX_SIZE > self.size:
+            return None
+        crc, = RECORD_CRC.unpack_from(data, offset)
+        flags, key_length, value_length, timestamp = RECORD_HEADER.unpack_from(
+            data, offset + RECORD_CRC.size)
+        start = offset + RECORD_PREFIX_SIZE
+        end = start + key_length + value_length
+        if end > self.size:
+            return None
+        if verify and zlib.crc32(data[offset + RECORD_CRC.size:end]) & 0xffffffff != crc:
+            return None
+        return flags, data[start:start + key_length], data[start + key_length:end], timestamp, end
+
+    def find(self, key, hash):
+        """
+        Return the offset of the latest record for ``key``, or ``None``.
+        """
+        if not self.sealed:
+            return self.keys.get(key)
+
+        mask = self.slots - 1
+        slot = hash & mask
+        while True:
+            slot_hash, offset = INDEX_SLOT.unpack_from(
+                self.index, INDEX_HEADER.size + slot * INDEX_SLOT.size)
+            if not offset:
+                return None
+            offset -= 1
+            if slot_hash == hash:
+                _, key_length, _, _ = RECORD_HEADER.unpack_from(
+                    self.data, offset + RECORD_CRC.size)
+                start = offset + RECORD_PREFIX_SIZE
+                if self.data[start:start + key_length] == key:
+                    return offset
+            slot = (slot + 1) & mask
+
+    def offsets(self):
+        """
+        Return the offsets of the latest record of every key.
+        """
+        if not self.sealed:
+            return list(six.itervalues(self.keys))
+
+        offsets = []
+        for slot in range(self.slots):
+            _, offset = INDEX_SLOT.unpack_from(self.index, INDEX_HEADER.size + slot * INDEX_SLOT.size)
+            if offset:
+                offsets.append(offset - 1)
+        return sorted(offsets)
+
+    def write_index(self, entries):
+        """
+        Write the index for ``entries`` (a list of ``(key, offset)`` pairs.)
+        """
+        slots = 8
+        while slots < len(entries) * 2:
+            slots *= 2
+        mask = slots - 1
+
+        timestamps = [self.read_record(offset, verify=False)[3] for _, offset in entries]
+        table = bytearray(INDEX_HEADER.size + slots * INDEX_SLOT.size)
+        INDEX_HEADER.pack_into(
+            table, 0, INDEX_MAGIC, slots, len(entries),
+            min(timestamps) if timestamps else 0.0, max(timestamps) if timestamps else 0.0,
+        )
+        for key, offset in entries:
+            hash = _hash(key)
+            slot = hash & mask
+            while INDEX_SLOT.unpack_from(table, INDEX_HEADER.size + slot * INDEX_SLOT.size)[1]:
+                slot = (slot + 1) & mask
+            INDEX_SLOT.pack_into(table, INDEX_HEADER.size + slot * INDEX_SLOT.size, hash, offset + 1)
+
+        _write_file(self.index_path, [bytes(table)], atomic=True)
+
+
+class SegmentStore(object):
+    """
+    The segments in a directory. A store is shared by all threads of a
+    process (see ``get_store``.)
+    """
+
+    def __init__(self, path, segment_size, segment_age, compaction_threshold, fsync):
+        self.path = path
+        self.segment_size = segment_size
+        self.segment_age = segment_age
+        self.compaction_threshold = compaction_threshold
+        self.fsync = fsync
+        self.sealed = []
+        self.active = None
+        self._names = None
+        self._segments = {}
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+
+        try:
+            os.makedirs(path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    @contextmanager
+    def locked(self):
+        """
+        Hold the write lock, shared by all processes using this directory.
+        """
+        with self._write_lock:
+            with open(os.path.join(self.path, LOCK_NAME), 'a') as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def refresh(self, recover=False):
+        """
+        Pick up segments that were created, sealed, compacted or removed, and
+        records that were appended to the active segment, by any process.
+
+        With ``recover`` (only when holding the write lock), remove incomplete
+        records and files left behind by writers that crashed.
+        """
+        with self._lock:
+            for attempt in range(5):
+                try:
+                    self._refresh(recover)
+                    break
+                except (IOError, OSError) as e:
+                    # A file was removed by a writer while it was listed.
+                    if e.errno != errno.ENOENT or attempt == 4:
+                        raise
+                    self._names = None
+
+    def _refresh(self, recover):
+        names = frozenset(os.listdir(self.path))
+        if names != self._names:
+            generations = {}
+            for name in names:
+                match = SEGMENT_RE.match(name)
+                if match is not None:
+                    number, generation, ext = match.groups()
+                    generations.setdefault(int(number), {}).setdefault(
+                        int(generation), set()).add(ext)
+
+            segments = {}
+            sealed = []
+            active = None
+            stale = []
+            numbers = sorted(generations)
+            for number in numbers:
+                complete = [
+                    g for g, exts in six.iteritems(generations[number]) if exts == {'log', 'idx'}
+                ]
+                if complete:
+                    key = (number, max(complete), True)
+                elif number == numbers[-1] and any(
+                        'log' in exts for exts in six.itervalues(generations[number])):
+                    key = (number, max(
+                        g for g, exts in six.iteritems(generations[number]) if 'log' in exts
+                    ), False)
+                else:
+                    key = None
+
+                for generation, exts in six.iteritems(generations[number]):
+                    if key is None or generation != key[1]:
+                        stale.extend('%08d-%04d.%s' % (number, generation, ext) for ext in exts)
+
+                if key is None:
+                    continue
+                segment = self._segments.get(key)
+                if segment is None:
+                    segment = Segment(self.path, *key).open()
+                segments[key] = segment
+                if key[2]:
+                    sealed.append(segment)
+                else:
+                    active = segment
+
+            self._segments = segments
+            self.sealed = sealed
+            self.active = active
+            self._names = names
+
+            if recover:
+                for name in stale + [n for n in names if n.endswith('.tmp')]:
+                    logger.warning('nodestore.filesystem.remove-stale-file', extra={'name': name})
+                    _unlink(os.path.join(self.path, name))
+
+        if self.active is not None:
+            size = self.active.update()
+            if recover and size > self.active.end:
+                logger.warning('nodestore.filesystem.truncate-segment', extra={
+                    'segment': self.active.log_path,
+                    'size': size,
+                    'end': self.active.end,
+                })
+                with open(self.active.log_path, 'r+b') as f:
+                    f.truncate(self.active.end)
+                self.active.update()
+
+    def lookup(self, key):
+        """
+        Return ``(flags, value)`` of the latest record for ``key``, or
+        ``None``.
+        """
+        hash = _hash(key)
+        with self._lock:
+            segments = ([self.active] if self.active is not None else []) + self.sealed[::-1]
+        for segment in segments:
+            offset = segment.find(key, hash)
+            if offset is not None:
+                flags, _, value, _, _ = segment.read_record(offset, verify=False)
+                return flags, value
+        return None
+
+    def append(self, items):
+        """
+        Append records for ``items``, a list of ``(key, value)`` pairs where a
+        value of ``None`` deletes the key.
+        """
+        with self.locked():
+            self.refresh(recover=True)
+            now = time.time()
+
+            segment = self.active
+            if segment is not None and segment.count and (
+                segment.end >= self.segment_size or
+                now - segment.min_timestamp >= self.segment_age
+            ):
+                self._seal(segment)
+                segment = None
+
+            if segment is None:
+                numbers = [s.number for s in self.sealed]
+                segment = Segment(self.path, max(numbers) + 1 if numbers else 0, 0, False)
+                open(segment.log_path, 'ab').close()
+
+            data = b''.join(
+                encode_record(key, b'', now, FLAG_TOMBSTONE) if value is None
+                else encode_record(key, value, now) for key, value in items
+            )
+            with open(segment.log_path, 'ab') as f:
+                f.write(data)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+
+            self.refresh()
+
+    def _seal(self, segment):
+        with open(segment.log_path, 'rb') as f:
+            os.fsync(f.fileno())
+        segment.write_index(list(six.iteritems(segment.keys)))
+        self.refresh()
+
+    def cleanup(self, cutoff):
+        """
+        Remove the segments that only contain records written before
+        ``cutoff`` (a POSIX timestamp), and compact the remaining segments.
+        """
+        with self.locked():
+            self.refresh(recover=True)
+            if self.active is not None and self.active.count and \
+                    self.active.max_timestamp < cutoff:
+                self._seal(self.active)
+
+            # Segments are removed strictly in order, so that tombstones are
+            # never removed before the records they delete. The newest segment
+            # is always kept, so that segment numbers are never reused.
+            for segment in self.sealed if self.active is not None else self.sealed[:-1]:
+                if segment.max_timestamp >= cutoff:
+                    break
+                # Without its log, the index is ignored.
+                _unlink(segment.log_path)
+                _unlink(segment.index_path)
+            self.refresh()
+
+            self.compact()
+
+    def compact(self):
+        """
+        Rewrite the sealed segments that mostly contain records which have
+        been overwritten or deleted (must hold the write lock.)
+        """
+        for i, segment in enumerate(self.sealed):
+            older = self.sealed[:i]
+            newer = self.sealed[i + 1:] + ([self.active] if self.active is not None else [])
+
+            live = []
+            for offset in segment.offsets():
+                flags, key, _, _, end = segment.read_record(offset, verify=False)
+                hash = _hash(key)
+                if any(s.find(key, hash) is not None for s in newer):
+                    continue
+                if flags & FLAG_TOMBSTONE and not any(
+                        s.find(key, hash) is not None for s in older):
+                    continue
+                live.append((key, offset, end))
+
+            if sum(end - offset for _, offset, end in live) >= \
+                    segment.size * self.compaction_threshold:
+                continue
+
+            if not live and i == len(self.sealed) - 1 and self.active is None:
+                # Keep the newest segment (see ``cleanup``.)
+                continue
+
+            if live:
+                compacted = Segment(self.path, segment.number, segment.generation + 1, False)
+                entries = []
+                position = 0
+                for key, offset, end in live:
+                    entries.append((key, position))
+                    position += end - offset
+                _write_file(compacted.log_path, [
+                    segment.data[offset:end] for _, offset, end in live
+                ])
+                compacted.update()
+                # Writing the index commits the new generation.
+                compacted.write_index(entries)
+
+            _unlink(segment.log_path)
+            _unlink(segment.index_path)
+
+        self.refresh()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(path, *options):
+    # Stores are shared by all threads, but not across a fork.
+    key = (os.getpid(), path) + options
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = SegmentStore(path, *options)
+        return store
+
+
+class FilesystemNodeStorage(NodeStorage):
+    """
+    Stores nodes in append-only segment files in a local directory (see
+    ``sentry.nodestore.filesystem.backend``.)
+
+    A segment is sealed after it grows beyond ``segment_size`` bytes or its
+    oldest record is ``segment_age`` seconds old. ``cleanup`` removes whole
+    segments, so nodes are kept for up to ``segment_age`` seconds longer than
+    requested. It also compacts sealed segments in which less than
+    ``compaction_threshold`` of the space is used by live nodes.
+
+    With ``fsync`` every write is flushed to disk before it returns.
+
+    >>> SENTRY_NODESTORE = 'sentry.nodestore.filesystem.FilesystemNodeStorage'
+    >>> SENTRY_NODESTORE_OPTIONS = {
+    >>>     'path': '/var/lib/sentry/nodestore',
+    >>>     'segment_size': 256 * 1024 * 1024,
+    >>>     'segment_age': 60 * 60 * 24,
+    >>> }
+    """
+
+    def __init__(self, path, segment_size=256 * 1024 * 1024, segment_age=60 * 60 * 24,
+                 compaction_threshold=0.5, fsync=False):
+        self.path = os.path.abspath(path)
+        self.options = (segment_size, segment_age, compaction_threshold, fsync)
+
+    @property
+    def store(self):
+        return get_store(self.path, *self.options)
+
+    def _decode(self, record):
+        if record is None:
+            return None
+        flags, value = record
+        if flags & FLAG_TOMBSTONE:
+            return None
+        return get_field_codec().loads(value)
+
+    def get(self, id):
+        store = self.store
+        store.refresh()
+        return self._decode(store.lookup(_encode_key(id)))
+
+    def get_multi(self, id_list):
+        store = self.store
+        store.refresh()
+        return {id: self._decode(store.lookup(_encode_key(id))) for id in id_list}
+
+    def set(self, id, data, ttl=None):
+        self.set_multi({id: data})
+
+    def set_multi(self, values):
+        codec = get_field_codec()
+        self.store.append([
+            (_encode_key(id), codec.dumps(data)) for id, data in six.iteritems(values)
+        ])
+
+    def delete(self, id):
+        self.delete_multi([id])
+
+    def delete_multi(self, id_list):
+        self.store.append([(_encode_key(id), None) for id in id_list])
+
+    def cleanup(self, cutoff_timestamp):
+        self.store.cleanup(to_timestamp(cutoff_timestamp))
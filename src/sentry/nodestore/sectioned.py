@@ -0,0 +1,209 @@
+"""
+sentry.nodestore.sectioned
+~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+A node encoding that compresses top-level keys independently, so that
+reading a single key does not require decoding the whole node.
+
+The encoded value is laid out as::
+
+    MAGIC | header length (4 bytes, big endian) | header (JSON) | sections
+
+The header lists every key (in order) with the index of the section that
+holds it, and the offset and length of every section. Each section is a
+compressed, serialized mapping of one or more keys to their values. Keys with
+large values get a section of their own, all other keys share one section.
+
+:copyright: (c) 2010-2019 by the Sentry Team, see AUTHORS for more details.
+:license: BSD, see LICENSE for more details.
+"""
+from __future__ import absolute_import
+
+import collections
+import six
+import struct
+import zlib
+
+from collections import OrderedDict
+
+from sentry.utils import json
+
+__all__ = ('SectionedFormat', 'SectionedData', 'is_sectioned')
+
+MAGIC = b'SN\x01'
+
+_header_size = struct.Struct('>I')
+
+_missing = object()
+
+
+def is_sectioned(value):
+    return value[:len(MAGIC)] == MAGIC
+
+
+class SectionedFormat(object):
+    """
+    Encodes and decodes nodes, using ``dumps`` and ``loads`` to serialize the
+    contents of each section. Sections are compressed with zlib, unless
+    ``compress`` is ``False`` (for ``dumps`` functions that compress on
+    their own, in which case ``section_size`` applies to the compressed
+    size.)
+    """
+
+    def __init__(self, dumps, loads, section_size=1024, level=6, compress=True):
+        self.dumps = dumps
+        self.loads = loads
+        self.section_size = section_size
+        self.level = level
+        self.compress = compress
+
+    def _dumps(self, value):
+        value = self.dumps(value)
+        if isinstance(value, six.text_type):
+            value = value.encode('utf-8')
+        return value
+
+    def _compress(self, payload):
+        if not self.compress:
+            return payload
+        return zlib.compress(payload, self.level)
+
+    def encode(self, data):
+        keys = []
+        sections = []
+        shared = OrderedDict()
+
+        for key, value in six.iteritems(data):
+            payload = self._dumps({key: value})
+            if len(payload) >= self.section_size:
+                keys.append((key, len(sections)))
+                sections.append(self._compress(payload))
+            else:
+                keys.append((key, None))
+                shared[key] = value
+
+        if shared:
+            index = len(sections)
+            sections.append(self._compress(self._dumps(shared)))
+            keys = [(key, index if i is None else i) for key, i in keys]
+
+        offsets = []
+        offset = 0
+        for section in sections:
+            offsets.append((offset, len(section)))
+            offset += len(section)
+
+        header = self._dumps_header({'k': keys, 's': offsets})
+        return b''.join([MAGIC, _header_size.pack(len(header)), header] + sections)
+
+    def _dumps_header(self, header):
+        header = json.dumps(header)
+        if isinstance(header, six.text_type):
+            header = header.encode('utf-8')
+        return header
+
+    def decode(self, value):
+        if not is_sectioned(value):
+            raise ValueError('Not a sectioned node')
+
+        start = len(MAGIC) + _header_size.size
+        length, = _header_size.unpack(value[len(MAGIC):start])
+        header = json.loads(value[start:start + length])
+        return SectionedData(self, value, start + length, header['k'], header['s'])
+
+    def load_section(self, value):
+        if not self.compress:
+            return self.loads(value)
+        return self.loads(zlib.decompress(value))
+
+
+class SectionedData(collections.MutableMapping):
+    """
+    A mapping backed by a sectioned node, that decodes a section the first
+    time one of its keys is accessed.
+    """
+
+    def __init__(self, format, value, body, keys, sections):
+        self._format = format
+        self._value = value
+        self._body = body
+        self._sections = sections
+        self._values = OrderedDict((key, _missing) for key, _ in keys)
+        # key -> (section index, key in the section)
+        self._sources = {key: (index, key) for key, index in keys}
+        self._loaded = set()
+
+    def _load(self, index):
+        offset, length = self._sections[index]
+        start = self._body + offset
+        section = self._format.load_section(self._value[start:start + length])
+        for key, (i, source) in list(six.iteritems(self._sources)):
+            if i == index:
+                self._values[key] = section[source]
+                del self._sources[key]
+        self._loaded.add(index)
+
+    def __getitem__(self, key):
+        value = self._values[key]
+        if value is _missing:
+            self._load(self._sources[key][0])
+            value = self._values[key]
+        return value
+
+    def __setitem__(self, key, value):
+        self._values[key] = value
+        self._sources.pop(key, None)
+
+    def __delitem__(self, key):
+        del self._values[key]
+        self._sources.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __repr__(self):
+        return '<SectionedData: %r>' % (list(self._values), )
+
+    def __reduce__(self):
+        # Unpickle (and deep copy) as a regular dictionary.
+        return (dict, (list(self.items()), ))
+
+    def copy(self):
+        rv = object.__new__(type(self))
+        rv.__dict__.update(self.__dict__)
+        rv._values = self._values.copy()
+        rv._sources = self._sources.copy()
+        rv._loaded = self._loaded.copy()
+        return rv
+
+    __copy__ = copy
+
+    def rekey(self, func):
+        """
+        Return a copy with every key replaced by ``func(key)``, without
+        decoding any sections. If several keys map to the same key, the key
+        that already had that name wins, otherwise the first one does.
+        """
+        rv = self.copy()
+        rv._values = OrderedDict()
+        rv._sources = {}
+        for key, value in six.iteritems(self._values):
+            new_key = func(key)
+            if key != new_key and new_key in rv._values:
+                continue
+            rv._values[new_key] = value
+            if key in self._sources:
+                rv._sources[new_key] = self._sources[key]
+            else:
+                rv._sources.pop(new_key, None)
+        return rv
+
+    @property
+    def decoded_sections(self):
+        return len(self._loaded)
@@ -19,12 +19,17 @@ TRIGGER_TASKS = set(
 )
 
 
+def get_counter_queues():
+    """
+    Return the names of the queues that ``COUNTER_TASKS`` are routed to.
+    """
+    return [q.name for q in current_app.conf['CELERY_QUEUES'] if q.name.startswith('counters-')]
+
+
 class SplitQueueRouter(object):
     def __init__(self):
         queues = current_app.conf['CELERY_QUEUES']
-        self.counter_queues = itertools.cycle(
-            [q.name for q in queues if q.name.startswith('counters-')]
-        )
+        self.counter_queues = itertools.cycle(get_counter_queues())
 
         self.trigger_queues = itertools.cycle(
             [q.name for q in queues if q.name.startswith('triggers-')]
@@ -0,0 +1,27 @@
+from __future__ import absolute_import
+
+from celery.signals import task_postrun, task_prerun
+from django.core.signals import request_finished, request_started
+
+from sentry.utils.cache import request_cache
+
+request_started.connect(
+    request_cache.start,
+    weak=False,
+    dispatch_uid='sentry.cache.request_cache.request_started',
+)
+request_finished.connect(
+    request_cache.finish,
+    weak=False,
+    dispatch_uid='sentry.cache.request_cache.request_finished',
+)
+task_prerun.connect(
+    request_cache.start,
+    weak=False,
+    dispatch_uid='sentry.cache.request_cache.task_prerun',
+)
+task_postrun.connect(
+    request_cache.finish,
+    weak=False,
+    dispatch_uid='sentry.cache.request_cache.task_postrun',
+)
@@ -0,0 +1,52 @@
+--[[
+
+Counter Aggregation
+===================
+
+Sums counter hash fields into a list of totals ("slots") on the server, so
+that only the aggregated values need to be returned to the client instead of
+every individual bucket.
+
+The first item passed as ``ARGV`` is the number of slots to return. It is
+followed by the fields to read from each hash provided in ``KEYS``, in the same
+order: the number of fields N to read from that hash, followed by N pairs of
+field name and (zero-based) slot index that the field value is added to.
+
+All hashes must be located on the server that the script is executed on.
+
+To sum two fields of the first hash into slot 0 and one field of the second
+hash into slot 1:
+
+    EVALSHA $SHA 2 ts:4:100:1 ts:4:101:1 2 2 1 0 5 0 1 1 1
+
+]]--
+
+local totals = {}
+for i = 1, tonumber(ARGV[1]) do
+    totals[i] = 0
+end
+
+local cursor = 2
+for _, key in ipairs(KEYS) do
+    local count = tonumber(ARGV[cursor])
+    cursor = cursor + 1
+
+    local fields = {}
+    local slots = {}
+    for i = 1, count do
+        fields[i] = ARGV[cursor]
+        slots[i] = tonumber(ARGV[cursor + 1]) + 1
+        cursor = cursor + 2
+    end
+
+    if count > 0 then
+        local values = redis.call('HMGET', key, unpack(fields))
+        for i = 1, count do
+            if values[i] then
+                totals[slots[i]] = totals[slots[i]] + tonumber(values[i])
+            end
+        end
+    end
+end
+
+return totals
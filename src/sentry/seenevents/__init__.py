@@ -0,0 +1,12 @@
+from __future__ import absolute_import
+
+from django.conf import settings
+
+from sentry.utils.services import LazyServiceWrapper
+
+from .base import SeenEvents  # NOQA
+
+backend = LazyServiceWrapper(
+    SeenEvents, settings.SENTRY_SEEN_EVENTS, settings.SENTRY_SEEN_EVENTS_OPTIONS
+)
+backend.expose(locals())
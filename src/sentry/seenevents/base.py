@@ -0,0 +1,29 @@
+"""
+sentry.seenevents.base
+~~~~~~~~~~~~~~~~~~~~~~
+
+:copyright: (c) 2010-2019 by the Sentry Team, see AUTHORS for more details.
+:license: BSD, see LICENSE for more details.
+"""
+from __future__ import absolute_import
+
+from sentry.utils.services import Service
+
+
+class SeenEvents(Service):
+    """
+    A probabilistic set of recently saved events, used to avoid looking up
+    events that can not have been saved before.
+
+    ``may_contain`` must never return ``False`` for an event that was added
+    (and that is still within the retention of the backend), but may return
+    ``True`` for events that were never added. This backend remembers nothing,
+    and therefore always returns ``True``.
+    """
+    __all__ = ('add', 'may_contain', 'validate')
+
+    def add(self, project_id, event_id):
+        pass
+
+    def may_contain(self, project_id, event_id):
+        return True
@@ -0,0 +1,79 @@
+"""
+sentry.seenevents.redis
+~~~~~~~~~~~~~~~~~~~~~~~
+
+:copyright: (c) 2010-2019 by the Sentry Team, see AUTHORS for more details.
+:license: BSD, see LICENSE for more details.
+"""
+from __future__ import absolute_import
+
+import math
+import mmh3
+import six
+
+from time import time
+
+from sentry.exceptions import InvalidConfiguration
+from sentry.seenevents.base import SeenEvents
+from sentry.utils.redis import get_cluster_from_options
+
+
+def get_filter_size(capacity, error_rate):
+    """
+    Return the number of bits and hash functions of a Bloom filter that holds
+    ``capacity`` items with a false positive rate of ``error_rate``.
+    """
+    bits = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+    hashes = max(1, int(round(bits / float(capacity) * math.log(2))))
+    return bits, hashes
+
+
+class RedisSeenEvents(SeenEvents):
+    """
+    Stores a Bloom filter per shard of projects and time window in a Redis
+    bitmap.
+
+    Events are added to the filter of the current window, and looked up in the
+    filters of the current and the previous window, so an event is remembered
+    for at least ``window`` seconds. Every filter is sized to hold
+    ``capacity`` events with a false positive rate of ``error_rate``.
+    """
+
+    def __init__(self, shards=64, window=3600, capacity=100000, error_rate=0.01, **options):
+        self.cluster, options = get_cluster_from_options('SENTRY_SEEN_EVENTS_OPTIONS', options)
+        self.shards = shards
+        self.window = window
+        self.bits, self.hashes = get_filter_size(capacity, error_rate)
+
+    def validate(self):
+        try:
+            with self.cluster.all() as client:
+                client.ping()
+        except Exception as e:
+            raise InvalidConfiguration(six.text_type(e))
+
+    def _get_key(self, project_id, bucket):
+        return 'se:%s:%s' % (project_id % self.shards, bucket)
+
+    def _get_offsets(self, project_id, event_id):
+        # Kirsch-Mitzenmacher: derive all hash functions from two hashes.
+        h1, h2 = mmh3.hash64(u'{}:{}'.format(project_id, event_id).encode('utf-8'))
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, project_id, event_id):
+        bucket = int(time() / self.window)
+        key = self._get_key(project_id, bucket)
+        with self.cluster.map() as client:
+            for offset in self._get_offsets(project_id, event_id):
+                client.setbit(key, offset, 1)
+            client.expire(key, self.window * 2)
+
+    def may_contain(self, project_id, event_id):
+        bucket = int(time() / self.window)
+        offsets = self._get_offsets(project_id, event_id)
+        with self.cluster.map() as client:
+            results = [
+                [client.getbit(self._get_key(project_id, b), offset) for offset in offsets]
+                for b in (bucket, bucket - 1)
+            ]
+        return any(all(result.value for result in bits) for bits in results)
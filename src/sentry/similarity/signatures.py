@@ -4,20 +4,34 @@ import mmh3
 
 
 class MinHashSignatureBuilder(object):
-    def __init__(self, columns, rows):
+    """
+    Builds MinHash signatures of ``columns`` values below ``rows``.
+
+    The hashes of a feature (one per column) are computed together, and kept
+    in a bounded cache of ``cache_size`` features, as the same features (such
+    as the frames of the same stack traces) are seen over and over again. A
+    signature is the column-wise minimum of the hashes of its features.
+    """
+
+    def __init__(self, columns, rows, cache_size=10000):
         self.columns = columns
         self.rows = rows
+        self.cache_size = cache_size
+        self._cache = {}
+
+    def _get_hashes(self, feature):
+        hashes = self._cache.get(feature)
+        if hashes is None:
+            rows = self.rows
+            hashes = tuple([mmh3.hash(feature, column) % rows for column in range(self.columns)])
+            if len(self._cache) >= self.cache_size:
+                self._cache.clear()
+            self._cache[feature] = hashes
+        return hashes
 
     def __call__(self, features):
-        return map(
-            lambda column: min(
-                map(
-                    lambda feature: mmh3.hash(
-                        feature,
-                        column,
-                    ) % self.rows,
-                    features,
-                ),
-            ),
-            range(self.columns),
-        )
+        # Duplicate features do not change the signature.
+        hashes = [self._get_hashes(feature) for feature in set(features)]
+        if not hashes:
+            raise ValueError('Cannot build a signature without features.')
+        return list(map(min, zip(*hashes)))
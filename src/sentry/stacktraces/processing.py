@@ -31,6 +31,7 @@ class ProcessableFrame(object):
         self.data = None
         self.cache_key = None
         self.cache_value = None
+        self.new_cache_value = None
         self.processable_frames = processable_frames
 
     def __repr__(self):
@@ -64,8 +65,10 @@ class ProcessableFrame(object):
         return self.processable_frames[last_idx]
 
     def set_cache_value(self, value):
+        # The value is written back by ``store_frame_cache``, together with
+        # the values of all other frames.
         if self.cache_key is not None:
-            cache.set(self.cache_key, value, 3600)
+            self.new_cache_value = value
             return True
         return False
 
@@ -391,10 +394,17 @@ def process_single_stacktrace(processing_task, stacktrace_info, processable_fram
 
 
 def lookup_frame_cache(keys):
-    rv = {}
-    for key in keys:
-        rv[key] = cache.get(key)
-    return rv
+    return cache.get_many(list(keys))
+
+
+def store_frame_cache(processable_frames):
+    values = {}
+    for processable_frame in processable_frames:
+        if processable_frame.new_cache_value is not None:
+            values[processable_frame.cache_key] = processable_frame.new_cache_value
+            processable_frame.new_cache_value = None
+    if values:
+        cache.set_many(values, 3600)
 
 
 def get_stacktrace_processing_task(infos, processors):
@@ -418,11 +428,13 @@ def get_stacktrace_processing_task(infos, processors):
             by_stacktrace_info.setdefault(processable_frame.stacktrace_info, []) \
                 .append(processable_frame)
             if processable_frame.cache_key is not None:
-                to_lookup[processable_frame.cache_key] = processable_frame
+                to_lookup.setdefault(processable_frame.cache_key, []) \
+                    .append(processable_frame)
 
     frame_cache = lookup_frame_cache(to_lookup)
-    for cache_key, processable_frame in six.iteritems(to_lookup):
-        processable_frame.cache_value = frame_cache.get(cache_key)
+    for cache_key, processable_frames in six.iteritems(to_lookup):
+        for processable_frame in processable_frames:
+            processable_frame.cache_value = frame_cache.get(cache_key)
 
     return StacktraceProcessingTask(
         processable_stacktraces=by_stacktrace_info, processors=by_processor
@@ -481,6 +493,8 @@ def process_stacktraces(data, make_processors=None, set_raw_stacktrace=True):
                 data.setdefault('errors', []).extend(dedup_errors(errors))
                 changed = True
 
+        store_frame_cache(processing_task.iter_processable_frames())
+
     finally:
         for processor in processors:
             processor.close()
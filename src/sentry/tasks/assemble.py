@@ -259,6 +259,12 @@ def assemble_artifacts(org_id, version, checksum, chunks, **kwargs):
                 release_file.update(file=file)
                 old_file.delete()
 
+        # Events of a new release usually arrive right after the upload. The
+        # version is bumped again as files were saved in transactions, so an
+        # index cached before those committed is not used anymore.
+        ReleaseFile.bump_cache_version(release.id)
+        ReleaseFile.cache_index(release.id, dist.id if dist else None)
+
     except AssembleArtifactsError as e:
         set_assemble_status(AssembleTask.ARTIFACTS, org_id, checksum,
                             ChunkFileState.ERROR, detail=e.message)
@@ -119,6 +119,9 @@ def merge_groups(
             transaction_id=transaction_id,
         )
 
+        # Hashes of the merged group now belong to ``new_group``.
+        GroupHash.invalidate_cache(group.project_id)
+
         if not has_more:
             # There are no more objects to merge for *this* "from" group, remove it
             # from the list of "from" groups that are being merged, and finish the
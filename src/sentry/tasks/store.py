@@ -452,7 +452,7 @@ def save_attachment(event, attachment):
 
 
 def _do_save_event(cache_key=None, data=None, start_time=None, event_id=None,
-                   project_id=None, **kwargs):
+                   project_id=None, tsdb_session=None, batch=None, **kwargs):
     """
     Saves an event to the database.
     """
@@ -507,7 +507,8 @@ def _do_save_event(cache_key=None, data=None, start_time=None, event_id=None,
     event = None
     try:
         manager = EventManager(data)
-        event = manager.save(project_id, assume_normalized=True)
+        event = manager.save(project_id, assume_normalized=True, tsdb_session=tsdb_session,
+                             batch=batch)
 
         # Always load attachments from the cache so we can later prune them.
         # Only save them if the event-attachments feature is active, though.
@@ -565,6 +566,36 @@ def _do_save_event(cache_key=None, data=None, start_time=None, event_id=None,
                 instance=data['platform'])
 
 
+def _do_save_event_batch(events, tsdb_session=None):
+    """
+    Saves a batch of events (each given as the keyword arguments for
+    ``_do_save_event``) grouped by project, sharing a ``SaveBatch``.
+
+    An event that fails to save is logged and dropped (like it is when the
+    ``save_event`` task fails), and the rest of the batch is still saved.
+    """
+    from sentry.event_manager import SaveBatch
+
+    batch = SaveBatch(tsdb_session=tsdb_session)
+    try:
+        for kwargs in sorted(events, key=lambda kwargs: kwargs['project_id']):
+            try:
+                _do_save_event(batch=batch, **kwargs)
+            except Exception:
+                error_logger.exception('save.failed', extra={
+                    'event_id': kwargs.get('event_id'),
+                    'project_id': kwargs['project_id'],
+                })
+                metrics.incr(
+                    'events.failed',
+                    tags={
+                        'reason': 'save',
+                        'stage': 'post'},
+                    skip_internal=False)
+    finally:
+        batch.flush()
+
+
 @instrumented_task(name='sentry.tasks.store.save_event', queue='events.save_event')
 def save_event(cache_key=None, data=None, start_time=None, event_id=None,
                project_id=None, **kwargs):
@@ -195,6 +195,7 @@ def migrate_events(caches, project, source_id, destination_id,
             project_id=project.id,
             hash__in=fingerprints,
         ).update(group=destination_id)
+        GroupHash.invalidate_cache(project.id)
 
         # Create activity records for the source and destination group.
         Activity.objects.create(
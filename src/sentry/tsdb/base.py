@@ -10,7 +10,7 @@ from __future__ import absolute_import
 import collections
 import six
 
-from collections import OrderedDict
+from collections import Counter, OrderedDict, defaultdict
 from datetime import timedelta
 from django.conf import settings
 from django.utils import timezone
@@ -100,9 +100,101 @@ class TSDBModel(Enum):
     servicehook_fired = 700
 
 
+class WriteSession(object):
+    """
+    Collects counter, distinct counter and frequency table writes so that they
+    can be written to the backend together when ``flush`` is called.
+
+    Writes to the same model, key and environment that fall into the same
+    buckets for every rollup are coalesced: counts are summed, distinct
+    values are unioned and frequency scores are added together.
+
+    >>> with tsdb.write_session() as session:
+    >>>     session.incr_multi([(TSDBModel.project, 1)])
+    """
+
+    def __init__(self, tsdb):
+        self.tsdb = tsdb
+        self.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def __len__(self):
+        return len(self.counters) + len(self.distinct_counters) + len(self.frequencies)
+
+    def clear(self):
+        # (model, key, environment_id, buckets) -> [timestamp, value]
+        self.counters = {}
+        self.distinct_counters = {}
+        self.frequencies = {}
+
+    def _get_entry(self, collection, model, key, timestamp, environment_id, default):
+        buckets = tuple(
+            self.tsdb.normalize_to_rollup(timestamp, rollup) for rollup in self.tsdb.rollups
+        )
+        entry_key = (model, key, environment_id, buckets)
+        entry = collection.get(entry_key)
+        if entry is None:
+            entry = collection[entry_key] = [timestamp, default()]
+        return entry
+
+    def incr_multi(self, items, timestamp=None, count=1, environment_id=None):
+        self.tsdb.validate_arguments([model for model, _ in items], [environment_id])
+
+        if timestamp is None:
+            timestamp = timezone.now()
+
+        for model, key in items:
+            entry = self._get_entry(self.counters, model, key, timestamp, environment_id, int)
+            entry[1] += count
+
+    def incr(self, model, key, timestamp=None, count=1, environment_id=None):
+        self.incr_multi([(model, key)], timestamp, count, environment_id)
+
+    def record_multi(self, items, timestamp=None, environment_id=None):
+        self.tsdb.validate_arguments([model for model, _, _ in items], [environment_id])
+
+        if timestamp is None:
+            timestamp = timezone.now()
+
+        for model, key, values in items:
+            entry = self._get_entry(
+                self.distinct_counters, model, key, timestamp, environment_id, set)
+            entry[1].update(values)
+
+    def record(self, model, key, values, timestamp=None, environment_id=None):
+        self.record_multi([(model, key, values)], timestamp, environment_id)
+
+    def record_frequency_multi(self, requests, timestamp=None, environment_id=None):
+        self.tsdb.validate_arguments([model for model, _ in requests], [environment_id])
+
+        if timestamp is None:
+            timestamp = timezone.now()
+
+        for model, request in requests:
+            for key, items in six.iteritems(request):
+                entry = self._get_entry(
+                    self.frequencies, model, key, timestamp, environment_id, Counter)
+                for member, score in six.iteritems(items):
+                    entry[1][member] += score
+
+    def flush(self):
+        if not len(self):
+            return
+        try:
+            self.tsdb.flush_write_session(self)
+        finally:
+            self.clear()
+
+
 class BaseTSDB(Service):
     __read_methods__ = frozenset([
         'get_range',
+        'get_range_rollup',
         'get_sums',
         'get_distinct_counts_series',
         'get_distinct_counts_totals',
@@ -134,6 +226,7 @@ class BaseTSDB(Service):
         'get_optimal_rollup_series',
         'get_rollups',
         'make_series',
+        'write_session',
         'models',
         'models_with_environment_support',
         'normalize_to_epoch',
@@ -313,6 +406,31 @@ class BaseTSDB(Service):
         for model, key in items:
             self.incr(model, key, timestamp, count, environment_id=environment_id)
 
+    def write_session(self):
+        """
+        Start collecting writes that are written together once the session is
+        flushed. See ``WriteSession``.
+        """
+        return WriteSession(self)
+
+    def flush_write_session(self, session):
+        """
+        Write everything collected by a ``WriteSession``.
+        """
+        for (model, key, environment_id, _), (timestamp, count) in six.iteritems(session.counters):
+            self.incr(model, key, timestamp, count, environment_id=environment_id)
+
+        for (model, key, environment_id, _), (timestamp, values) in six.iteritems(
+                session.distinct_counters):
+            self.record(model, key, values, timestamp, environment_id=environment_id)
+
+        requests = defaultdict(list)
+        for (model, key, environment_id, _), (timestamp, items) in six.iteritems(
+                session.frequencies):
+            requests[(timestamp, environment_id)].append((model, {key: dict(items)}))
+        for (timestamp, environment_id), request in six.iteritems(requests):
+            self.record_frequency_multi(request, timestamp, environment_id=environment_id)
+
     def merge(self, model, destination, sources, timestamp=None, environment_ids=None):
         """
         Transfer all counters from the source keys to the destination key.
@@ -348,6 +466,23 @@ class BaseTSDB(Service):
         )
         return sum_set
 
+    def get_range_rollup(self, model, keys, start, end, interval, rollup=None,
+                         environment_ids=None):
+        """
+        Fetch a range of data (as with ``get_range``) and roll it up using the
+        ``interval`` time (in seconds), as with ``rollup``.
+
+        >>> now = timezone.now()
+        >>> get_range_rollup(TSDBModel.group, [1, 2, 3],
+        >>>                  start=now - timedelta(days=30),
+        >>>                  end=now,
+        >>>                  interval=3600 * 24)
+        """
+        return self.rollup(
+            self.get_range(model, keys, start, end, rollup, environment_ids=environment_ids),
+            interval,
+        )
+
     def rollup(self, values, rollup):
         """
         Given a set of values (as returned from ``get_range``), roll them up
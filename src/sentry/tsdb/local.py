@@ -0,0 +1,612 @@
+"""
+sentry.tsdb.local
+~~~~~~~~~~~~~~~~~
+
+:copyright: (c) 2010-2019 by the Sentry Team, see AUTHORS for more details.
+:license: BSD, see LICENSE for more details.
+"""
+from __future__ import absolute_import
+
+import logging
+import os
+import six
+import sqlite3
+import threading
+
+from contextlib import contextmanager
+from django.utils import timezone
+
+from sentry.tsdb.base import BaseTSDB
+from sentry.tsdb.sketches import CountMinSketch, HyperLogLog, ranked
+from sentry.utils import json, metrics
+from sentry.utils.compat import pickle
+from sentry.utils.iterators import chunked
+
+logger = logging.getLogger(__name__)
+
+COUNTER, DISTINCT_COUNTER, FREQUENCY_TABLE = 'c', 'd', 'f'
+
+# SQLite limits the number of parameters of a statement to 999.
+QUERY_CHUNK_SIZE = 500
+
+SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS tsdb_meta (
+        name TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS tsdb_series (
+        id INTEGER PRIMARY KEY,
+        kind TEXT NOT NULL,
+        model INTEGER NOT NULL,
+        key TEXT NOT NULL,
+        environment_id INTEGER NOT NULL,
+        used INTEGER NOT NULL,
+        UNIQUE (kind, model, environment_id, key)
+    )
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS tsdb_series_used ON tsdb_series (used)
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS tsdb_point (
+        series_id INTEGER NOT NULL,
+        rollup INTEGER NOT NULL,
+        slot INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        value,
+        PRIMARY KEY (series_id, rollup, slot)
+    ) WITHOUT ROWID
+    ''',
+)
+
+
+def _environment(environment_id):
+    # ``None`` (all environments) must not collide with environment 0.
+    return -1 if environment_id is None else environment_id
+
+
+def _dumps(value):
+    return sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+
+def _loads(value):
+    return pickle.loads(bytes(value))
+
+
+class LocalTSDB(BaseTSDB):
+    """
+    A time series storage in a SQLite database, for single node installations
+    that do not run Redis.
+
+    All processes of the installation (web, workers and cron) open the same
+    database file at ``path``, so every process sees the writes of all
+    others, and the data survives restarts. The file is accessed through
+    memory mapped I/O (up to ``mmap_size`` bytes of it.) Without a ``path``
+    the data is kept in the memory of the process, which is only useful for
+    tests.
+
+    Every ``(model, key, environment)`` series is stored as one fixed size
+    ring buffer per rollup: the bucket of a timestamp is stored in the slot
+    ``bucket % samples``, replacing any older bucket in that slot, so the size
+    of a series is bounded by the rollup configuration. Distinct counters are
+    stored as HyperLogLogs and frequency tables as Count-Min sketches. At most
+    ``max_series`` series are kept, and the least recently written series are
+    evicted first. The data is dropped when the rollup configuration changes.
+
+    >>> SENTRY_TSDB = 'sentry.tsdb.local.LocalTSDB'
+    >>> SENTRY_TSDB_OPTIONS = {
+    >>>     'path': '/var/lib/sentry/tsdb.sqlite',
+    >>>     'max_series': 100000,
+    >>> }
+    """
+    # Matches ``RedisTSDB.DEFAULT_SKETCH_PARAMETERS``.
+    DEFAULT_SKETCH_PARAMETERS = (3, 128, 50)
+
+    def __init__(self, path=None, max_series=100000, precision=12, mmap_size=256 << 20,
+                 timeout=30, **options):
+        super(LocalTSDB, self).__init__(**options)
+        self.path = path
+        self.max_series = max_series
+        self.precision = precision
+        self.mmap_size = mmap_size
+        self.timeout = timeout
+        assert self.max_series > 0
+        self._lock = threading.RLock()
+        self._connection = (None, None)
+
+    def _connect(self):
+        connection = sqlite3.connect(
+            self.path or ':memory:',
+            timeout=self.timeout,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        if self.path is not None:
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = NORMAL')
+            connection.execute('PRAGMA mmap_size = %d' % (self.mmap_size, ))
+        for statement in SCHEMA:
+            connection.execute(statement)
+
+        rollups = json.dumps(list(self.rollups.items()))
+        with self._transaction(connection) as cursor:
+            cursor.execute("SELECT value FROM tsdb_meta WHERE name = 'rollups'")
+            row = cursor.fetchone()
+            if row is not None and row[0] != rollups:
+                logger.warning(
+                    'Discarding the tsdb data in %s, the rollup configuration changed.',
+                    self.path,
+                )
+                cursor.execute('DELETE FROM tsdb_point')
+                cursor.execute('DELETE FROM tsdb_series')
+            if row is None or row[0] != rollups:
+                cursor.execute(
+                    "INSERT OR REPLACE INTO tsdb_meta (name, value) VALUES ('rollups', ?)",
+                    (rollups, ),
+                )
+        return connection
+
+    def _get_connection(self):
+        # must be called while holding the lock. SQLite connections must not
+        # be used across a fork, so every process opens its own.
+        pid, connection = self._connection
+        if pid != os.getpid():
+            connection = self._connect()
+            self._connection = (os.getpid(), connection)
+        return connection
+
+    @contextmanager
+    def _transaction(self, connection):
+        # ``IMMEDIATE`` takes the write lock up front, so that concurrent
+        # read-modify-write transactions wait for each other instead of
+        # failing when they try to upgrade their locks.
+        cursor = connection.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            yield cursor
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
+        else:
+            cursor.execute('COMMIT')
+
+    @contextmanager
+    def _write(self):
+        with self._lock:
+            connection = self._get_connection()
+            with self._transaction(connection) as cursor:
+                yield cursor
+
+    @contextmanager
+    def _read(self):
+        with self._lock:
+            yield self._get_connection().cursor()
+
+    def _get_series_id(self, cursor, kind, model, key, environment_id):
+        cursor.execute(
+            'SELECT id FROM tsdb_series '
+            'WHERE kind = ? AND model = ? AND environment_id = ? AND key = ?',
+            (kind, model.value, _environment(environment_id), six.text_type(key)),
+        )
+        row = cursor.fetchone()
+        return row[0] if row is not None else None
+
+    def _get_or_create_series_id(self, cursor, kind, model, key, environment_id):
+        # must be called in a write transaction
+        cursor.execute('SELECT COALESCE(MAX(used), 0) + 1 FROM tsdb_series')
+        used, = cursor.fetchone()
+
+        series_id = self._get_series_id(cursor, kind, model, key, environment_id)
+        if series_id is not None:
+            cursor.execute('UPDATE tsdb_series SET used = ? WHERE id = ?', (used, series_id))
+            return series_id
+
+        cursor.execute('SELECT COUNT(*) FROM tsdb_series')
+        excess = cursor.fetchone()[0] - self.max_series + 1
+        if excess > 0:
+            cursor.execute('SELECT id FROM tsdb_series ORDER BY used LIMIT ?', (excess, ))
+            self._delete_series(cursor, [row[0] for row in cursor.fetchall()])
+            metrics.incr('tsdb.local.evicted', amount=excess, skip_internal=True)
+
+        cursor.execute(
+            'INSERT INTO tsdb_series (kind, model, key, environment_id, used) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (kind, model.value, six.text_type(key), _environment(environment_id), used),
+        )
+        return cursor.lastrowid
+
+    def _delete_series(self, cursor, series_ids):
+        for chunk in chunked(series_ids, QUERY_CHUNK_SIZE):
+            placeholders = ', '.join(['?'] * len(chunk))
+            cursor.execute(
+                'DELETE FROM tsdb_point WHERE series_id IN (%s)' % (placeholders, ), chunk)
+            cursor.execute(
+                'DELETE FROM tsdb_series WHERE id IN (%s)' % (placeholders, ), chunk)
+
+    def _add(self, cursor, series_id, rollup, bucket, count):
+        slot = bucket % self.rollups[rollup]
+        cursor.execute(
+            'INSERT OR IGNORE INTO tsdb_point (series_id, rollup, slot, bucket, value) '
+            'VALUES (?, ?, ?, -1, 0)',
+            (series_id, rollup, slot),
+        )
+        # An older bucket in the slot is replaced, a newer one is kept.
+        cursor.execute(
+            'UPDATE tsdb_point SET '
+            'value = CASE WHEN bucket = ? THEN value + ? ELSE ? END, bucket = ? '
+            'WHERE series_id = ? AND rollup = ? AND slot = ? AND bucket <= ?',
+            (bucket, count, count, bucket, series_id, rollup, slot, bucket),
+        )
+
+    def _update_sketch(self, cursor, series_id, rollup, bucket, default, update):
+        slot = bucket % self.rollups[rollup]
+        cursor.execute(
+            'SELECT bucket, value FROM tsdb_point '
+            'WHERE series_id = ? AND rollup = ? AND slot = ?',
+            (series_id, rollup, slot),
+        )
+        row = cursor.fetchone()
+        if row is None or row[0] < bucket:
+            sketch = default()
+        elif row[0] == bucket:
+            sketch = _loads(row[1])
+        else:
+            return
+        update(sketch)
+        cursor.execute(
+            'INSERT OR REPLACE INTO tsdb_point (series_id, rollup, slot, bucket, value) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (series_id, rollup, slot, bucket, _dumps(sketch)),
+        )
+
+    def _write_points(self, kind, items, timestamp, environment_id, write):
+        """
+        Call ``write(cursor, series_id, rollup, bucket, *args)`` for every
+        ``(model, key, args)`` in ``items`` and every rollup, in the series
+        of ``environment_id`` as well as the series of all environments.
+        """
+        environment_ids = set([environment_id, None])
+        with self._write() as cursor:
+            for model, key, args in items:
+                for environment_id in environment_ids:
+                    series_id = self._get_or_create_series_id(
+                        cursor, kind, model, key, environment_id)
+                    for rollup in self.rollups:
+                        bucket = self.normalize_to_rollup(timestamp, rollup)
+                        write(cursor, series_id, rollup, bucket, *args)
+
+    def _get_points(self, kind, model, keys, environment_id, rollup, series):
+        """
+        Return a mapping of every key in ``keys`` to a mapping of the buckets
+        of ``series`` that hold a value to that value.
+        """
+        buckets = [self.normalize_ts_to_rollup(epoch, rollup) for epoch in series]
+        keys = {six.text_type(key): key for key in keys}
+        results = {key: {} for key in six.itervalues(keys)}
+        if not buckets:
+            return results
+
+        with self._read() as cursor:
+            for chunk in chunked(list(keys), QUERY_CHUNK_SIZE):
+                cursor.execute(
+                    'SELECT s.key, p.bucket, p.value FROM tsdb_series s '
+                    'JOIN tsdb_point p ON p.series_id = s.id '
+                    'WHERE s.kind = ? AND s.model = ? AND s.environment_id = ? '
+                    'AND s.key IN (%s) AND p.rollup = ? AND p.bucket BETWEEN ? AND ?' % (
+                        ', '.join(['?'] * len(chunk)),
+                    ),
+                    [kind, model.value, _environment(environment_id)] + chunk +
+                    [rollup, min(buckets), max(buckets)],
+                )
+                for key, bucket, value in cursor.fetchall():
+                    results[keys[key]][bucket] = value
+        return results
+
+    def _get_series(self, kind, model, keys, environment_id, rollup, series, loads):
+        """
+        Return a mapping of every key in ``keys`` to a list of ``(epoch,
+        value)`` pairs, where ``value`` is ``None`` for empty buckets.
+        """
+        points = self._get_points(kind, model, keys, environment_id, rollup, series)
+        results = {}
+        for key, values in six.iteritems(points):
+            results[key] = []
+            for epoch in series:
+                value = values.get(self.normalize_ts_to_rollup(epoch, rollup))
+                results[key].append((epoch, loads(value) if value is not None else None))
+        return results
+
+    def _merge(self, kind, model, destination, sources, environment_ids, write):
+        environment_ids = (
+            set(environment_ids) if environment_ids is not None else set()).union(
+            [None])
+
+        self.validate_arguments([model], environment_ids)
+
+        with self._write() as cursor:
+            for environment_id in environment_ids:
+                for source in sources:
+                    source_id = self._get_series_id(cursor, kind, model, source, environment_id)
+                    if source_id is None:
+                        continue
+                    cursor.execute(
+                        'SELECT rollup, bucket, value FROM tsdb_point '
+                        'WHERE series_id = ? ORDER BY bucket',
+                        (source_id, ),
+                    )
+                    points = cursor.fetchall()
+                    self._delete_series(cursor, [source_id])
+
+                    series_id = self._get_or_create_series_id(
+                        cursor, kind, model, destination, environment_id)
+                    for rollup, bucket, value in points:
+                        if rollup in self.rollups:
+                            write(cursor, series_id, rollup, bucket, value)
+
+    def _delete(self, kind, models, keys, start, end, timestamp, environment_ids):
+        environment_ids = (
+            set(environment_ids) if environment_ids is not None else set()).union(
+            [None])
+
+        self.validate_arguments(models, environment_ids)
+
+        points = []
+        for rollup, series in self.get_active_series(start, end, timestamp).items():
+            for timestamp in series:
+                bucket = self.normalize_to_rollup(timestamp, rollup)
+                points.append((rollup, bucket % self.rollups[rollup], bucket))
+
+        with self._write() as cursor:
+            for model in models:
+                for key in keys:
+                    for environment_id in environment_ids:
+                        series_id = self._get_series_id(
+                            cursor, kind, model, key, environment_id)
+                        if series_id is None:
+                            continue
+                        cursor.executemany(
+                            'DELETE FROM tsdb_point WHERE series_id = ? AND rollup = ? '
+                            'AND slot = ? AND bucket = ?',
+                            [(series_id, ) + point for point in points],
+                        )
+
+    def incr(self, model, key, timestamp=None, count=1, environment_id=None):
+        self.incr_multi([(model, key)], timestamp, count, environment_id)
+
+    def incr_multi(self, items, timestamp=None, count=1, environment_id=None):
+        self.validate_arguments([model for model, key in items], [environment_id])
+
+        if timestamp is None:
+            timestamp = timezone.now()
+
+        self._write_points(
+            COUNTER,
+            [(model, key, (count, )) for model, key in items],
+            timestamp,
+            environment_id,
+            self._add,
+        )
+
+    def merge(self, model, destination, sources, timestamp=None, environment_ids=None):
+        self._merge(COUNTER, model, destination, sources, environment_ids, self._add)
+
+    def delete(self, models, keys, start=None, end=None, timestamp=None, environment_ids=None):
+        self._delete(COUNTER, models, keys, start, end, timestamp, environment_ids)
+
+    def get_range(self, model, keys, start, end, rollup=None, environment_ids=None):
+        self.validate_arguments([model], environment_ids if environment_ids is not None else [None])
+
+        rollup, series = self.get_optimal_rollup_series(start, end, rollup)
+
+        results = {key: [(epoch, 0) for epoch in series] for key in keys}
+        for environment_id in (environment_ids or [None]):
+            points = self._get_series(
+                COUNTER, model, keys, environment_id, rollup, series, int)
+            for key, values in six.iteritems(points):
+                results[key] = [
+                    (epoch, total + (value or 0))
+                    for (epoch, total), (_, value) in zip(results[key], values)
+                ]
+        return results
+
+    def record(self, model, key, values, timestamp=None, environment_id=None):
+        self.record_multi([(model, key, values)], timestamp, environment_id)
+
+    def _make_hyperloglog(self):
+        return HyperLogLog(self.precision)
+
+    def record_multi(self, items, timestamp=None, environment_id=None):
+        self.validate_arguments([model for model, key, values in items], [environment_id])
+
+        if timestamp is None:
+            timestamp = timezone.now()
+
+        def write(cursor, series_id, rollup, bucket, values):
+            self._update_sketch(
+                cursor, series_id, rollup, bucket, self._make_hyperloglog,
+                lambda hll: hll.update(values),
+            )
+
+        self._write_points(
+            DISTINCT_COUNTER,
+            [(model, key, (values, )) for model, key, values in items],
+            timestamp,
+            environment_id,
+            write,
+        )
+
+    def _get_distinct_counters(self, model, keys, environment_id, rollup, series):
+        return self._get_series(
+            DISTINCT_COUNTER, model, keys, environment_id, rollup, series, _loads)
+
+    def get_distinct_counts_series(self, model, keys, start, end=None,
+                                   rollup=None, environment_id=None):
+        self.validate_arguments([model], [environment_id])
+
+        rollup, series = self.get_optimal_rollup_series(start, end, rollup)
+
+        return {
+            key: [
+                (epoch, hll.cardinality() if hll is not None else 0)
+                for epoch, hll in values
+            ]
+            for key, values in six.iteritems(
+                self._get_distinct_counters(model, keys, environment_id, rollup, series))
+        }
+
+    def get_distinct_counts_totals(self, model, keys, start, end=None,
+                                   rollup=None, environment_id=None):
+        self.validate_arguments([model], [environment_id])
+
+        rollup, series = self.get_optimal_rollup_series(start, end, rollup)
+
+        results = {}
+        for key, values in six.iteritems(
+                self._get_distinct_counters(model, keys, environment_id, rollup, series)):
+            union = self._make_hyperloglog()
+            for _, hll in values:
+                if hll is not None:
+                    union.merge(hll)
+            results[key] = union.cardinality()
+        return results
+
+    def get_distinct_counts_union(self, model, keys, start, end=None,
+                                  rollup=None, environment_id=None):
+        self.validate_arguments([model], [environment_id])
+
+        if not keys:
+            return 0
+
+        rollup, series = self.get_optimal_rollup_series(start, end, rollup)
+
+        union = self._make_hyperloglog()
+        for values in six.itervalues(
+                self._get_distinct_counters(model, keys, environment_id, rollup, series)):
+            for _, hll in values:
+                if hll is not None:
+                    union.merge(hll)
+        return union.cardinality()
+
+    def merge_distinct_counts(self, model, destination, sources,
+                              timestamp=None, environment_ids=None):
+        def write(cursor, series_id, rollup, bucket, value):
+            self._update_sketch(
+                cursor, series_id, rollup, bucket, self._make_hyperloglog,
+                lambda hll: hll.merge(_loads(value)),
+            )
+
+        self._merge(DISTINCT_COUNTER, model, destination, sources, environment_ids, write)
+
+    def delete_distinct_counts(self, models, keys, start=None, end=None,
+                               timestamp=None, environment_ids=None):
+        self._delete(DISTINCT_COUNTER, models, keys, start, end, timestamp, environment_ids)
+
+    def _make_sketch(self):
+        return CountMinSketch(*self.DEFAULT_SKETCH_PARAMETERS)
+
+    def record_frequency_multi(self, requests, timestamp=None, environment_id=None):
+        self.validate_arguments([model for model, request in requests], [environment_id])
+
+        if timestamp is None:
+            timestamp = timezone.now()
+
+        def write(cursor, series_id, rollup, bucket, items):
+            self._update_sketch(
+                cursor, series_id, rollup, bucket, self._make_sketch,
+                lambda sketch: sketch.increment(items),
+            )
+
+        self._write_points(
+            FREQUENCY_TABLE,
+            [
+                (model, key, ([(member, float(score)) for member, score in six.iteritems(items)], ))
+                for model, request in requests
+                for key, items in six.iteritems(request)
+            ],
+            timestamp,
+            environment_id,
+            write,
+        )
+
+    def _get_sketches(self, model, keys, environment_id, rollup, series):
+        return self._get_series(
+            FREQUENCY_TABLE, model, keys, environment_id, rollup, series, _loads)
+
+    def get_most_frequent(self, model, keys, start, end=None,
+                          rollup=None, limit=None, environment_id=None):
+        self.validate_arguments([model], [environment_id])
+
+        rollup, series = self.get_optimal_rollup_series(start, end, rollup)
+
+        return {
+            key: ranked([sketch for _, sketch in values if sketch is not None], limit)
+            for key, values in six.iteritems(
+                self._get_sketches(model, keys, environment_id, rollup, series))
+        }
+
+    def get_most_frequent_series(self, model, keys, start, end=None,
+                                 rollup=None, limit=None, environment_id=None):
+        self.validate_arguments([model], [environment_id])
+
+        rollup, series = self.get_optimal_rollup_series(start, end, rollup)
+
+        return {
+            key: [
+                (epoch, dict(ranked([sketch], limit)) if sketch is not None else {})
+                for epoch, sketch in values
+            ]
+            for key, values in six.iteritems(
+                self._get_sketches(model, keys, environment_id, rollup, series))
+        }
+
+    def get_frequency_series(self, model, items, start, end=None, rollup=None, environment_id=None):
+        self.validate_arguments([model], [environment_id])
+
+        rollup, series = self.get_optimal_rollup_series(start, end, rollup)
+
+        sketches = self._get_sketches(model, list(items), environment_id, rollup, series)
+        return {
+            key: [
+                (epoch, {
+                    member: sketch.estimate(member) if sketch is not None else 0.0
+                    for member in members
+                })
+                for epoch, sketch in sketches[key]
+            ]
+            for key, members in items.items()
+        }
+
+    def get_frequency_totals(self, model, items, start, end=None, rollup=None, environment_id=None):
+        self.validate_arguments([model], [environment_id])
+
+        results = {}
+        for key, series in six.iteritems(
+            self.get_frequency_series(model, items, start, end, rollup, environment_id)
+        ):
+            result = results[key] = {}
+            for timestamp, scores in series:
+                for member, score in scores.items():
+                    result[member] = result.get(member, 0.0) + score
+
+        return results
+
+    def merge_frequencies(self, model, destination, sources, timestamp=None, environment_ids=None):
+        def write(cursor, series_id, rollup, bucket, value):
+            self._update_sketch(
+                cursor, series_id, rollup, bucket, self._make_sketch,
+                lambda sketch: sketch.merge(_loads(value)),
+            )
+
+        self._merge(FREQUENCY_TABLE, model, destination, sources, environment_ids, write)
+
+    def delete_frequencies(self, models, keys, start=None, end=None,
+                           timestamp=None, environment_ids=None):
+        self._delete(FREQUENCY_TABLE, models, keys, start, end, timestamp, environment_ids)
+
+    def flush(self):
+        with self._write() as cursor:
+            cursor.execute('DELETE FROM tsdb_point')
+            cursor.execute('DELETE FROM tsdb_series')
@@ -10,8 +10,8 @@ from __future__ import absolute_import
 import itertools
 import logging
 import operator
-import random
 import uuid
+from array import array
 from binascii import crc32
 from collections import defaultdict, namedtuple
 from hashlib import md5
@@ -22,10 +22,10 @@ from pkg_resources import resource_string
 from redis.client import Script
 
 from sentry.tsdb.base import BaseTSDB
+from sentry.tsdb.sketches import HyperLogLog
 from sentry.utils.dates import to_datetime, to_timestamp
 from sentry.utils.redis import check_cluster_versions, get_cluster_from_options
 from sentry.utils.versioning import Version
-from six.moves import reduce
 
 logger = logging.getLogger(__name__)
 
@@ -36,6 +36,11 @@ CountMinScript = Script(
     resource_string('sentry', 'scripts/tsdb/cmsketch.lua'),
 )
 
+SumScript = Script(
+    None,
+    resource_string('sentry', 'scripts/tsdb/sum.lua'),
+)
+
 
 class SuppressionWrapper(object):
     """\
@@ -124,6 +129,10 @@ class RedisTSDB(BaseTSDB):
         self.prefix = prefix
         self.vnodes = vnodes
         self.enable_frequency_sketches = options.pop('enable_frequency_sketches', False)
+        # When enabled, ``get_sums`` and ``get_range_rollup`` sum counters on
+        # the Redis servers (see ``sum.lua``) instead of fetching every bucket.
+        self.enable_server_side_aggregation = options.pop(
+            'enable_server_side_aggregation', True)
         super(RedisTSDB, self).__init__(**options)
 
     def validate(self):
@@ -242,6 +251,79 @@ class RedisTSDB(BaseTSDB):
                                 self.calculate_expiry(rollup, max_values, timestamp),
                             )
 
+    def flush_write_session(self, session):
+        """
+        Write everything collected by a ``WriteSession``.
+
+        Counters and distinct counters for each cluster are written with a
+        single pipeline per host, with identical counter fields summed and
+        each key's expiration set once. Frequency table updates are merged by
+        key and written with one script call per key.
+        """
+        # cluster -> data to be written to that cluster
+        counters = defaultdict(lambda: defaultdict(int))
+        distinct_counters = defaultdict(lambda: defaultdict(set))
+        frequencies = defaultdict(lambda: defaultdict(list))
+        expirations = defaultdict(dict)
+
+        def expand(entries):
+            for (model, key, environment_id, _), (timestamp, value) in six.iteritems(entries):
+                for environment_id in set([None, environment_id]):
+                    cluster = self.get_cluster(environment_id)
+                    for rollup, max_values in six.iteritems(self.rollups):
+                        expiry = self.calculate_expiry(rollup, max_values, timestamp)
+                        yield cluster, model, key, environment_id, rollup, timestamp, expiry, value
+
+        for cluster, model, key, environment_id, rollup, timestamp, expiry, count in expand(
+                session.counters):
+            hash_key, hash_field = self.make_counter_key(
+                model, rollup, timestamp, key, environment_id)
+            counters[cluster][(hash_key, hash_field)] += count
+            expirations[cluster][(hash_key, hash_key)] = expiry
+
+        for cluster, model, key, environment_id, rollup, timestamp, expiry, values in expand(
+                session.distinct_counters):
+            # distinct counters are routed by the key, not the Redis key
+            k = self.make_key(model, rollup, int(to_timestamp(timestamp)), key, environment_id)
+            distinct_counters[cluster][(key, k)].update(values)
+            expirations[cluster][(key, k)] = expiry
+
+        for cluster, model, key, environment_id, rollup, timestamp, expiry, items in expand(
+                session.frequencies):
+            keys = self.make_frequency_table_keys(
+                model, rollup, int(to_timestamp(timestamp)), key, environment_id)
+            arguments = ['INCR'] + list(self.DEFAULT_SKETCH_PARAMETERS)
+            for member, score in items.items():
+                arguments.extend((score, member))
+            frequencies[cluster][key].append((CountMinScript, keys, arguments))
+            for k in keys:
+                frequencies[cluster][key].append(('EXPIREAT', k, expiry))
+
+        for cluster, durable in set(counters) | set(distinct_counters):
+            manager = cluster.fanout()
+            if not durable:
+                manager = SuppressionWrapper(manager)
+
+            with manager as client:
+                for (hash_key, hash_field), count in six.iteritems(
+                        counters[(cluster, durable)]):
+                    client.target_key(hash_key).hincrby(hash_key, hash_field, count)
+                for (routing_key, k), values in six.iteritems(
+                        distinct_counters[(cluster, durable)]):
+                    client.target_key(routing_key).pfadd(k, *values)
+                for (routing_key, k), expiry in six.iteritems(expirations[(cluster, durable)]):
+                    client.target_key(routing_key).expireat(k, expiry)
+
+        if not self.enable_frequency_sketches:
+            return
+
+        for (cluster, durable), commands in six.iteritems(frequencies):
+            try:
+                cluster.execute_commands(commands)
+            except Exception:
+                if durable:
+                    raise
+
     def get_range(self, model, keys, start, end, rollup=None, environment_ids=None):
         """
         To get a range of data for group ID=[1, 2, 3]:
@@ -250,35 +332,155 @@ class RedisTSDB(BaseTSDB):
         >>> get_keys(TimeSeriesModel.group, [1, 2, 3],
         >>>          start=now - timedelta(days=1),
         >>>          end=now)
+
+        All fields that live in the same counter hash (one per rollup bucket
+        and vnode) are fetched with a single ``HMGET``, covering every
+        requested key and environment at once. When multiple environments are
+        requested, their counts are summed.
+        """
+        environment_ids = list(environment_ids) if environment_ids else [None]
+
+        self.validate_arguments([model], environment_ids)
+
+        keys = list(keys)
+        rollup, series = self.get_optimal_rollup_series(start, end, rollup)
+        series = [to_datetime(timestamp) for timestamp in series]
+        width = len(series)
+
+        if not width:
+            return {}
+
+        # Counts are accumulated into a flat array of ``len(keys) * width``
+        # cells, where each requested field maps to a fixed position.
+        counts = array('l', [0]) * (len(keys) * width)
+
+        for (cluster, _), cluster_environment_ids in self.get_cluster_groups(environment_ids):
+            requests = defaultdict(lambda: ([], []))
+            for i, key in enumerate(keys):
+                for j, timestamp in enumerate(series):
+                    for environment_id in cluster_environment_ids:
+                        hash_key, hash_field = self.make_counter_key(
+                            model, rollup, timestamp, key, environment_id)
+                        fields, positions = requests[hash_key]
+                        fields.append(hash_field)
+                        positions.append(i * width + j)
+
+            with cluster.map() as client:
+                responses = [
+                    (positions, client.hmget(hash_key, fields))
+                    for hash_key, (fields, positions) in six.iteritems(requests)
+                ]
+
+            for positions, promise in responses:
+                for position, value in zip(positions, promise.value):
+                    if value is not None:
+                        counts[position] += int(value)
+
+        timestamps = [to_timestamp(timestamp) for timestamp in series]
+        return {
+            key: list(zip(timestamps, counts[i * width:(i + 1) * width]))
+            for i, key in enumerate(keys)
+        }
+
+    def aggregate_counters(self, model, keys, series, rollup, environment_ids, slots, get_slot):
+        """
+        Sum counters on the Redis servers into ``slots`` totals.
+
+        ``get_slot`` is called with the index of each key and each timestamp
+        in ``series`` and returns the index of the total the counter is added
+        to. Counters for every environment in ``environment_ids`` are added
+        together.
         """
-        # redis backend doesn't support multiple envs
-        if environment_ids is not None and len(environment_ids) > 1:
-            raise NotImplementedError
-        environment_id = environment_ids[0] if environment_ids else None
+        totals = [0] * slots
+
+        for (cluster, _), cluster_environment_ids in self.get_cluster_groups(environment_ids):
+            router = cluster.get_router()
+
+            # host -> hash key -> [field, slot, field, slot, ...]
+            requests = defaultdict(lambda: defaultdict(list))
+            for i, key in enumerate(keys):
+                for j, timestamp in enumerate(series):
+                    slot = get_slot(i, j)
+                    for environment_id in cluster_environment_ids:
+                        hash_key, hash_field = self.make_counter_key(
+                            model, rollup, timestamp, key, environment_id)
+                        requests[router.get_host_for_key(hash_key)][hash_key].extend(
+                            (hash_field, slot))
+
+            commands = {}
+            for host, fields in six.iteritems(requests):
+                arguments = [slots]
+                for hash_key, values in six.iteritems(fields):
+                    arguments.append(len(values) // 2)
+                    arguments.extend(values)
+                # Any of the hash keys will route the script to this host.
+                commands[next(iter(fields))] = [(SumScript, list(fields), arguments)]
+
+            for responses in six.itervalues(cluster.execute_commands(commands)):
+                for slot, value in enumerate(responses[0].value):
+                    totals[slot] += int(value)
+
+        return totals
+
+    def get_sums(self, model, keys, start, end, rollup=None, environment_id=None):
+        if not self.enable_server_side_aggregation:
+            return super(RedisTSDB, self).get_sums(
+                model, keys, start, end, rollup, environment_id=environment_id)
 
         self.validate_arguments([model], [environment_id])
 
+        keys = list(keys)
         rollup, series = self.get_optimal_rollup_series(start, end, rollup)
-        series = map(to_datetime, series)
+        series = [to_datetime(timestamp) for timestamp in series]
 
-        results = []
-        cluster, _ = self.get_cluster(environment_id)
-        with cluster.map() as client:
-            for key in keys:
-                for timestamp in series:
-                    hash_key, hash_field = self.make_counter_key(
-                        model, rollup, timestamp, key, environment_id)
-                    results.append(
-                        (to_timestamp(timestamp), key, client.hget(
-                            hash_key, hash_field)))
+        if not series:
+            return {}
+
+        totals = self.aggregate_counters(
+            model, keys, series, rollup, [environment_id], len(keys), lambda i, j: i)
 
-        results_by_key = defaultdict(dict)
-        for epoch, key, count in results:
-            results_by_key[key][epoch] = int(count.value or 0)
+        return dict(zip(keys, totals))
 
-        for key, points in six.iteritems(results_by_key):
-            results_by_key[key] = sorted(points.items())
-        return dict(results_by_key)
+    def get_range_rollup(self, model, keys, start, end, interval, rollup=None,
+                         environment_ids=None):
+        if not self.enable_server_side_aggregation:
+            return super(RedisTSDB, self).get_range_rollup(
+                model, keys, start, end, interval, rollup, environment_ids=environment_ids)
+
+        environment_ids = list(environment_ids) if environment_ids else [None]
+
+        self.validate_arguments([model], environment_ids)
+
+        keys = list(keys)
+        rollup, series = self.get_optimal_rollup_series(start, end, rollup)
+
+        if not series:
+            return {}
+
+        # ``series`` is sorted, so each interval is a contiguous run of it
+        epochs = []
+        buckets = []
+        for timestamp in series:
+            epoch = self.normalize_ts_to_epoch(to_timestamp(to_datetime(timestamp)), interval)
+            if not epochs or epochs[-1] != epoch:
+                epochs.append(epoch)
+            buckets.append(len(epochs) - 1)
+
+        width = len(epochs)
+        totals = self.aggregate_counters(
+            model,
+            keys,
+            [to_datetime(timestamp) for timestamp in series],
+            rollup,
+            environment_ids,
+            len(keys) * width,
+            lambda i, j: i * width + buckets[j],
+        )
+
+        return {
+            key: [[epoch, totals[i * width + b]] for b, epoch in enumerate(epochs)]
+            for i, key in enumerate(keys)
+        }
 
     def merge(self, model, destination, sources, timestamp=None, environment_ids=None):
         environment_ids = (
@@ -486,79 +688,26 @@ class RedisTSDB(BaseTSDB):
 
         rollup, series = self.get_optimal_rollup_series(start, end, rollup)
 
-        temporary_id = uuid.uuid1().hex
+        cluster, _ = self.get_cluster(environment_id)
 
-        def make_temporary_key(key):
-            return u'{}{}:{}'.format(self.prefix, temporary_id, key)
+        # Rather than merging the HyperLogLogs with ``PFMERGE`` on each host
+        # (which requires writing and deleting temporary keys, and moving the
+        # partial aggregates between hosts), the raw registers are fetched from
+        # all hosts in parallel and merged here as the responses arrive.
+        union = HyperLogLog(HyperLogLog.REDIS_PRECISION, redis=True)
 
-        def expand_key(key):
-            """
-            Return a list containing all keys for each interval in the series for a key.
-            """
-            return [self.make_key(model, rollup, timestamp, key, environment_id)
-                    for timestamp in series]
+        def merge(value):
+            if value is not None:
+                union.merge(HyperLogLog.from_redis(value))
 
-        cluster, _ = self.get_cluster(environment_id)
-        router = cluster.get_router()
-
-        def map_key_to_host(hosts, key):
-            """
-            Identify the host where a key is located and add it to the host map.
-            """
-            hosts[router.get_host_for_key(key)].add(key)
-            return hosts
-
-        def get_partition_aggregate(value):
-            """
-            Fetch the HyperLogLog value (in its raw byte representation) that
-            results from merging all HyperLogLogs at the provided keys.
-            """
-            (host, keys) = value
-            destination = make_temporary_key(u'p:{}'.format(host))
-            client = cluster.get_local_client(host)
-            with client.pipeline(transaction=False) as pipeline:
-                pipeline.execute_command(
-                    'PFMERGE', destination, *itertools.chain.from_iterable(map(expand_key, keys))
-                )
-                pipeline.get(destination)
-                pipeline.delete(destination)
-                return (host, pipeline.execute()[1])
-
-        def merge_aggregates(values):
-            """
-            Calculate the cardinality of the provided HyperLogLog values.
-            """
-            destination = make_temporary_key('a')  # all values will be merged into this key
-            aggregates = {make_temporary_key(u'a:{}'.format(host)): value for host, value in values}
-
-            # Choose a random host to execute the reduction on. (We use a host
-            # here that we've already accessed as part of this process -- this
-            # way, we constrain the choices to only hosts that we know are
-            # running.)
-            client = cluster.get_local_client(random.choice(values)[0])
-            with client.pipeline(transaction=False) as pipeline:
-                pipeline.mset(aggregates)
-                pipeline.execute_command('PFMERGE', destination, *aggregates.keys())
-                pipeline.execute_command('PFCOUNT', destination)
-                pipeline.delete(destination, *aggregates.keys())
-                return pipeline.execute()[2]
-
-        # TODO: This could be optimized to skip the intermediate step for the
-        # host that has the largest number of keys if the final merge and count
-        # is performed on that host. If that host contains *all* keys, the
-        # final reduction could be performed as a single PFCOUNT, skipping the
-        # MSET and PFMERGE operations entirely.
-
-        return merge_aggregates(
-            [
-                get_partition_aggregate(x)
-                for x in reduce(
-                    map_key_to_host,
-                    keys,
-                    defaultdict(set),
-                ).items()
-            ]
-        )
+        with cluster.map() as client:
+            for key in keys:
+                for timestamp in series:
+                    client.get(
+                        self.make_key(model, rollup, timestamp, key, environment_id),
+                    ).then(merge)
+
+        return union.cardinality()
 
     def merge_distinct_counts(self, model, destination, sources,
                               timestamp=None, environment_ids=None):
@@ -0,0 +1,391 @@
+"""
+sentry.tsdb.sketches
+~~~~~~~~~~~~~~~~~~~~
+
+Probabilistic data structures used by the time series backends that do not
+keep them in Redis.
+
+:copyright: (c) 2010-2019 by the Sentry Team, see AUTHORS for more details.
+:license: BSD, see LICENSE for more details.
+"""
+from __future__ import absolute_import
+
+import math
+import mmh3
+import six
+
+from array import array
+
+
+def _to_bytes(value):
+    if isinstance(value, six.binary_type):
+        return value
+    return six.text_type(value).encode('utf-8')
+
+
+def _hash64(value):
+    return mmh3.hash64(_to_bytes(value))[0] & 0xffffffffffffffff
+
+
+def _hash32(value, seed):
+    return mmh3.hash(_to_bytes(value), seed) & 0xffffffff
+
+
+class HyperLogLog(object):
+    """
+    A HyperLogLog cardinality estimator.
+
+    Registers are stored sparsely (as a mapping of register index to value)
+    until the dense representation (one byte per register) becomes smaller.
+    Cardinality is estimated with the same improved estimator that Redis uses
+    for ``PFCOUNT`` (Otmar Ertl, "New cardinality estimation algorithms for
+    HyperLogLog sketches"), which is accurate for small cardinalities without
+    needing a separate linear counting correction.
+
+    The registers of a Redis HyperLogLog can be loaded with ``from_redis``
+    and merged with other estimators loaded from Redis. Redis hashes values
+    with MurmurHash64A while ``add`` uses ``mmh3.hash64``, so the same value
+    sets different registers in both, and estimators loaded from Redis can
+    not be merged with (or extended like) estimators built with ``add``.
+    """
+    __slots__ = ('precision', 'registers', 'redis')
+
+    ALPHA_INF = 0.721347520444481703680
+
+    # Redis always uses 2^14 registers of 6 bits each.
+    REDIS_PRECISION = 14
+    REDIS_HEADER_SIZE = 16
+
+    def __init__(self, precision=12, registers=None, redis=False):
+        assert 4 <= precision <= 16
+        self.precision = precision
+        self.registers = registers if registers is not None else {}
+        self.redis = redis
+
+    def __getstate__(self):
+        return (self.precision, self.registers, self.redis)
+
+    def __setstate__(self, state):
+        if len(state) == 2:
+            state += (False, )
+        self.precision, self.registers, self.redis = state
+
+    @classmethod
+    def from_redis(cls, value):
+        """
+        Load the registers of a HyperLogLog stored by Redis (the result of
+        ``GET`` on a key written with ``PFADD`` or ``PFMERGE``.)
+        """
+        value = bytearray(value)
+        if value[:4] != b'HYLL':
+            raise ValueError('Not a Redis HyperLogLog value')
+
+        encoding = value[4]
+        data = value[cls.REDIS_HEADER_SIZE:]
+        size = 1 << cls.REDIS_PRECISION
+
+        if encoding == 0:
+            # Dense: registers are packed as 6 bit integers, least significant
+            # bits first, so every 3 bytes hold 4 registers.
+            if len(data) != size * 6 // 8:
+                raise ValueError('Invalid dense HyperLogLog length')
+            registers = bytearray(size)
+            i = 0
+            for j in range(0, len(data), 3):
+                word = data[j] | (data[j + 1] << 8) | (data[j + 2] << 16)
+                registers[i] = word & 63
+                registers[i + 1] = (word >> 6) & 63
+                registers[i + 2] = (word >> 12) & 63
+                registers[i + 3] = word >> 18
+                i += 4
+            return cls(cls.REDIS_PRECISION, registers, redis=True)
+        elif encoding == 1:
+            # Sparse: a sequence of ZERO (00xxxxxx), XZERO (01xxxxxx yyyyyyyy)
+            # and VAL (1vvvvvxx) opcodes describing runs of registers.
+            registers = {}
+            index = 0
+            position = 0
+            while position < len(data):
+                opcode = data[position]
+                if opcode & 0xc0 == 0:
+                    index += (opcode & 0x3f) + 1
+                    position += 1
+                elif opcode & 0xc0 == 0x40:
+                    index += (((opcode & 0x3f) << 8) | data[position + 1]) + 1
+                    position += 2
+                else:
+                    register = ((opcode >> 2) & 0x1f) + 1
+                    for _ in range((opcode & 0x03) + 1):
+                        registers[index] = register
+                        index += 1
+                    position += 1
+            if index != size:
+                raise ValueError('Invalid sparse HyperLogLog length')
+            hll = cls(cls.REDIS_PRECISION, registers, redis=True)
+            if len(registers) > size // 16:
+                hll._densify()
+            return hll
+        else:
+            raise ValueError('Unknown HyperLogLog encoding: %r' % (encoding, ))
+
+    @property
+    def size(self):
+        return 1 << self.precision
+
+    def _densify(self):
+        registers = bytearray(self.size)
+        for index, value in six.iteritems(self.registers):
+            registers[index] = value
+        self.registers = registers
+
+    def _set(self, index, value):
+        registers = self.registers
+        if isinstance(registers, dict):
+            if value > registers.get(index, 0):
+                registers[index] = value
+                # Each sparse entry costs far more than a byte, so switch
+                # to the dense representation well before it is full.
+                if len(registers) > self.size // 16:
+                    self._densify()
+        elif value > registers[index]:
+            registers[index] = value
+
+    def add(self, value):
+        if self.redis:
+            raise ValueError('Can not add values to a HyperLogLog loaded from Redis')
+        hash = _hash64(value)
+        index = hash & (self.size - 1)
+        hash >>= self.precision
+        hash |= 1 << (64 - self.precision)
+        rank = 1
+        while not hash & 1:
+            hash >>= 1
+            rank += 1
+        self._set(index, rank)
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+
+    def merge(self, other):
+        """
+        Merge the registers of ``other`` into this estimator, producing an
+        estimator of the union of both sets.
+        """
+        assert self.precision == other.precision
+        if self.redis != other.redis:
+            raise ValueError('Can not merge HyperLogLogs loaded from Redis with local ones')
+        if isinstance(other.registers, dict):
+            for index, value in six.iteritems(other.registers):
+                self._set(index, value)
+        else:
+            if isinstance(self.registers, dict):
+                self._densify()
+            registers = self.registers
+            for index, value in enumerate(other.registers):
+                if value > registers[index]:
+                    registers[index] = value
+
+    def histogram(self):
+        q = 64 - self.precision
+        histogram = [0] * (q + 2)
+        if isinstance(self.registers, dict):
+            histogram[0] = self.size - len(self.registers)
+            values = six.itervalues(self.registers)
+        else:
+            values = iter(self.registers)
+        for value in values:
+            histogram[value] += 1
+        return histogram
+
+    def cardinality(self):
+        m = self.size
+        q = 64 - self.precision
+        histogram = self.histogram()
+        if histogram[0] == m:
+            return 0
+
+        z = m * _tau(float(m - histogram[q + 1]) / m)
+        for k in range(q, 0, -1):
+            z += histogram[k]
+            z *= 0.5
+        z += m * _sigma(float(histogram[0]) / m)
+        return int(round(self.ALPHA_INF * m * m / z))
+
+
+def _sigma(x):
+    if x == 1.0:
+        return float('inf')
+    y = 1.0
+    z = x
+    while True:
+        x *= x
+        previous = z
+        z += x * y
+        y += y
+        if previous == z:
+            return z
+
+
+def _tau(x):
+    if x == 0.0 or x == 1.0:
+        return 0.0
+    y = 1.0
+    z = 1 - x
+    while True:
+        x = math.sqrt(x)
+        previous = z
+        y *= 0.5
+        z -= math.pow(1 - x, 2) * y
+        if previous == z:
+            return z / 3
+
+
+class CountMinSketch(object):
+    """
+    A Count-Min sketch with an index of the most frequent items.
+
+    This mirrors the behavior of ``sentry/scripts/tsdb/cmsketch.lua``: the
+    index is the primary storage (and exact) until its capacity is exceeded,
+    at which point it is used to initialize the estimation matrix, and
+    afterwards only tracks the items with the highest estimates.
+    """
+    __slots__ = ('depth', 'width', 'capacity', 'index', 'estimators')
+
+    def __init__(self, depth, width, capacity):
+        self.depth = depth
+        self.width = width
+        self.capacity = capacity
+        self.index = {}
+        self.estimators = None
+
+    def __getstate__(self):
+        return (self.depth, self.width, self.capacity, self.index, self.estimators)
+
+    def __setstate__(self, state):
+        self.depth, self.width, self.capacity, self.index, self.estimators = state
+
+    def __nonzero__(self):
+        return bool(self.index) or self.estimators is not None
+
+    __bool__ = __nonzero__
+
+    def coordinates(self, value):
+        return [d * self.width + _hash32(value, d + 1) % self.width for d in range(self.depth)]
+
+    def _initialize_estimators(self):
+        if self.estimators is None:
+            self.estimators = array('d', [0.0]) * (self.depth * self.width)
+
+    def _update_estimators(self, coordinates, score):
+        estimators = self.estimators
+        for c in coordinates:
+            if score > estimators[c]:
+                estimators[c] = score
+
+    def _truncate_index(self):
+        excess = len(self.index) - self.capacity
+        if excess > 0:
+            for member, _ in sorted(six.iteritems(self.index), key=lambda i: (i[1], i[0]))[:excess]:
+                del self.index[member]
+
+    def estimate(self, value):
+        score = self.index.get(value)
+        if score is not None:
+            return score
+        if self.estimators is None:
+            return 0.0
+        return min(self.estimators[c] for c in self.coordinates(value))
+
+    def increment(self, items):
+        """
+        Add the ``(value, delta)`` pairs in ``items`` to the sketch.
+        """
+        index = self.index
+        if len(index) < self.capacity:
+            for value, delta in items:
+                index[value] = index.get(value, 0.0) + delta
+
+            if len(index) >= self.capacity:
+                self._initialize_estimators()
+                for value, score in six.iteritems(index):
+                    self._update_estimators(self.coordinates(value), score)
+                self._truncate_index()
+            return
+
+        self._initialize_estimators()
+        scores = []
+        for value, delta in items:
+            coordinates = self.coordinates(value)
+            score = index.get(value)
+            if score is None:
+                score = min(self.estimators[c] for c in coordinates)
+            score += delta
+            self._update_estimators(coordinates, score)
+            scores.append((value, score))
+
+        if self.capacity > 0:
+            minimum = min(six.itervalues(index)) if index else 0.0
+            for value, score in scores:
+                if score > minimum:
+                    index[value] = score
+            self._truncate_index()
+
+    def merge(self, other):
+        """
+        Merge the observations recorded in ``other`` into this sketch.
+        """
+        if other.estimators is None:
+            self.increment(list(six.iteritems(other.index)))
+            return
+
+        if self.estimators is None:
+            self._initialize_estimators()
+            for value, score in six.iteritems(self.index):
+                self._update_estimators(self.coordinates(value), score)
+
+        for c, value in enumerate(other.estimators):
+            self.estimators[c] += value
+
+        members = set(self.index) | set(other.index)
+        self.index = {
+            member: min(self.estimators[c] for c in self.coordinates(member))
+            for member in members
+        }
+        self._truncate_index()
+
+    def ranked(self, limit=None):
+        if limit is None:
+            limit = self.capacity
+        # Ties are broken the same way as ``ZREVRANGE``.
+        return sorted(
+            six.iteritems(self.index),
+            key=lambda i: (i[1], i[0]),
+            reverse=True,
+        )[:limit]
+
+
+def ranked(sketches, limit=None):
+    """
+    Find the most frequent items across all sketches, returning a sequence of
+    ``(item, score)`` pairs ordered by descending score.
+    """
+    sketches = [sketch for sketch in sketches if sketch]
+    if not sketches:
+        return []
+
+    if limit is None:
+        limit = min(sketch.capacity for sketch in sketches)
+
+    if len(sketches) == 1:
+        return sketches[0].ranked(limit)
+
+    members = set()
+    for sketch in sketches:
+        members.update(sketch.index)
+
+    results = [
+        (member, sum(sketch.estimate(member) for sketch in sketches)) for member in members
+    ]
+    results.sort(key=lambda i: (-i[1], i[0]))
+    return results[:limit]
@@ -8,11 +8,21 @@ sentry.utils.cache
 from __future__ import absolute_import, print_function
 
 import functools
+import logging
+import os
+import six
+import threading
+import time
 
+from collections import OrderedDict
+from django.conf import settings
 from django.core.cache import cache
+from uuid import uuid4
 
 default_cache = cache
 
+logger = logging.getLogger(__name__)
+
 
 class memoize(object):
     """
@@ -79,3 +89,251 @@ class cached_for_request(memoize):
 
     def __get__(self, obj, type=None):
         return functools.partial(self.__call__, obj)
+
+
+class LRUCache(object):
+    """
+    A thread safe mapping that holds at most ``max_size`` items, discarding
+    the least recently used items first.
+    """
+
+    def __init__(self, max_size):
+        assert max_size > 0
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.pop(key, None)
+            if value is not None:
+                self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_missing = object()
+
+
+class RequestCache(threading.local):
+    """
+    A cache that only holds values while a web request or a task is handled,
+    for values that are looked up several times while doing so. It is emptied
+    when the (outermost) request or task starts and finishes, and nothing is
+    cached outside of one. See ``sentry.receivers.cache``.
+    """
+
+    def __init__(self):
+        self._depth = 0
+        self._data = None
+
+    def start(self, **kwargs):
+        self._depth += 1
+        if self._depth == 1:
+            self._data = {}
+
+    def finish(self, **kwargs):
+        self._depth = max(self._depth - 1, 0)
+        if not self._depth:
+            self._data = None
+
+    def get(self, key, default=None):
+        if self._data is None:
+            return default
+        return self._data.get(key, default)
+
+    def set(self, key, value):
+        if self._data is not None:
+            self._data[key] = value
+
+    def delete(self, key):
+        if self._data is not None:
+            self._data.pop(key, None)
+
+
+request_cache = RequestCache()
+
+
+class LocalCache(object):
+    """
+    A bounded, process local cache in front of a shared cache, for values that
+    are read far more often than they change (such as the rows that are looked
+    up or created for every event.)
+
+    Values (and misses) are kept in the ``request_cache`` until the current
+    request or task is finished, so they are looked up at most once per event
+    that is saved, even without the local cache.
+
+    Values are kept locally for at most ``SENTRY_LOCAL_CACHE_TTL`` seconds,
+    misses of the shared cache for at most ``negative_ttl`` seconds. Every
+    ``set`` and ``delete`` is published on a Redis channel, and other processes
+    drop the key from their local cache when they receive it. Nothing is cached
+    locally while a process is not subscribed to that channel, so no
+    invalidation can be missed. The local cache is disabled unless
+    ``SENTRY_LOCAL_CACHE_SIZE`` is set, as every process then subscribes to
+    the channel in a thread of its own.
+    """
+
+    negative_ttl = 5
+    channel = 'local-cache'
+
+    def __init__(self, cache=default_cache, cluster='default'):
+        self.cache = cache
+        self.cluster = cluster
+        self._origin = None
+        self._lock = threading.Lock()
+        self._pid = None
+        self._local = None
+        self._subscribed = False
+        # Incremented for every invalidation that is received, so that values
+        # read from the shared cache before the invalidation are not cached.
+        self._invalidations = 0
+
+    def _get_local(self):
+        max_size = settings.SENTRY_LOCAL_CACHE_SIZE
+        if not max_size:
+            return None
+
+        # The subscriber thread does not survive a fork, so every process
+        # starts its own (with an empty cache), and gets its own origin, so
+        # that it does not ignore the invalidations of its siblings.
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._origin = uuid4().hex
+                    self._local = LRUCache(max_size)
+                    self._subscribed = False
+                    self._pid = os.getpid()
+                    thread = threading.Thread(
+                        target=self._subscribe,
+                        args=(self._local, ),
+                        name='sentry.local-cache',
+                    )
+                    thread.daemon = True
+                    thread.start()
+
+        return self._local if self._subscribed else None
+
+    def _subscribe(self, local):
+        from sentry.utils.redis import clusters
+
+        while True:
+            try:
+                client = clusters.get(self.cluster).get_local_client_for_key(self.channel)
+                pubsub = client.pubsub()
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    if message['type'] == 'subscribe':
+                        local.clear()
+                        self._subscribed = True
+                    elif message['type'] == 'message':
+                        data = message['data']
+                        if isinstance(data, six.binary_type):
+                            data = data.decode('utf-8')
+                        origin, key = data.split(' ', 1)
+                        if origin != self._origin:
+                            self._invalidations += 1
+                            local.delete(key)
+            except Exception:
+                logger.warning('local-cache.subscribe-failed', exc_info=True)
+            finally:
+                self._subscribed = False
+                local.clear()
+            time.sleep(1)
+
+    def _publish(self, key):
+        from sentry.utils.redis import clusters
+
+        try:
+            client = clusters.get(self.cluster).get_local_client_for_key(self.channel)
+            client.publish(self.channel, u'%s %s' % (self._origin, key))
+        except Exception:
+            # Other processes keep their copy until it expires.
+            logger.warning('local-cache.publish-failed', exc_info=True)
+
+    def get(self, key):
+        value = request_cache.get(key, _missing)
+        if value is _missing:
+            value = self._get(key)
+            request_cache.set(key, value)
+        return value
+
+    def _get(self, key):
+        local = self._get_local()
+        now = time.time()
+        if local is not None:
+            entry = local.get(key)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+            invalidations = self._invalidations
+
+        value = self.cache.get(key)
+        if local is not None and invalidations == self._invalidations:
+            ttl = settings.SENTRY_LOCAL_CACHE_TTL if value is not None else self.negative_ttl
+            local.set(key, (now + ttl, value))
+        return value
+
+    def set(self, key, value, timeout):
+        """
+        Set the value of ``key``, ``timeout=None`` keeps it until it is
+        evicted from the shared cache.
+        """
+        self.cache.set(key, value, timeout)
+        self._set_local(key, value, timeout)
+
+    def add(self, key, value, timeout):
+        """
+        Set the value of ``key`` unless the shared cache already holds one,
+        and return whether it was set.
+        """
+        if not self.cache.add(key, value, timeout):
+            # Whatever is cached here for the key (such as a miss) is out of
+            # date.
+            request_cache.delete(key)
+            local = self._get_local()
+            if local is not None:
+                local.delete(key)
+            return False
+
+        self._set_local(key, value, timeout)
+        return True
+
+    def _set_local(self, key, value, timeout):
+        request_cache.set(key, value)
+        if settings.SENTRY_LOCAL_CACHE_SIZE:
+            local = self._get_local()
+            if local is not None:
+                ttl = settings.SENTRY_LOCAL_CACHE_TTL
+                if timeout is not None:
+                    ttl = min(timeout, ttl)
+                local.set(key, (time.time() + ttl, value))
+            self._publish(key)
+
+    def delete(self, key):
+        self.cache.delete(key)
+        request_cache.delete(key)
+        if settings.SENTRY_LOCAL_CACHE_SIZE:
+            local = self._get_local()
+            if local is not None:
+                local.delete(key)
+            self._publish(key)
+
+
+local_cache = LocalCache()
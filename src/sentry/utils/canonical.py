@@ -102,6 +102,14 @@ class CanonicalKeyDict(collections.MutableMapping):
             legacy = settings.PREFER_CANONICAL_LEGACY_KEYS
         norm_func = legacy and get_legacy_name or get_canonical_name
         self._norm_func = norm_func
+
+        # Mappings that decode their values lazily (such as sectioned nodes)
+        # can rename their keys without decoding anything.
+        rekey = getattr(data, 'rekey', None)
+        if rekey is not None:
+            self.data = rekey(norm_func)
+            return
+
         self.data = {}
         for key, value in six.iteritems(data):
             canonical_key = norm_func(key)
@@ -0,0 +1,209 @@
+"""
+sentry.utils.codecs
+~~~~~~~~~~~~~~~~~~~
+
+Versioned encodings for the dictionaries that are stored in text columns
+(``GzippedDictField`` and ``NodeField``.)
+
+Every encoded value starts with a type byte that identifies the serializer
+and compressor that were used, and is stored base64 encoded. Values written
+before the type byte existed are a zlib compressed pickle, and always start
+with a zlib header (``0x78``), which is never used as a type byte, so they
+can be read transparently.
+
+Versions that predate the type byte can only read the legacy format, which is
+why it is still written by default (see ``SENTRY_FIELD_CODEC``.)
+
+:copyright: (c) 2010-2019 by the Sentry Team, see AUTHORS for more details.
+:license: BSD, see LICENSE for more details.
+"""
+from __future__ import absolute_import
+
+import base64
+import msgpack
+import six
+import zlib
+
+from sentry.utils.compat import pickle
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+__all__ = ('Codec', 'FieldCodec', 'get_field_codec')
+
+# The first byte of a zlib stream with the default window size.
+LEGACY_HEADER = 0x78
+
+
+class Codec(object):
+    def encode(self, value):
+        raise NotImplementedError
+
+    def decode(self, value):
+        raise NotImplementedError
+
+
+class PickleCodec(Codec):
+    def encode(self, value):
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, value):
+        return pickle.loads(value)
+
+
+class MsgpackCodec(Codec):
+    """
+    Serializes values with msgpack. Values that would not be decoded as the
+    same types, such as tuples and subclasses of ``dict``, raise
+    ``TypeError`` like values that msgpack does not support at all.
+    """
+
+    def encode(self, value):
+        return msgpack.packb(value, use_bin_type=True, strict_types=True)
+
+    def decode(self, value):
+        return msgpack.unpackb(value, raw=False)
+
+
+class ZlibCodec(Codec):
+    def __init__(self, level=6):
+        self.level = level
+
+    def encode(self, value):
+        return zlib.compress(value, self.level)
+
+    def decode(self, value):
+        return zlib.decompress(value)
+
+
+class ZstdCodec(Codec):
+    def __init__(self, level=3):
+        if zstandard is None:
+            raise ImportError('The zstandard package is required for zstd compression.')
+        self.level = level
+
+    # Compression contexts are not thread safe, so a new one is created for
+    # every call (which is cheap compared to the compression itself.)
+    def encode(self, value):
+        return zstandard.ZstdCompressor(level=self.level).compress(value)
+
+    def decode(self, value):
+        return zstandard.ZstdDecompressor().decompress(value)
+
+
+SERIALIZERS = {
+    'pickle': PickleCodec,
+    'msgpack': MsgpackCodec,
+}
+
+COMPRESSORS = {
+    'zlib': ZlibCodec,
+    'zstd': ZstdCodec,
+}
+
+# Type bytes must never change once they have been used to store values.
+FORMATS = {
+    0x01: ('pickle', 'zlib'),
+    0x02: ('msgpack', 'zlib'),
+    0x03: ('pickle', 'zstd'),
+    0x04: ('msgpack', 'zstd'),
+}
+
+TYPES = {format: type for type, format in six.iteritems(FORMATS)}
+
+assert LEGACY_HEADER not in FORMATS
+
+
+class FieldCodec(Codec):
+    """
+    Encodes values with ``serializer`` and ``compressor``, and decodes values
+    written in any known format (including the legacy format.)
+
+    Values that can not be serialized with ``serializer`` are pickled instead.
+    The ``legacy`` serializer writes the legacy format, without a type byte.
+    """
+
+    def __init__(self, serializer='msgpack', compressor='zlib', level=None):
+        self._decoders = {}
+        if serializer == 'legacy':
+            if compressor != 'zlib':
+                raise ValueError('The legacy format is always compressed with zlib.')
+            self.type = self.fallback_type = None
+            return
+
+        self.type = TYPES[(serializer, compressor)]
+        self.serializer = SERIALIZERS[serializer]()
+        self.fallback_type = TYPES[('pickle', compressor)]
+        self.fallback_serializer = SERIALIZERS['pickle']()
+        self.compressor = COMPRESSORS[compressor](**({'level': level} if level is not None else {}))
+
+    def _get_decoder(self, type):
+        decoder = self._decoders.get(type)
+        if decoder is None:
+            serializer, compressor = FORMATS[type]
+            decoder = self._decoders[type] = (
+                SERIALIZERS[serializer](), COMPRESSORS[compressor](),
+            )
+        return decoder
+
+    def dumps(self, value):
+        """
+        Encode ``value``, returning bytes.
+        """
+        if self.type is None:
+            return zlib.compress(pickle.dumps(value))
+
+        try:
+            type, payload = self.type, self.serializer.encode(value)
+        except (TypeError, ValueError, OverflowError):
+            type, payload = self.fallback_type, self.fallback_serializer.encode(value)
+        return six.int2byte(type) + self.compressor.encode(payload)
+
+    def loads(self, value):
+        """
+        Decode bytes returned by ``dumps``, or a legacy compressed pickle.
+        """
+        type = six.indexbytes(value, 0)
+        if type == LEGACY_HEADER:
+            return pickle.loads(zlib.decompress(value))
+
+        try:
+            serializer, compressor = self._get_decoder(type)
+        except KeyError:
+            raise ValueError('Unknown codec type: 0x%02x' % (type, ))
+        return serializer.decode(compressor.decode(value[1:]))
+
+    def encode(self, value):
+        # This returns a unicode string rather than bytes, as the Django ORM
+        # works with unicode objects.
+        return base64.b64encode(self.dumps(value)).decode('utf-8')
+
+    def decode(self, value):
+        return self.loads(base64.b64decode(value))
+
+    def get_type(self, value):
+        """
+        Return the type byte of an encoded value, or ``None`` for legacy
+        values (which is also the ``type`` of the legacy codec.)
+        """
+        type = six.indexbytes(base64.b64decode(value[:4]), 0)
+        return None if type == LEGACY_HEADER else type
+
+
+_field_codec = (None, None)
+
+
+def get_field_codec():
+    """
+    Return the codec configured by ``SENTRY_FIELD_CODEC``.
+    """
+    global _field_codec
+    from django.conf import settings
+    options, codec = _field_codec
+    if options != settings.SENTRY_FIELD_CODEC:
+        options = dict(settings.SENTRY_FIELD_CODEC)
+        codec = FieldCodec(**options)
+        _field_codec = (options, codec)
+    return codec
@@ -105,6 +105,16 @@ def pytest_configure(config):
 
     settings.DISABLE_RAVEN = True
 
+    # Rows are rolled back between tests, so process local caches could hold
+    # rows that no longer exist.
+    settings.SENTRY_GROUPHASH_CACHE_TTL = 0
+    settings.SENTRY_LOCAL_CACHE_SIZE = 0
+    settings.SENTRY_SOURCEMAP_CACHE_SIZE = 0
+
+    # Fetch threads use their own database connections, which can not see
+    # the rows created in the transaction of a test.
+    settings.SENTRY_SCRAPE_JAVASCRIPT_CONCURRENCY = 1
+
     settings.CACHES = {
         'default': {
             'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
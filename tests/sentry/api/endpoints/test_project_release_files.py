@@ -4,6 +4,7 @@ import six
 
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.urlresolvers import reverse
+from django.db.models.signals import post_save
 
 from sentry.models import File, Release, ReleaseFile
 from sentry.testutils import APITestCase
@@ -92,6 +93,52 @@ class ReleaseFileCreateTest(APITestCase):
             'X-SourceMap': 'http://example.com',
         }
 
+    def test_bumps_cache_version_after_commit(self):
+        project = self.create_project(name='foo')
+
+        release = Release.objects.create(
+            organization_id=project.organization_id,
+            version='1',
+        )
+        release.add_project(project)
+
+        versions = []
+
+        def record_version(instance, **kwargs):
+            versions.append(ReleaseFile.get_cache_version(instance.release_id))
+
+        url = reverse(
+            'sentry-api-0-project-release-files',
+            kwargs={
+                'organization_slug': project.organization.slug,
+                'project_slug': project.slug,
+                'version': release.version,
+            }
+        )
+
+        self.login_as(user=self.user)
+
+        post_save.connect(record_version, sender=ReleaseFile, weak=False)
+        try:
+            response = self.client.post(
+                url, {
+                    'name': 'http://example.com/application.js',
+                    'file': SimpleUploadedFile(
+                        'application.js', b'function() { }',
+                        content_type='application/javascript'
+                    ),
+                },
+                format='multipart'
+            )
+        finally:
+            post_save.disconnect(record_version, sender=ReleaseFile)
+
+        assert response.status_code == 201, response.content
+        # An index cached with the version seen while the file was saved is
+        # not used anymore.
+        assert len(versions) == 1
+        assert ReleaseFile.get_cache_version(release.id) != versions[0]
+
     def test_no_file(self):
         project = self.create_project(name='foo')
 
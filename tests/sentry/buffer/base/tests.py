@@ -65,3 +65,54 @@ class BufferTest(TestCase):
         self.buf.process(ReleaseProject, columns, filters)
         release_project_ = ReleaseProject.objects.get(id=release_project.id)
         assert release_project_.new_groups == 1
+
+    def test_process_batch_merges_and_updates(self):
+        project = self.create_project()
+        group = self.create_group(project=project)
+        other = self.create_group(project=project)
+        the_date = (timezone.now() + timedelta(days=5))
+        self.buf.process_batch([
+            (Group, {'times_seen': 1}, {'id': group.id}, {'last_seen': the_date}),
+            (Group, {'times_seen': 2}, {'id': other.id}, {'last_seen': the_date}),
+            (Group, {'times_seen': 3}, {'id': group.id}, {'last_seen': the_date}),
+        ])
+        group_ = Group.objects.get(id=group.id)
+        assert group_.times_seen == group.times_seen + 4
+        assert group_.last_seen == the_date
+        other_ = Group.objects.get(id=other.id)
+        assert other_.times_seen == other.times_seen + 2
+        assert other_.last_seen == the_date
+
+    def test_process_batch_creates_missing_rows(self):
+        group = Group.objects.create(project=Project(id=1))
+        self.buf.process_batch([
+            (Group, {'times_seen': 1}, {'id': group.id, 'project_id': 1}, None),
+            (Group, {'times_seen': 1}, {'message': 'foo bar', 'project_id': 1}, None),
+        ])
+        assert Group.objects.get(id=group.id).times_seen == group.times_seen + 1
+        assert Group.objects.get(message='foo bar').times_seen == 2
+
+    @mock.patch('sentry.buffer.base.buffer_incr_complete')
+    def test_process_batch_sends_signal(self, buffer_incr_complete):
+        org = Organization.objects.create(slug='test-org')
+        project = Project.objects.create(organization=org, slug='test-project')
+        release = Release.objects.create(organization=org, version='abcdefg')
+        release2 = Release.objects.create(organization=org, version='hijklmn')
+        rp = ReleaseProject.objects.create(project=project, release=release)
+        rp2 = ReleaseProject.objects.create(project=project, release=release2)
+
+        self.buf.process_batch([
+            (ReleaseProject, {'new_groups': 1}, {'id': rp.id}, None),
+            (ReleaseProject, {'new_groups': 1}, {'id': rp2.id}, None),
+        ])
+        assert ReleaseProject.objects.get(id=rp.id).new_groups == 1
+        assert ReleaseProject.objects.get(id=rp2.id).new_groups == 1
+        assert len(buffer_incr_complete.send_robust.mock_calls) == 2
+        buffer_incr_complete.send_robust.assert_any_call(
+            model=ReleaseProject,
+            columns={'new_groups': 1},
+            filters={'id': rp.id},
+            extra=None,
+            created=False,
+            sender=ReleaseProject,
+        )
@@ -0,0 +1,63 @@
+from __future__ import absolute_import
+
+import mock
+import pytest
+
+from sentry.buffer.combining import CombiningBuffer
+from sentry.models import Group, Project
+from sentry.testutils import TestCase
+
+
+class CombiningBufferTest(TestCase):
+    def setUp(self):
+        self.buf = CombiningBuffer(backend='sentry.buffer.base.Buffer', max_size=3, max_age=60)
+        self.buf.backend = mock.Mock()
+
+    def test_incr_combines(self):
+        self.buf.incr(Group, {'times_seen': 1}, {'id': 1}, {'last_seen': 1, 'message': 'foo'})
+        self.buf.incr(Group, {'times_seen': 2}, {'id': 1}, {'last_seen': 2})
+        self.buf.incr(Project, {'times_seen': 1}, {'id': 1})
+        assert self.buf.backend.incr.mock_calls == []
+
+        self.buf.flush()
+        assert self.buf.backend.incr.mock_calls == [
+            mock.call(Group, {'times_seen': 3}, {'id': 1}, {'last_seen': 2, 'message': 'foo'}),
+            mock.call(Project, {'times_seen': 1}, {'id': 1}, None),
+        ]
+
+        self.buf.flush()
+        assert len(self.buf.backend.incr.mock_calls) == 2
+
+    def test_incr_flushes_when_full(self):
+        for i in range(3):
+            self.buf.incr(Group, {'times_seen': 1}, {'id': i})
+        assert len(self.buf.backend.incr.mock_calls) == 3
+
+    @mock.patch('sentry.buffer.combining.time')
+    def test_incr_flushes_when_old(self, time):
+        time.return_value = 0
+        self.buf.incr(Group, {'times_seen': 1}, {'id': 1})
+        assert self.buf.backend.incr.mock_calls == []
+        time.return_value = 61
+        self.buf.incr(Group, {'times_seen': 1}, {'id': 1})
+        assert self.buf.backend.incr.mock_calls == [
+            mock.call(Group, {'times_seen': 2}, {'id': 1}, None),
+        ]
+
+    def test_flush_keeps_unwritten_on_error(self):
+        self.buf.incr(Group, {'times_seen': 1}, {'id': 1}, {'last_seen': 1})
+        self.buf.incr(Group, {'times_seen': 1}, {'id': 2})
+        self.buf.backend.incr.side_effect = [None, Exception('boom')]
+        with pytest.raises(Exception):
+            self.buf.flush()
+
+        self.buf.backend.incr.side_effect = None
+        self.buf.backend.incr.reset_mock()
+        self.buf.flush()
+        assert self.buf.backend.incr.mock_calls == [
+            mock.call(Group, {'times_seen': 1}, {'id': 2}, None),
+        ]
+
+    def test_process_delegates(self):
+        self.buf.process(batch_keys=['foo'])
+        self.buf.backend.process.assert_called_once_with(batch_keys=['foo'])
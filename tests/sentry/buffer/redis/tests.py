@@ -2,14 +2,16 @@
 
 from __future__ import absolute_import
 
-import pytest
 import mock
 
 from datetime import datetime
 from django.utils import timezone
 from sentry.buffer.redis import RedisBuffer
-from sentry.models import Group, Project
+from sentry.models import Group, Project, Release, ReleaseProject
+from sentry.queue.routers import get_counter_queues
 from sentry.testutils import TestCase
+from sentry.utils import json
+from sentry.utils.compat import pickle
 
 
 class RedisBufferTest(TestCase):
@@ -56,6 +58,63 @@ class RedisBufferTest(TestCase):
         client = self.buf.cluster.get_routing_client()
         assert client.zrange('b:p', 0, -1) == []
 
+    @mock.patch('sentry.buffer.redis.process_incr')
+    def test_process_pending_chunks(self, process_incr):
+        self.buf.incr_batch_size = 2
+        self.buf.pending_chunk_size = 2
+        with self.buf.cluster.map() as client:
+            client.zadd('b:p', 1, 'foo')
+            client.zadd('b:p', 2, 'bar')
+            client.zadd('b:p', 3, 'baz')
+        self.buf.process_pending()
+        assert process_incr.apply_async.mock_calls == [
+            mock.call(kwargs={'batch_keys': ['foo', 'bar']}),
+            mock.call(kwargs={'batch_keys': ['baz']}),
+        ]
+        client = self.buf.cluster.get_routing_client()
+        assert client.zrange('b:p', 0, -1) == []
+
+    @mock.patch('sentry.buffer.redis.time')
+    @mock.patch('sentry.buffer.redis.process_incr')
+    def test_process_pending_time_budget(self, process_incr, time):
+        time.side_effect = [0, 60]
+        self.buf.incr_batch_size = 5
+        self.buf.pending_chunk_size = 2
+        with self.buf.cluster.map() as client:
+            client.zadd('b:p', 1, 'foo')
+            client.zadd('b:p', 2, 'bar')
+            client.zadd('b:p', 3, 'baz')
+        self.buf.process_pending()
+        assert process_incr.apply_async.mock_calls == [
+            mock.call(kwargs={'batch_keys': ['foo', 'bar']}),
+        ]
+        client = self.buf.cluster.get_routing_client()
+        assert client.zrange('b:p', 0, -1) == ['baz']
+
+    @mock.patch('sentry.buffer.redis.RedisBuffer._get_incr_queue_depth',
+                mock.Mock(return_value=100))
+    @mock.patch('sentry.buffer.redis.process_incr')
+    def test_process_pending_backpressure(self, process_incr):
+        self.buf.pending_max_queue_depth = 10
+        with self.buf.cluster.map() as client:
+            client.zadd('b:p', 1, 'foo')
+        self.buf.process_pending()
+        assert process_incr.apply_async.mock_calls == []
+        client = self.buf.cluster.get_routing_client()
+        assert client.zrange('b:p', 0, -1) == ['foo']
+
+    @mock.patch('sentry.monitoring.queues.backend')
+    def test_get_incr_queue_depth(self, backend):
+        backend.bulk_get_sizes.return_value = [('counters-0', 5), ('counters-1', 12)]
+        assert self.buf._get_incr_queue_depth() == 12
+        assert backend.bulk_get_sizes.mock_calls == [mock.call(get_counter_queues())]
+        assert get_counter_queues() == ['counters-0']
+
+        backend.reset_mock()
+        self.buf.pending_queues = ['counters-0', 'counters-1']
+        assert self.buf._get_incr_queue_depth() == 12
+        assert backend.bulk_get_sizes.mock_calls == [mock.call(['counters-0', 'counters-1'])]
+
     @mock.patch('sentry.buffer.redis.RedisBuffer._make_key', mock.Mock(return_value='foo'))
     @mock.patch('sentry.buffer.base.Buffer.process')
     def test_process_does_bubble_up_json(self, process):
@@ -93,11 +152,84 @@ class RedisBufferTest(TestCase):
         self.buf.process('foo')
         process.assert_called_once_with(Group, columns, filters, extra)
 
-    # this test should be passing once we no longer serialize using pickle
-    @pytest.mark.xfail
+    @mock.patch('sentry.buffer.base.Buffer.process_batch')
+    def test_process_batch_flush(self, process_batch):
+        self.buf.batch_flush = True
+        client = self.buf.cluster.get_routing_client()
+        client.hmset(
+            'foo', {
+                'e+foo': '["s","bar"]',
+                'f': '{"pk": ["i","1"]}',
+                'i+times_seen': '2',
+                'm': 'sentry.models.Group',
+            }
+        )
+        client.hmset(
+            'bar', {
+                'f': '{"pk": ["i","2"]}',
+                'i+times_seen': '3',
+                'm': 'sentry.models.Group',
+            }
+        )
+        client.zadd('b:p', 1, 'foo')
+        client.zadd('b:p', 2, 'bar')
+        self.buf.process(batch_keys=['foo', 'bar', 'foo', 'baz'])
+        process_batch.assert_called_once_with([
+            (Group, {'times_seen': 2}, {'pk': 1}, {'foo': 'bar'}),
+            (Group, {'times_seen': 3}, {'pk': 2}, {}),
+        ])
+        assert client.zrange('b:p', 0, -1) == []
+        assert not client.exists('foo')
+        assert not client.exists('bar')
+        assert not client.exists('l:foo')
+
+    def test_process_batch_flush_writes_rows(self):
+        buf = RedisBuffer(batch_flush=True)
+        group = self.create_group(project=self.project, times_seen=1)
+        existing = Release.objects.create(organization_id=self.organization.id, version='a')
+        existing.add_project(self.project)
+        missing = Release.objects.create(organization_id=self.organization.id, version='b')
+
+        with mock.patch('sentry.buffer.redis.process_incr', mock.Mock()):
+            # a row of its own shape
+            buf.incr(Group, {'times_seen': 2}, {'pk': group.id})
+            # a row that exists, and a row that has to be created
+            for release in (existing, missing):
+                buf.incr(ReleaseProject, {'new_groups': 1}, {
+                    'release_id': release.id,
+                    'project_id': self.project.id,
+                })
+
+        client = buf.cluster.get_routing_client()
+        buf.process(batch_keys=client.zrange('b:p', 0, -1))
+
+        assert Group.objects.get(id=group.id).times_seen == 3
+        assert ReleaseProject.objects.get(release=existing, project=self.project).new_groups == 1
+        assert ReleaseProject.objects.get(release=missing, project=self.project).new_groups == 1
+        assert client.zrange('b:p', 0, -1) == []
+
+    @mock.patch('sentry.buffer.base.Buffer.process_batch')
+    def test_process_batch_flush_skips_locked(self, process_batch):
+        self.buf.batch_flush = True
+        client = self.buf.cluster.get_routing_client()
+        client.hmset(
+            'foo', {
+                'f': '{"pk": ["i","1"]}',
+                'i+times_seen': '2',
+                'm': 'sentry.models.Group',
+            }
+        )
+        client.set('l:bar', '1')
+        self.buf.process(batch_keys=['foo', 'bar'])
+        process_batch.assert_called_once_with([
+            (Group, {'times_seen': 2}, {'pk': 1}, {}),
+        ])
+        assert client.get('l:bar') == '1'
+
     @mock.patch('sentry.buffer.redis.RedisBuffer._make_key', mock.Mock(return_value='foo'))
     @mock.patch('sentry.buffer.redis.process_incr', mock.Mock())
     def test_incr_saves_to_redis(self):
+        self.buf.value_encoding = 'json'
         now = datetime(2017, 5, 3, 6, 6, 6, tzinfo=timezone.utc)
         client = self.buf.cluster.get_routing_client()
         model = mock.Mock()
@@ -106,10 +238,13 @@ class RedisBufferTest(TestCase):
         filters = {'pk': 1, 'datetime': now}
         self.buf.incr(model, columns, filters, extra={'foo': 'bar', 'datetime': now})
         result = client.hgetall('foo')
+        assert json.loads(result.pop('f')) == {
+            'pk': ['i', '1'],
+            'datetime': ['d', '1493791566.000000'],
+        }
         assert result == {
             'e+foo': '["s","bar"]',
             'e+datetime': '["d","1493791566.000000"]',
-            'f': '{"pk":["i","1"],"datetime":["d","1493791566.000000"]}',
             'i+times_seen': '1',
             'm': 'mock.mock.Mock',
         }
@@ -117,16 +252,52 @@ class RedisBufferTest(TestCase):
         assert pending == ['foo']
         self.buf.incr(model, columns, filters, extra={'foo': 'baz'})
         result = client.hgetall('foo')
+        assert json.loads(result.pop('f')) == {
+            'pk': ['i', '1'],
+            'datetime': ['d', '1493791566.000000'],
+        }
         assert result == {
             'e+foo': '["s","baz"]',
             'e+datetime': '["d","1493791566.000000"]',
-            'f': '{"pk":["i","1"],"datetime":["d","1493791566.000000"]}',
             'i+times_seen': '2',
             'm': 'mock.mock.Mock',
         }
         pending = client.zrange('b:p', 0, -1)
         assert pending == ['foo']
 
+    @mock.patch('sentry.buffer.redis.RedisBuffer._make_key', mock.Mock(return_value='foo'))
+    @mock.patch('sentry.buffer.redis.process_incr', mock.Mock())
+    def test_incr_saves_pickle_by_default(self):
+        client = self.buf.cluster.get_routing_client()
+        self.buf.incr(Group, {'times_seen': 1}, {'pk': 1}, extra={'foo': 'bar'})
+        result = client.hgetall('foo')
+        assert pickle.loads(result['f']) == {'pk': 1}
+        assert pickle.loads(result['e+foo']) == 'bar'
+
+    @mock.patch('sentry.buffer.redis.RedisBuffer._make_key', mock.Mock(return_value='foo'))
+    @mock.patch('sentry.buffer.redis.process_incr', mock.Mock())
+    @mock.patch('sentry.buffer.base.Buffer.process')
+    def test_incr_round_trips_values(self, process):
+        self.buf.value_encoding = 'json'
+        now = datetime(2017, 5, 3, 6, 6, 6, tzinfo=timezone.utc)
+        extra = {
+            'none': None,
+            'flag': True,
+            'level': 40,
+            'data': {'type': 'default', 'metadata': {'title': u'foo'}, 'last_received': 1.5},
+            'last_seen': now,
+            # not representable as JSON, so this falls back to pickle
+            'date_data': {'last_seen': now},
+        }
+        self.buf.incr(Group, {'times_seen': 1}, {'pk': 1, 'project': None}, extra=extra)
+        client = self.buf.cluster.get_routing_client()
+        result = client.hgetall('foo')
+        assert result['e+date_data'].startswith('(')
+        assert json.loads(result['e+data'])[0] == 'j'
+        self.buf.process('foo')
+        process.assert_called_once_with(
+            Group, {'times_seen': 1}, {'pk': 1, 'project': None}, extra)
+
     @mock.patch('sentry.buffer.redis.RedisBuffer._make_key', mock.Mock(return_value='foo'))
     @mock.patch('sentry.buffer.redis.process_incr')
     @mock.patch('sentry.buffer.redis.process_pending')
@@ -23,3 +23,16 @@ class RedisCacheTest(TestCase):
 
         with self.assertRaises(ValueTooLarge):
             self.backend.set('foo', 'x' * (RedisCache.max_size + 1), 0)
+
+    def test_many(self):
+        self.backend.set_many({'foo': {'foo': 'bar'}, 'bar': [1, 2]}, 50)
+
+        assert self.backend.get('foo') == {'foo': 'bar'}
+        assert self.backend.get_many(['foo', 'bar', 'baz']) == {
+            'foo': {'foo': 'bar'},
+            'bar': [1, 2],
+        }
+        assert self.backend.get_many([]) == {}
+
+        with self.assertRaises(ValueTooLarge):
+            self.backend.set_many({'foo': 'x' * (RedisCache.max_size + 1)}, 0)
@@ -35,7 +35,8 @@ class TestConsumer(PluginTestCase):
         value = json.loads(kwargs['value'])
 
         consumer = ConsumerWorker()
-        consumer._handle(topic, value)
+        result = consumer._handle(topic, value)
+        consumer.flush_batch([result])
 
     def _create_event_with_platform(self, project, platform):
         from sentry.event_manager import EventManager
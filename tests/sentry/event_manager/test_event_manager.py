@@ -14,7 +14,7 @@ from time import time
 
 from sentry.app import tsdb
 from sentry.constants import MAX_VERSION_LENGTH
-from sentry.event_manager import HashDiscarded, EventManager, EventUser
+from sentry.event_manager import HashDiscarded, EventManager, EventUser, SaveBatch
 from sentry.grouping.utils import hash_from_values
 from sentry.models import (
     Activity, Environment, Event, ExternalIssue, Group, GroupEnvironment,
@@ -22,6 +22,8 @@ from sentry.models import (
     GroupTombstone, EventMapping, Integration, Release,
     ReleaseProjectEnvironment, OrganizationIntegration, UserReport, EventAttachment, File
 )
+from sentry.models.grouphash import grouphash_cache
+from sentry.seenevents.redis import RedisSeenEvents
 from sentry.signals import event_discarded, event_saved
 from sentry.testutils import assert_mock_called_once_with_partial, TestCase
 from sentry.utils.data_filters import FilterStatKeys
@@ -123,6 +125,68 @@ class EventManagerTest(TestCase):
 
         assert Event.objects.count() == 1
 
+    def test_dupe_message_id_seen_events(self):
+        event_id = 'a' * 32
+
+        with mock.patch('sentry.event_manager.seenevents', RedisSeenEvents()) as seenevents:
+            assert not seenevents.may_contain(self.project.id, event_id)
+
+            manager = EventManager(make_event(event_id=event_id))
+            manager.normalize()
+            event = manager.save(self.project.id)
+
+            assert seenevents.may_contain(self.project.id, event_id)
+
+            manager = EventManager(make_event(event_id=event_id))
+            manager.normalize()
+            assert manager.save(self.project.id).id == event.id
+
+        assert Event.objects.count() == 1
+
+    def test_dupe_message_id_seen_events_failure(self):
+        event_id = 'a' * 32
+
+        seenevents = mock.Mock()
+        seenevents.add.side_effect = Exception('boom')
+        seenevents.may_contain.side_effect = Exception('boom')
+        with mock.patch('sentry.event_manager.seenevents', seenevents):
+            manager = EventManager(make_event(event_id=event_id))
+            manager.normalize()
+            event = manager.save(self.project.id)
+
+            manager = EventManager(make_event(event_id=event_id))
+            manager.normalize()
+            assert manager.save(self.project.id).id == event.id
+
+        assert seenevents.add.called
+        assert seenevents.may_contain.called
+        assert Event.objects.count() == 1
+
+    def test_cached_hash_of_deleted_group(self):
+        manager = EventManager(make_event(event_id='a' * 32, checksum='a' * 32))
+        manager.normalize()
+        grouphash_cache.clear()
+        with self.settings(SENTRY_GROUPHASH_CACHE_TTL=10):
+            event = manager.save(self.project.id)
+            hashes = [gh.hash for gh in GroupHash.objects.filter(group_id=event.group_id)]
+            GroupHash.get_or_create_many(self.project, hashes)
+
+            # Move the hash away without invalidating the cache, like a merge
+            # that raced with this process, then delete the old group.
+            other_group = self.create_group(project=self.project)
+            GroupHash.objects.filter(
+                project=self.project,
+                hash__in=hashes,
+            ).update(group=other_group)
+            Group.objects.filter(id=event.group_id).delete()
+
+            manager = EventManager(make_event(event_id='b' * 32, checksum='a' * 32))
+            manager.normalize()
+            event2 = manager.save(self.project.id)
+
+        assert event2.group_id == other_group.id
+        grouphash_cache.clear()
+
     def test_updates_group(self):
         timestamp = time() - 300
         manager = EventManager(
@@ -766,6 +830,60 @@ class EventManagerTest(TestCase):
         assert query(tsdb.models.project, project.id, environment_id=environment_id) == 1
         assert query(tsdb.models.group, event.group.id, environment_id=environment_id) == 1
 
+    def test_save_batch(self):
+        project = self.project
+        batch = SaveBatch()
+        events = []
+        for event_id in ('a' * 32, 'b' * 32, 'c' * 32):
+            manager = EventManager(make_event(
+                event_id=event_id,
+                fingerprint=['batched fingerprint'],
+                release='1.0',
+                environment='production',
+            ))
+            manager.normalize()
+            events.append(manager.save(project.id, batch=batch))
+
+        assert len(set(event.group_id for event in events)) == 1
+        assert len(set(event.project for event in events)) == 1
+        assert GroupHash.objects.filter(project=project, group=events[0].group).count() == 1
+
+        def query(model, key):
+            date = events[0].datetime
+            return tsdb.get_sums(model, [key], date, date)[key]
+
+        # Time series writes are collected until the batch is flushed.
+        assert query(tsdb.models.group, events[0].group_id) == 0
+        batch.flush()
+        assert query(tsdb.models.group, events[0].group_id) == 3
+        assert query(tsdb.models.release, Release.objects.get(version='1.0').id) == 3
+
+    def test_save_batch_deleted_group(self):
+        project = self.project
+        batch = SaveBatch()
+
+        def save(event_id):
+            manager = EventManager(make_event(event_id=event_id, checksum='a' * 32))
+            manager.normalize()
+            return manager.save(project.id, batch=batch)
+
+        event = save('a' * 32)
+        save('b' * 32)
+
+        other_group = self.create_group(project=project)
+        GroupHash.objects.filter(
+            project=project,
+            group_id=event.group_id,
+        ).update(group=other_group)
+        Group.objects.filter(id=event.group_id).delete()
+
+        assert save('c' * 32).group_id == other_group.id
+        # The batch remembers the hashes of the group they were moved to.
+        with mock.patch.object(GroupHash, 'invalidate_cache') as invalidate_cache:
+            assert save('d' * 32).group_id == other_group.id
+            assert not invalidate_cache.called
+        batch.flush()
+
     @pytest.mark.xfail
     def test_record_frequencies(self):
         project = self.project
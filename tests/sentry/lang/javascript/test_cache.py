@@ -1,6 +1,6 @@
 from __future__ import absolute_import
 
-from sentry.lang.javascript.cache import SourceCache
+from sentry.lang.javascript.cache import SourceCache, ViewCache
 from unittest import TestCase
 
 
@@ -38,3 +38,29 @@ class BasicCacheTest(TestCase):
         # fall back to utf-8
         cache.add(url, 'foobar'.encode('utf-32'), encoding='utf-32')
         assert cache.get(url)[0] == u'foobar'
+
+
+class ViewCacheTest(TestCase):
+    def test_max_size(self):
+        cache = ViewCache(10)
+
+        cache.set('a', 'A', 4)
+        cache.set('b', 'B', 4)
+        assert cache.get('a') == 'A'
+        assert cache.size == 8
+
+        # evicts the least recently used view
+        cache.set('c', 'C', 4)
+        assert cache.get('b') is None
+        assert cache.get('a') == 'A'
+        assert cache.get('c') == 'C'
+        assert cache.size == 8
+
+        # views larger than the cache are not cached
+        cache.set('d', 'D', 11)
+        assert cache.get('d') is None
+        assert len(cache) == 2
+
+        cache.clear()
+        assert cache.get('a') is None
+        assert cache.size == 0
@@ -1,9 +1,13 @@
 from __future__ import absolute_import
 
+import os
 import pytest
 import re
 import responses
+import shutil
 import six
+import tempfile
+import threading
 import unittest
 from symbolic import SourceMapTokenMatch
 
@@ -20,6 +24,8 @@ from sentry.lang.javascript.processor import (
     generate_module,
     trim_line,
     fetch_release_file,
+    fetch_once,
+    read_release_file,
     UnparseableSourcemap,
     get_max_age,
     CACHE_CONTROL_MAX,
@@ -56,6 +62,65 @@ class JavaScriptStacktraceProcessorTest(TestCase):
         r = JavaScriptStacktraceProcessor({}, None, project)
         assert not r.allow_scraping
 
+    @patch('sentry.lang.javascript.processor.close_old_connections')
+    @patch('sentry.lang.javascript.processor.fetch_file')
+    def test_populate_source_cache(self, fetch_file, close_old_connections):
+        def fetch(url, **kwargs):
+            body = 'console.log("hello");\n//# sourceMappingURL=%s' % base64_sourcemap
+            return http.UrlResult(url, {}, body.encode('utf-8'), 200, None)
+
+        fetch_file.side_effect = fetch
+        urls = ['http://example.com/%s.js' % i for i in range(5)]
+
+        with self.settings(SENTRY_SCRAPE_JAVASCRIPT_CONCURRENCY=3):
+            r = JavaScriptStacktraceProcessor({}, None, self.project)
+            r.max_fetches = 4
+            r.populate_source_cache([{'abs_path': url, 'lineno': 1} for url in urls])
+
+        assert fetch_file.call_count == 4
+        # before and after every fetch on the fetch threads
+        assert close_old_connections.call_count == 8
+        errors = [url for url in urls if r.cache.get_errors(url)]
+        assert len(errors) == 1
+        assert r.cache.get_errors(errors[0]) == [{'type': EventError.JS_TOO_MANY_REMOTE_SOURCES}]
+        for url in urls:
+            if url not in errors:
+                assert r.cache.get(url) is not None
+                assert r.sourcemaps.get_link(url)[0] == base64_sourcemap
+                assert r.sourcemaps.get_link(url)[1] is not None
+
+
+class FetchOnceTest(unittest.TestCase):
+    @patch('sentry.lang.javascript.processor.metrics')
+    def test_simple(self, metrics):
+        started = threading.Event()
+        deduplicated = threading.Event()
+        release = threading.Event()
+        calls = []
+        metrics.incr.side_effect = lambda *args, **kwargs: deduplicated.set()
+
+        def fetch(value):
+            calls.append(value)
+            started.set()
+            release.wait()
+            return value
+
+        results = []
+        owner = threading.Thread(target=lambda: results.append(fetch_once('key', fetch, 1)))
+        owner.start()
+        started.wait()
+
+        waiter = threading.Thread(target=lambda: results.append(fetch_once('key', fetch, 2)))
+        waiter.start()
+        deduplicated.wait()
+        release.set()
+        owner.join()
+        waiter.join()
+
+        assert calls == [1]
+        assert results == [1, 1]
+        assert fetch_once('key', fetch, 3) == 3
+
 
 class FetchReleaseFileTest(TestCase):
     def test_unicode(self):
@@ -98,6 +163,67 @@ class FetchReleaseFileTest(TestCase):
 
         assert result == new_result
 
+    def test_changed_file(self):
+        project = self.project
+        release = Release.objects.create(
+            organization_id=project.organization_id,
+            version='abc',
+        )
+        release.add_project(project)
+
+        file = File.objects.create(name='file.min.js', type='release.file')
+        file.putfile(six.BytesIO(b'foo'))
+        releasefile = ReleaseFile.objects.create(
+            name='file.min.js',
+            release=release,
+            organization_id=project.organization_id,
+            file=file,
+        )
+
+        assert fetch_release_file('file.min.js', release).body == b'foo'
+
+        file = File.objects.create(name='file.min.js', type='release.file')
+        file.putfile(six.BytesIO(b'bar'))
+        releasefile.update(file=file)
+
+        assert fetch_release_file('file.min.js', release).body == b'bar'
+
+        releasefile.delete()
+
+        assert fetch_release_file('file.min.js', release) is None
+
+    def test_disk_cache(self):
+        project = self.project
+        release = Release.objects.create(
+            organization_id=project.organization_id,
+            version='abc',
+        )
+        release.add_project(project)
+
+        file = File.objects.create(name='file.min.js', type='release.file')
+        file.putfile(six.BytesIO(b'foo'))
+        ReleaseFile.objects.create(
+            name='file.min.js',
+            release=release,
+            organization_id=project.organization_id,
+            file=file,
+        )
+
+        cache_dir = tempfile.mkdtemp()
+        try:
+            with self.settings(SENTRY_RELEASE_FILE_CACHE_DIR=cache_dir):
+                assert fetch_release_file('file.min.js', release).body == b'foo'
+
+                path = os.path.join(cache_dir, file.checksum[:2], file.checksum)
+                with open(path, 'rb') as fp:
+                    assert fp.read() == b'foo'
+
+                with patch.object(File, 'getfile') as getfile:
+                    assert read_release_file(file)[1] == b'foo'
+                    assert not getfile.called
+        finally:
+            shutil.rmtree(cache_dir)
+
     def test_distribution(self):
         project = self.project
         release = Release.objects.create(
@@ -503,6 +629,13 @@ class FetchSourcemapTest(TestCase):
         with pytest.raises(UnparseableSourcemap):
             fetch_sourcemap('data:application/json;base64,xxx')
 
+    def test_view_cache(self):
+        with self.settings(SENTRY_SOURCEMAP_CACHE_SIZE=1024):
+            smap_view = fetch_sourcemap(base64_sourcemap)
+            assert fetch_sourcemap(base64_sourcemap) is smap_view
+
+        assert fetch_sourcemap(base64_sourcemap) is not smap_view
+
     @responses.activate
     def test_garbage_json(self):
         responses.add(
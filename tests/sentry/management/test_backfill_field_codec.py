@@ -0,0 +1,44 @@
+from __future__ import absolute_import
+
+from django.core.management import call_command
+from six import StringIO
+
+from sentry.models import Group
+from sentry.testutils import TestCase
+from sentry.utils.codecs import TYPES, get_field_codec
+
+MSGPACK = {'serializer': 'msgpack', 'compressor': 'zlib'}
+
+
+class BackfillFieldCodecTest(TestCase):
+    def get_type(self, group):
+        value = Group.objects.filter(id=group.id).values_list('data', flat=True)[0]
+        return get_field_codec().get_type(value)
+
+    def backfill(self):
+        out = StringIO()
+        call_command('backfill_field_codec', 'sentry.Group', stdout=out)
+        return out.getvalue()
+
+    def test_backfill(self):
+        group = self.create_group(data={'foo': 'bar'})
+        # tuples can not be represented by msgpack, so they stay pickled
+        pickled_group = self.create_group(data={'foo': ('bar', 1)})
+
+        assert self.get_type(group) is None
+        assert self.get_type(pickled_group) is None
+
+        with self.settings(SENTRY_FIELD_CODEC=MSGPACK):
+            assert self.backfill() == 'sentry.Group.data: 2 of 2 rows re-encoded\n'
+            assert self.get_type(group) == TYPES[('msgpack', 'zlib')]
+            assert self.get_type(pickled_group) == TYPES[('pickle', 'zlib')]
+            assert Group.objects.get(id=group.id).data['foo'] == 'bar'
+            assert Group.objects.get(id=pickled_group.id).data['foo'] == ('bar', 1)
+
+            # values that are pickled on purpose are not rewritten again
+            assert self.backfill() == 'sentry.Group.data: 0 of 2 rows re-encoded\n'
+
+        # and values can be re-encoded in the legacy format, too
+        assert self.backfill() == 'sentry.Group.data: 2 of 2 rows re-encoded\n'
+        assert self.get_type(group) is None
+        assert self.get_type(pickled_group) is None
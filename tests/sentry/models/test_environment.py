@@ -1,9 +1,11 @@
 from __future__ import absolute_import
 
+import mock
 import pytest
 
 from sentry.models import Environment
 from sentry.testutils import TestCase
+from sentry.utils.cache import local_cache, request_cache
 
 
 class GetOrCreateTest(TestCase):
@@ -37,6 +39,19 @@ class GetOrCreateTest(TestCase):
                 'prod',
             ).id == env.id
 
+    def test_request_cache(self):
+        project = self.create_project()
+
+        request_cache.start()
+        try:
+            env = Environment.get_or_create(project=project, name='prod')
+
+            with self.assertNumQueries(0), mock.patch.object(local_cache, '_get') as get:
+                assert Environment.get_or_create(project=project, name='prod').id == env.id
+            assert not get.called
+        finally:
+            request_cache.finish()
+
 
 @pytest.mark.parametrize('val,expected', [
     ('42', True),
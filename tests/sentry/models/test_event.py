@@ -4,9 +4,12 @@ import pytest
 import pickle
 
 from sentry.models import Environment
+from sentry.models.event import EventDict
 from sentry.db.models.fields.node import NodeData
 from sentry.event_manager import EventManager
+from sentry.nodestore.sectioned import SectionedFormat
 from sentry.testutils import TestCase
+from sentry.utils import json
 
 
 class EventTest(TestCase):
@@ -192,6 +195,24 @@ def test_renormalization(monkeypatch, factories, task_runner, default_project):
     assert len(normalize_mock_calls) == 1
 
 
+def test_sectioned_data_is_not_renormalized(monkeypatch):
+    def normalize(*args, **kwargs):
+        raise AssertionError('normalize_event must not be called')
+
+    monkeypatch.setattr('semaphore.processing.StoreNormalizer.normalize_event',
+                        normalize)
+
+    format = SectionedFormat(dumps=json.dumps, loads=json.loads, section_size=64)
+    data = format.decode(format.encode({
+        'message': 'hello',
+        'extra': {'foo': 'x' * 100},
+    }))
+    event_data = EventDict(data)
+    assert event_data.data.decoded_sections == 0
+    assert event_data['extra'] == {'foo': 'x' * 100}
+    assert event_data.data.decoded_sections == 1
+
+
 class EventGetLegacyMessageTest(TestCase):
     def test_message(self):
         event = self.create_event(message='foo bar')
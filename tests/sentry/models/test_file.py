@@ -91,3 +91,31 @@ class FileTest(TestCase):
 
         f = file.getfile(prefetch=True)
         assert f.read() == random_data
+
+    def test_multi_chunk_read(self):
+        random_data = os.urandom(1 << 16)
+
+        fileobj = ContentFile(random_data)
+        file = File.objects.create(
+            name='test.bin',
+            type='default',
+            size=len(random_data),
+        )
+        file.putfile(fileobj, 1 << 10)
+
+        with file.getfile() as f:
+            assert f.read() == random_data
+
+            f.seek(0)
+            parts = []
+            while True:
+                part = f.read(3000)
+                if not part:
+                    break
+                parts.append(part)
+            assert b''.join(parts) == random_data
+
+            f.seek(5000)
+            assert f.tell() == 5000
+            assert f.read(10000) == random_data[5000:15000]
+            assert f.tell() == 15000
@@ -1,6 +1,9 @@
 from __future__ import absolute_import
 
+from mock import patch
+
 from sentry.models import GroupHash
+from sentry.models.grouphash import GroupHashCache, grouphash_cache
 from sentry.testutils import TestCase
 
 
@@ -22,3 +25,51 @@ class GroupTest(TestCase):
         assert GroupHash.fetch_last_processed_event_id(
             [grouphash.id, -1],
         ) == ['event', None]
+
+    def test_get_or_create_many(self):
+        project = self.project
+        existing = GroupHash.objects.create(project=project, group=self.group, hash='a' * 32)
+
+        grouphashes = GroupHash.get_or_create_many(project, ['b' * 32, 'a' * 32, 'b' * 32])
+
+        assert [h.hash for h in grouphashes] == ['b' * 32, 'a' * 32, 'b' * 32]
+        assert grouphashes[1].id == existing.id
+        assert grouphashes[1].group_id == self.group.id
+        assert grouphashes[0].id == grouphashes[2].id
+        assert grouphashes[0].group_id is None
+        assert GroupHash.objects.filter(project=project).count() == 2
+
+    def test_cache(self):
+        project = self.project
+        other_group = self.create_group(project=project)
+        grouphash = GroupHash.objects.create(project=project, group=self.group, hash='a' * 32)
+
+        grouphash_cache.clear()
+        with self.settings(SENTRY_GROUPHASH_CACHE_TTL=10):
+            assert GroupHash.get_or_create_many(project, ['a' * 32])[0].group_id == self.group.id
+
+            GroupHash.objects.filter(id=grouphash.id).update(group=other_group)
+            cached, = GroupHash.get_or_create_many(project, ['a' * 32])
+            assert cached.id == grouphash.id
+            assert cached.group_id == self.group.id
+
+            GroupHash.invalidate_cache(project.id)
+            assert GroupHash.get_or_create_many(project, ['a' * 32])[0].group_id == other_group.id
+        grouphash_cache.clear()
+
+    @patch.object(GroupHashCache, '_get_client', side_effect=Exception('boom'))
+    def test_cache_version_failure(self, get_client):
+        project = self.project
+        other_group = self.create_group(project=project)
+        grouphash = GroupHash.objects.create(project=project, group=self.group, hash='a' * 32)
+
+        grouphash_cache.clear()
+        with self.settings(SENTRY_GROUPHASH_CACHE_TTL=10):
+            assert GroupHash.get_or_create_many(project, ['a' * 32])[0].group_id == self.group.id
+
+            GroupHash.objects.filter(id=grouphash.id).update(group=other_group)
+            assert GroupHash.get_or_create_many(project, ['a' * 32])[0].group_id == other_group.id
+
+            GroupHash.invalidate_cache(project.id)
+        assert get_client.called
+        grouphash_cache.clear()
@@ -1,6 +1,9 @@
 from __future__ import absolute_import
 
-from sentry.models import ReleaseFile
+from django.core.cache import cache
+from mock import patch
+
+from sentry.models import File, Release, ReleaseFile, ReleaseFileIndex
 from sentry.testutils import TestCase
 
 
@@ -41,3 +44,91 @@ class ReleaseFileTestCase(TestCase):
             'foo.js',
             '~foo.js',
         ]
+
+
+class ReleaseFileIndexTestCase(TestCase):
+    def test_lookup(self):
+        idents = [ReleaseFile.get_ident('~/%s.js' % i) for i in range(10)]
+        index = ReleaseFileIndex.build(
+            [(ident, i, i + 100, 'a' * 40) for i, ident in enumerate(idents[:-1])]
+            + [(idents[-1], 9, 109, None)]
+        )
+
+        assert len(index) == 10
+        for i, ident in enumerate(idents[:-1]):
+            assert index.get(ident) == (i, i + 100, 'a' * 40)
+        assert index.get(idents[-1]) == (9, 109, None)
+        assert index.get(ReleaseFile.get_ident('~/foo.js')) is None
+        assert ReleaseFileIndex.build([]).get(idents[0]) is None
+
+    def test_get_index(self):
+        release = Release.objects.create(
+            organization_id=self.organization.id,
+            version='abc',
+        )
+        dist = release.add_dist('foo')
+
+        file = File.objects.create(name='foo.js', type='release.file')
+        releasefile = ReleaseFile.objects.create(
+            name='~/foo.js',
+            release=release,
+            organization_id=self.organization.id,
+            file=file,
+        )
+        ident = ReleaseFile.get_ident('~/foo.js')
+
+        assert ReleaseFile.get_index(release.id).get(ident) == (releasefile.id, file.id, None)
+        assert ReleaseFile.get_index(release.id, dist.id).get(ident) is None
+
+        other = ReleaseFile.objects.create(
+            name='~/bar.js',
+            release=release,
+            organization_id=self.organization.id,
+            file=File.objects.create(name='bar.js', type='release.file'),
+        )
+        index = ReleaseFile.get_index(release.id)
+        assert len(index) == 2
+        assert index.get(ReleaseFile.get_ident('~/bar.js'))[0] == other.id
+
+        releasefile.delete()
+        assert ReleaseFile.get_index(release.id).get(ident) is None
+
+    def test_cache_version_evicted(self):
+        release = Release.objects.create(
+            organization_id=self.organization.id,
+            version='abc',
+        )
+        version_key = 'releasefile:version:%s' % (release.id, )
+
+        cache.delete(version_key)
+        assert len(ReleaseFile.get_index(release.id)) == 0
+
+        ReleaseFile.objects.create(
+            name='~/foo.js',
+            release=release,
+            organization_id=self.organization.id,
+            file=File.objects.create(name='foo.js', type='release.file'),
+        )
+
+        # Nothing cached with an earlier version is used once the version
+        # was evicted.
+        cache.delete(version_key)
+        assert len(ReleaseFile.get_index(release.id)) == 1
+        version = ReleaseFile.get_cache_version(release.id)
+        assert version
+        assert ReleaseFile.get_cache_version(release.id) == version
+
+    @patch('sentry.models.releasefile.MAX_INDEX_SIZE', 0)
+    def test_too_many_files(self):
+        release = Release.objects.create(
+            organization_id=self.organization.id,
+            version='abc',
+        )
+        ReleaseFile.objects.create(
+            name='~/foo.js',
+            release=release,
+            organization_id=self.organization.id,
+            file=File.objects.create(name='foo.js', type='release.file'),
+        )
+
+        assert ReleaseFile.get_index(release.id) is None
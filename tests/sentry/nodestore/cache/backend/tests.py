@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import mock
+
+from time import time
+
+from sentry.nodestore.cache.backend import CachingNodeStorage, LRUCache
+from sentry.nodestore.django.models import Node
+from sentry.testutils import TestCase
+
+
+def test_lru_cache():
+    cache = LRUCache(2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    cache.delete('a')
+    assert cache.get('a') is None
+    assert len(cache) == 1
+
+
+class CachingNodeStorageTest(TestCase):
+    def setUp(self):
+        self.ns = CachingNodeStorage(
+            backend='sentry.nodestore.django.DjangoNodeStorage',
+            cache='sentry.cache.redis.RedisCache',
+            name='test',
+        )
+        self.ns.local_cache.clear()
+
+    def tearDown(self):
+        self.ns.local_cache.clear()
+
+    def test_get(self):
+        node = Node.objects.create(id='d2502ebbd7df41ceba8d3275595cac33', data={'foo': 'bar'})
+
+        assert self.ns.get(node.id) == {'foo': 'bar'}
+        with mock.patch.object(self.ns.backend, 'get') as get:
+            result = self.ns.get(node.id)
+            assert result == {'foo': 'bar'}
+            assert not get.called
+
+        # Reads return copies, so mutating them does not affect the cache.
+        result['foo'] = 'baz'
+        assert self.ns.get(node.id) == {'foo': 'bar'}
+
+    def test_get_shared_cache(self):
+        self.ns.set('d2502ebbd7df41ceba8d3275595cac33', {'foo': 'bar'})
+        self.ns.local_cache.clear()
+
+        with mock.patch.object(self.ns.backend, 'get') as get:
+            assert self.ns.get('d2502ebbd7df41ceba8d3275595cac33') == {'foo': 'bar'}
+            assert not get.called
+
+    def test_get_multi(self):
+        Node.objects.create(id='d2502ebbd7df41ceba8d3275595cac33', data={'foo': 'bar'})
+        self.ns.set('5394aa025b8e401ca6bc3ddee3130edc', {'foo': 'baz'})
+
+        with mock.patch.object(
+            self.ns.backend, 'get_multi', wraps=self.ns.backend.get_multi,
+        ) as get_multi:
+            assert self.ns.get_multi(
+                ['d2502ebbd7df41ceba8d3275595cac33', '5394aa025b8e401ca6bc3ddee3130edc'],
+            ) == {
+                'd2502ebbd7df41ceba8d3275595cac33': {'foo': 'bar'},
+                '5394aa025b8e401ca6bc3ddee3130edc': {'foo': 'baz'},
+            }
+            get_multi.assert_called_once_with(['d2502ebbd7df41ceba8d3275595cac33'])
+
+    def test_set_multi(self):
+        self.ns.set_multi({
+            'd2502ebbd7df41ceba8d3275595cac33': {'foo': 'bar'},
+            '5394aa025b8e401ca6bc3ddee3130edc': {'foo': 'baz'},
+        })
+        assert Node.objects.get(id='d2502ebbd7df41ceba8d3275595cac33').data == {'foo': 'bar'}
+        assert self.ns.local_cache.get('5394aa025b8e401ca6bc3ddee3130edc') is not None
+
+    def test_delete(self):
+        self.ns.set('d2502ebbd7df41ceba8d3275595cac33', {'foo': 'bar'})
+        self.ns.delete('d2502ebbd7df41ceba8d3275595cac33')
+
+        assert self.ns.get('d2502ebbd7df41ceba8d3275595cac33') is None
+        assert not Node.objects.filter(id='d2502ebbd7df41ceba8d3275595cac33').exists()
+
+    def test_delete_multi(self):
+        self.ns.set('d2502ebbd7df41ceba8d3275595cac33', {'foo': 'bar'})
+        self.ns.delete_multi(['d2502ebbd7df41ceba8d3275595cac33'])
+
+        assert self.ns.get_multi(['d2502ebbd7df41ceba8d3275595cac33']) == {}
+        assert self.ns.shared_cache.get('d2502ebbd7df41ceba8d3275595cac33', raw=True) is None
+
+    def test_get_multi_shared_cache(self):
+        self.ns.set_multi({
+            'd2502ebbd7df41ceba8d3275595cac33': {'foo': 'bar'},
+            '5394aa025b8e401ca6bc3ddee3130edc': {'foo': 'baz'},
+        })
+        self.ns.local_cache.clear()
+
+        with mock.patch.object(
+            self.ns.shared_cache, 'get_many', wraps=self.ns.shared_cache.get_many,
+        ) as get_many, mock.patch.object(self.ns.backend, 'get_multi') as get_multi:
+            assert self.ns.get_multi(
+                ['d2502ebbd7df41ceba8d3275595cac33', '5394aa025b8e401ca6bc3ddee3130edc'],
+            ) == {
+                'd2502ebbd7df41ceba8d3275595cac33': {'foo': 'bar'},
+                '5394aa025b8e401ca6bc3ddee3130edc': {'foo': 'baz'},
+            }
+            assert get_many.call_count == 1
+            assert not get_multi.called
+
+    def test_local_ttl(self):
+        self.ns.set('d2502ebbd7df41ceba8d3275595cac33', {'foo': 'bar'})
+        # Another process changes the node.
+        self.ns.backend.set('d2502ebbd7df41ceba8d3275595cac33', {'foo': 'baz'})
+        self.ns.shared_cache.delete('d2502ebbd7df41ceba8d3275595cac33')
+        assert self.ns.get('d2502ebbd7df41ceba8d3275595cac33') == {'foo': 'bar'}
+
+        with mock.patch('sentry.nodestore.cache.backend.time',
+                        mock.Mock(return_value=time() + self.ns.local_ttl + 1)):
+            assert self.ns.get('d2502ebbd7df41ceba8d3275595cac33') == {'foo': 'baz'}
+
+    def test_delete_shared_cache_failure(self):
+        self.ns.set('d2502ebbd7df41ceba8d3275595cac33', {'foo': 'bar'})
+
+        with mock.patch.object(self.ns.shared_cache, 'delete', side_effect=Exception('boom')):
+            self.ns.delete('d2502ebbd7df41ceba8d3275595cac33')
+
+        assert not Node.objects.filter(id='d2502ebbd7df41ceba8d3275595cac33').exists()
+        assert self.ns.local_cache.get('d2502ebbd7df41ceba8d3275595cac33') is None
@@ -2,12 +2,19 @@
 
 from __future__ import absolute_import
 
+import six
+
 from datetime import timedelta
 from django.utils import timezone
 
 from sentry.nodestore.django.models import Node
 from sentry.nodestore.django.backend import DjangoNodeStorage
 from sentry.testutils import TestCase
+from sentry.utils.hashlib import sha1_text
+
+# Sections are compressed by the field codec, so this must not compress well
+# to get a section of its own.
+BLOB = [sha1_text(six.text_type(i)).hexdigest() for i in range(100)]
 
 
 class DjangoNodeStorageTest(TestCase):
@@ -65,6 +72,35 @@ class DjangoNodeStorageTest(TestCase):
             'foo': 'baz',
         }
 
+    def test_set_multi_existing(self):
+        Node.objects.create(
+            id='d2502ebbd7df41ceba8d3275595cac33', data={
+                'foo': 'bar',
+            }
+        )
+
+        self.ns.batch_size = 1
+        self.ns.set_multi(
+            {
+                'd2502ebbd7df41ceba8d3275595cac33': {
+                    'foo': 'baz',
+                },
+                '5394aa025b8e401ca6bc3ddee3130edc': {
+                    'foo': 'qux',
+                },
+            }
+        )
+        assert self.ns.get_multi(
+            ['d2502ebbd7df41ceba8d3275595cac33', '5394aa025b8e401ca6bc3ddee3130edc', 'missing']
+        ) == {
+            'd2502ebbd7df41ceba8d3275595cac33': {
+                'foo': 'baz',
+            },
+            '5394aa025b8e401ca6bc3ddee3130edc': {
+                'foo': 'qux',
+            },
+        }
+
     def test_create(self):
         node_id = self.ns.create({
             'foo': 'bar',
@@ -113,3 +149,46 @@ class DjangoNodeStorageTest(TestCase):
 
         assert Node.objects.filter(id=node.id).exists()
         assert not Node.objects.filter(id=node2.id).exists()
+
+    def test_sectioned(self):
+        ns = DjangoNodeStorage(sectioned=True)
+        Node.objects.create(id='5394aa025b8e401ca6bc3ddee3130edc', data={
+            'foo': 'baz',
+        })
+        ns.set('d2502ebbd7df41ceba8d3275595cac33', {
+            'foo': 'bar',
+            'baz': BLOB,
+        })
+
+        result = ns.get('d2502ebbd7df41ceba8d3275595cac33')
+        assert result['foo'] == 'bar'
+        assert result.decoded_sections == 1
+        assert dict(result) == {
+            'foo': 'bar',
+            'baz': BLOB,
+        }
+
+        # Nodes written in the legacy format can still be read.
+        assert ns.get_multi(['5394aa025b8e401ca6bc3ddee3130edc']) == {
+            '5394aa025b8e401ca6bc3ddee3130edc': {
+                'foo': 'baz',
+            },
+        }
+
+    def test_sectioned_field_codec(self):
+        ns = DjangoNodeStorage(sectioned=True)
+        with self.settings(SENTRY_FIELD_CODEC={'serializer': 'msgpack', 'compressor': 'zlib'}):
+            ns.set('d2502ebbd7df41ceba8d3275595cac33', {
+                'foo': 'bar',
+                'baz': BLOB,
+            })
+            assert dict(ns.get('d2502ebbd7df41ceba8d3275595cac33')) == {
+                'foo': 'bar',
+                'baz': BLOB,
+            }
+
+        # Sections written with another codec can still be read.
+        assert dict(ns.get('d2502ebbd7df41ceba8d3275595cac33')) == {
+            'foo': 'bar',
+            'baz': BLOB,
+        }
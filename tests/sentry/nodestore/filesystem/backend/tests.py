@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import time
+
+from datetime import timedelta
+from django.utils import timezone
+
+from sentry.nodestore.filesystem import backend
+from sentry.nodestore.filesystem.backend import FilesystemNodeStorage
+from sentry.testutils import TestCase
+
+
+class FilesystemNodeStorageTest(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.ns = FilesystemNodeStorage(self.path)
+
+    def tearDown(self):
+        backend._stores.clear()
+        shutil.rmtree(self.path)
+
+    def reopen(self, **options):
+        # Forget everything that is cached in memory, as a new process would.
+        backend._stores.clear()
+        return FilesystemNodeStorage(self.path, **options)
+
+    def segment_files(self):
+        return sorted(n for n in os.listdir(self.path) if backend.SEGMENT_RE.match(n))
+
+    def test_get_set(self):
+        assert self.ns.get('d2502ebbd7df41ceba8d3275595cac33') is None
+        self.ns.set('d2502ebbd7df41ceba8d3275595cac33', {'foo': 'bar'})
+        assert self.ns.get('d2502ebbd7df41ceba8d3275595cac33') == {'foo': 'bar'}
+
+        self.ns.set('d2502ebbd7df41ceba8d3275595cac33', {'foo': 'baz'})
+        assert self.ns.get('d2502ebbd7df41ceba8d3275595cac33') == {'foo': 'baz'}
+        assert self.reopen().get('d2502ebbd7df41ceba8d3275595cac33') == {'foo': 'baz'}
+
+    def test_get_multi(self):
+        self.ns.set_multi({
+            'd2502ebbd7df41ceba8d3275595cac33': {'foo': 'bar'},
+            '5394aa025b8e401ca6bc3ddee3130edc': {'foo': 'baz'},
+        })
+        assert self.ns.get_multi([
+            'd2502ebbd7df41ceba8d3275595cac33',
+            '5394aa025b8e401ca6bc3ddee3130edc',
+            '2cc1ba8a12ab4bba9b0b1e57d7fd1b67',
+        ]) == {
+            'd2502ebbd7df41ceba8d3275595cac33': {'foo': 'bar'},
+            '5394aa025b8e401ca6bc3ddee3130edc': {'foo': 'baz'},
+            '2cc1ba8a12ab4bba9b0b1e57d7fd1b67': None,
+        }
+
+    def test_delete(self):
+        self.ns.set_multi({
+            'd2502ebbd7df41ceba8d3275595cac33': {'foo': 'bar'},
+            '5394aa025b8e401ca6bc3ddee3130edc': {'foo': 'baz'},
+            '2cc1ba8a12ab4bba9b0b1e57d7fd1b67': {'foo': 'qux'},
+        })
+        self.ns.delete('d2502ebbd7df41ceba8d3275595cac33')
+        self.ns.delete_multi(['5394aa025b8e401ca6bc3ddee3130edc'])
+        assert self.reopen().get_multi([
+            'd2502ebbd7df41ceba8d3275595cac33',
+            '5394aa025b8e401ca6bc3ddee3130edc',
+            '2cc1ba8a12ab4bba9b0b1e57d7fd1b67',
+        ]) == {
+            'd2502ebbd7df41ceba8d3275595cac33': None,
+            '5394aa025b8e401ca6bc3ddee3130edc': None,
+            '2cc1ba8a12ab4bba9b0b1e57d7fd1b67': {'foo': 'qux'},
+        }
+
+    def test_segments(self):
+        ns = self.reopen(segment_size=256)
+        for i in range(100):
+            ns.set('node-%d' % i, {'i': i, 'data': u'☃' * 20})
+        ns.delete('node-10')
+        ns.set('node-20', {'i': -20})
+
+        sealed = [n for n in self.segment_files() if n.endswith('.idx')]
+        assert len(sealed) > 5
+
+        for ns in (ns, self.reopen(segment_size=256)):
+            assert ns.get('node-10') is None
+            assert ns.get('node-20') == {'i': -20}
+            for i in set(range(100)) - set([10, 20]):
+                assert ns.get('node-%d' % i) == {'i': i, 'data': u'☃' * 20}
+
+    def test_incomplete_write(self):
+        self.ns.set('d2502ebbd7df41ceba8d3275595cac33', {'foo': 'bar'})
+        log, = self.segment_files()
+        with open(os.path.join(self.path, log), 'ab') as f:
+            f.write(backend.encode_record(b'5394aa025b8e401ca6bc3ddee3130edc', b'x' * 100, 0)[:50])
+
+        ns = self.reopen()
+        assert ns.get('5394aa025b8e401ca6bc3ddee3130edc') is None
+        ns.set('5394aa025b8e401ca6bc3ddee3130edc', {'foo': 'baz'})
+        assert self.reopen().get_multi([
+            'd2502ebbd7df41ceba8d3275595cac33',
+            '5394aa025b8e401ca6bc3ddee3130edc',
+        ]) == {
+            'd2502ebbd7df41ceba8d3275595cac33': {'foo': 'bar'},
+            '5394aa025b8e401ca6bc3ddee3130edc': {'foo': 'baz'},
+        }
+
+    def test_cleanup(self):
+        ns = self.reopen(segment_size=1024)
+        for i in range(50):
+            ns.set('old-%d' % i, {'i': i, 'data': 'x' * 50})
+        time.sleep(0.01)
+        cutoff = timezone.now()
+        for i in range(50):
+            ns.set('new-%d' % i, {'i': i, 'data': 'x' * 50})
+
+        ns.cleanup(cutoff - timedelta(days=1))
+        assert ns.get('old-0') == {'i': 0, 'data': 'x' * 50}
+
+        ns.cleanup(cutoff)
+        assert ns.get('old-0') is None
+        assert ns.get('new-0') == {'i': 0, 'data': 'x' * 50}
+        assert ns.get('new-49') == {'i': 49, 'data': 'x' * 50}
+
+    def test_compaction(self):
+        ns = self.reopen(segment_size=1024)
+        for i in range(50):
+            ns.set('node-%d' % i, {'i': i, 'data': 'x' * 50})
+        files = self.segment_files()
+        ns.delete_multi(['node-%d' % i for i in range(50) if i % 10])
+        ns.set('node-%d' % 49, {'i': 49})
+
+        ns.cleanup(timezone.now() - timedelta(days=1))
+        assert self.segment_files() != files
+        assert any(n.endswith('-0001.log') for n in self.segment_files())
+
+        for ns in (ns, self.reopen(segment_size=1024)):
+            for i in range(50):
+                if i % 10 == 0:
+                    assert ns.get('node-%d' % i) == {'i': i, 'data': 'x' * 50}
+                elif i == 49:
+                    assert ns.get('node-%d' % i) == {'i': i}
+                else:
+                    assert ns.get('node-%d' % i) is None
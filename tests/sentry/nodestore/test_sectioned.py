@@ -0,0 +1,80 @@
+from __future__ import absolute_import
+
+import copy
+import pytest
+
+from sentry.nodestore.sectioned import SectionedData, SectionedFormat, is_sectioned
+from sentry.utils import json
+from sentry.utils.canonical import CanonicalKeyDict
+from sentry.utils.compat import pickle
+
+format = SectionedFormat(dumps=json.dumps, loads=json.loads, section_size=64)
+
+DATA = {
+    'message': 'hello',
+    'tags': [['level', 'error']],
+    'exception': {
+        'values': [{'type': 'ValueError', 'value': 'x' * 100}],
+    },
+    'sentry.interfaces.Http': {
+        'url': 'http://example.com/' + 'y' * 100,
+    },
+}
+
+
+def test_round_trip():
+    value = format.encode(DATA)
+    assert is_sectioned(value)
+    assert not is_sectioned(json.dumps(DATA))
+
+    data = format.decode(value)
+    assert isinstance(data, SectionedData)
+    assert dict(data) == DATA
+    assert sorted(data) == sorted(DATA)
+    assert len(data) == len(DATA)
+
+
+def test_lazy():
+    data = format.decode(format.encode(DATA))
+    assert data.decoded_sections == 0
+
+    assert data['tags'] == [['level', 'error']]
+    assert data['message'] == 'hello'
+    assert data.decoded_sections == 1
+
+    assert data['exception'] == DATA['exception']
+    assert data.decoded_sections == 2
+
+    with pytest.raises(KeyError):
+        data['missing']
+
+
+def test_mutation():
+    data = format.decode(format.encode(DATA))
+
+    data['message'] = 'goodbye'
+    del data['exception']
+    data['extra'] = {}
+
+    assert data['tags'] == [['level', 'error']]
+    assert data['message'] == 'goodbye'
+    assert 'exception' not in data
+    assert data.decoded_sections == 1
+
+    other = data.copy()
+    other['message'] = 'hello again'
+    assert data['message'] == 'goodbye'
+
+    assert pickle.loads(pickle.dumps(data)) == dict(data)
+    assert copy.deepcopy(data) == dict(data)
+
+
+def test_canonical_key_dict():
+    data = CanonicalKeyDict(format.decode(format.encode(DATA)), legacy=False)
+    assert isinstance(data.data, SectionedData)
+    assert data.data.decoded_sections == 0
+
+    assert data['request'] == DATA['sentry.interfaces.Http']
+    assert data['sentry.interfaces.Http'] == DATA['sentry.interfaces.Http']
+    assert sorted(data) == ['exception', 'logentry', 'request', 'tags']
+    assert data.data.decoded_sections == 1
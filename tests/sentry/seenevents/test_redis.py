@@ -0,0 +1,32 @@
+from __future__ import absolute_import
+
+import mock
+
+from sentry.seenevents.redis import RedisSeenEvents, get_filter_size
+from sentry.testutils import TestCase
+
+
+class RedisSeenEventsTest(TestCase):
+    def setUp(self):
+        self.backend = RedisSeenEvents(window=60)
+
+    def test_filter_size(self):
+        assert get_filter_size(100000, 0.01) == (958506, 7)
+
+    def test_add(self):
+        assert not self.backend.may_contain(1, 'a' * 32)
+        self.backend.add(1, 'a' * 32)
+        assert self.backend.may_contain(1, 'a' * 32)
+        assert not self.backend.may_contain(1, 'b' * 32)
+        assert not self.backend.may_contain(2, 'a' * 32)
+
+    @mock.patch('sentry.seenevents.redis.time')
+    def test_window(self, time):
+        time.return_value = 1000
+        self.backend.add(1, 'a' * 32)
+
+        time.return_value = 1060
+        assert self.backend.may_contain(1, 'a' * 32)
+
+        time.return_value = 1120
+        assert not self.backend.may_contain(1, 'a' * 32)
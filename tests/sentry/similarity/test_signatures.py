@@ -1,5 +1,7 @@
 from __future__ import absolute_import
 
+import mmh3
+
 from collections import Counter
 from unittest import TestCase
 
@@ -38,3 +40,13 @@ class MinHashSignatureBuilderTestCase(TestCase):
             estimation,
             delta=0.1,  # totally made up constant, seems reasonable
         )
+
+    def test_compatibility(self):
+        get_signature = MinHashSignatureBuilder(16, 0xFFFF, cache_size=4)
+        features = ['foo', 'bar', 'baz', 'foo', 'quux', 'hello world']
+        expected = [
+            min(mmh3.hash(feature, column) % 0xFFFF for feature in features)
+            for column in range(16)
+        ]
+        assert get_signature(features) == expected
+        assert get_signature(features) == expected
@@ -0,0 +1,52 @@
+from __future__ import absolute_import
+
+import mock
+
+from sentry.stacktraces.processing import StacktraceProcessor, process_stacktraces
+from sentry.testutils import TestCase
+from sentry.utils.cache import cache
+
+
+class FunctionProcessor(StacktraceProcessor):
+    def handles_frame(self, frame, stacktrace_info):
+        return 'function' in frame
+
+    def preprocess_frame(self, processable_frame):
+        processable_frame.set_cache_key_from_values([processable_frame['function']])
+
+    def process_frame(self, processable_frame, processing_task):
+        function = processable_frame.cache_value
+        if function is None:
+            function = processable_frame['function'].upper()
+            processable_frame.set_cache_value(function)
+        return [dict(processable_frame.frame, function=function)], None, None
+
+
+class ProcessStacktracesTest(TestCase):
+    def process(self, functions):
+        data = {
+            'project': self.project.id,
+            'stacktrace': {
+                'frames': [{'function': function} for function in functions],
+            },
+        }
+        process_stacktraces(
+            data,
+            make_processors=lambda data, infos: [
+                FunctionProcessor(data, infos, project=self.project),
+            ],
+        )
+        return [frame['function'] for frame in data['stacktrace']['frames']]
+
+    def test_frame_cache(self):
+        with mock.patch.object(cache, 'set_many', wraps=cache.set_many) as set_many:
+            assert self.process(['foo', 'bar', 'foo']) == ['FOO', 'BAR', 'FOO']
+            assert set_many.call_count == 1
+            assert sorted(set_many.call_args[0][0].values()) == ['BAR', 'FOO']
+
+        with mock.patch.object(cache, 'get_many', wraps=cache.get_many) as get_many, \
+                mock.patch.object(cache, 'set_many', wraps=cache.set_many) as set_many:
+            assert self.process(['foo', 'baz']) == ['FOO', 'BAZ']
+            assert get_many.call_count == 1
+            # Only the frame that was not cached yet is written back.
+            assert list(set_many.call_args[0][0].values()) == ['BAZ']
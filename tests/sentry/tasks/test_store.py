@@ -7,7 +7,9 @@ from time import time
 from sentry import quotas, tsdb
 from sentry.event_manager import EventManager, HashDiscarded
 from sentry.plugins import Plugin2
-from sentry.tasks.store import preprocess_event, process_event, save_event
+from sentry.tasks.store import (
+    _do_save_event_batch, preprocess_event, process_event, save_event
+)
 from sentry.testutils import PluginTestCase
 from sentry.utils.dates import to_datetime
 
@@ -203,3 +205,19 @@ class StoreTasksTest(PluginTestCase):
             ],
                 timestamp=to_datetime(now),
             )
+
+    @mock.patch('sentry.tasks.store._do_save_event')
+    def test_save_event_batch_failure(self, mock_do_save_event):
+        project = self.create_project()
+        mock_do_save_event.side_effect = [Exception('boom'), None]
+
+        events = [
+            {'data': {'event_id': 'a' * 32}, 'event_id': 'a' * 32, 'project_id': project.id},
+            {'data': {'event_id': 'b' * 32}, 'event_id': 'b' * 32, 'project_id': project.id},
+        ]
+        _do_save_event_batch(events)
+
+        # The failing event does not stop the rest of the batch.
+        assert [call[1]['event_id'] for call in mock_do_save_event.call_args_list] == [
+            'a' * 32, 'b' * 32,
+        ]
@@ -0,0 +1,103 @@
+from __future__ import absolute_import
+
+import os
+import pytest
+import pytz
+import shutil
+import tempfile
+
+from datetime import datetime, timedelta
+
+from sentry.tsdb.base import TSDBModel, ONE_MINUTE, ONE_HOUR, ONE_DAY
+from sentry.tsdb.local import LocalTSDB
+from tests.sentry.tsdb import test_redis
+
+
+def redis_only(self):
+    pytest.skip('only applies to RedisTSDB')
+
+
+class LocalTSDBTest(test_redis.RedisTSDBTest):
+    # Runs all of the ``RedisTSDB`` tests that are not about Redis itself.
+
+    def setUp(self):
+        self.db = LocalTSDB(
+            rollups=(
+                # time in seconds, samples to keep
+                (10, 30),  # 5 minutes at 10 seconds
+                (ONE_MINUTE, 120),  # 2 hours at 1 minute
+                (ONE_HOUR, 24),  # 1 days at 1 hour
+                (ONE_DAY, 30),  # 30 days at 1 day
+            ),
+        )
+
+    def tearDown(self):
+        self.db.flush()
+
+    test_make_counter_key = redis_only
+    test_get_model_key = redis_only
+    test_frequency_table_import_export_no_estimators = redis_only
+    test_frequency_table_import_export_both_estimators = redis_only
+    test_frequency_table_import_export_source_estimators = redis_only
+    test_frequency_table_import_export_destination_estimators = redis_only
+
+    def test_expiry(self):
+        now = datetime.utcnow().replace(tzinfo=pytz.UTC)
+
+        self.db.incr(TSDBModel.project, 1, now - timedelta(days=2), count=5)
+        self.db.incr(TSDBModel.project, 1, now, count=1)
+        # Anything older than the newest bucket in its slot is dropped.
+        self.db.incr(TSDBModel.project, 1, now - timedelta(days=1), count=3)
+
+        assert self.db.get_sums(
+            TSDBModel.project, [1], now - timedelta(hours=23), now, rollup=ONE_HOUR,
+        ) == {1: 1}
+        assert self.db.get_sums(
+            TSDBModel.project, [1], now - timedelta(days=2), now, rollup=ONE_DAY,
+        ) == {1: 9}
+
+    def test_max_series(self):
+        self.db.max_series = 2
+        now = datetime.utcnow().replace(tzinfo=pytz.UTC)
+
+        for key in (1, 2, 3):
+            self.db.incr(TSDBModel.group, key, now)
+
+        assert self.db.get_sums(
+            TSDBModel.group, [1, 2, 3], now, now) == {1: 0, 2: 1, 3: 1}
+
+    def test_shared_path(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'tsdb.sqlite')
+            now = datetime.utcnow().replace(tzinfo=pytz.UTC)
+
+            # Every process opens its own database, writes of one are visible
+            # to all others.
+            db = LocalTSDB(rollups=self.db.rollups.items(), path=path)
+            other = LocalTSDB(rollups=self.db.rollups.items(), path=path)
+            db.incr(TSDBModel.project, 1, now, count=3, environment_id=1)
+            other.incr(TSDBModel.project, 1, now, count=2, environment_id=1)
+            db.record(TSDBModel.users_affected_by_project, 1, ['a', 'b'], now)
+            other.record(TSDBModel.users_affected_by_project, 1, ['b', 'c'], now)
+            other.record_frequency_multi(
+                [(TSDBModel.frequent_environments_by_group, {1: {'production': 2}})], now)
+
+            for tsdb in (db, other):
+                assert tsdb.get_sums(
+                    TSDBModel.project, [1], now, now, environment_id=1) == {1: 5}
+                assert tsdb.get_distinct_counts_totals(
+                    TSDBModel.users_affected_by_project, [1], now, now) == {1: 3}
+                assert tsdb.get_most_frequent(
+                    TSDBModel.frequent_environments_by_group, [1], now, now,
+                ) == {1: [('production', 2.0)]}
+
+            # The data survives restarts.
+            restored = LocalTSDB(rollups=self.db.rollups.items(), path=path)
+            assert restored.get_sums(TSDBModel.project, [1], now, now) == {1: 5}
+
+            # The data is discarded when the rollup configuration changes.
+            restored = LocalTSDB(rollups=((ONE_HOUR, 24), ), path=path)
+            assert restored.get_sums(TSDBModel.project, [1], now, now) == {1: 0}
+        finally:
+            shutil.rmtree(directory)
@@ -11,6 +11,7 @@ from datetime import (
 
 from sentry.testutils import TestCase
 from sentry.tsdb.base import TSDBModel, ONE_MINUTE, ONE_HOUR, ONE_DAY
+from sentry.tsdb.inmemory import InMemoryTSDB
 from sentry.tsdb.redis import RedisTSDB, CountMinScript, SuppressionWrapper
 from sentry.utils.dates import to_datetime, to_timestamp
 
@@ -136,6 +137,23 @@ class RedisTSDBTest(TestCase):
             ],
         }
 
+        results = self.db.get_range(
+            TSDBModel.project, [1, 2], dts[0], dts[-1], environment_ids=[1, 2])
+        assert results == {
+            1: [
+                (timestamp(dts[0]), 0),
+                (timestamp(dts[1]), 1),
+                (timestamp(dts[2]), 0),
+                (timestamp(dts[3]), 4),
+            ],
+            2: [
+                (timestamp(dts[0]), 0),
+                (timestamp(dts[1]), 0),
+                (timestamp(dts[2]), 0),
+                (timestamp(dts[3]), 4),
+            ],
+        }
+
         results = self.db.get_sums(TSDBModel.project, [1, 2], dts[0], dts[-1])
         assert results == {
             1: 9,
@@ -207,6 +225,104 @@ class RedisTSDBTest(TestCase):
             2: 0,
         }
 
+    def test_server_side_aggregation(self):
+        inmemory = InMemoryTSDB(rollups=self.db.rollups.items())
+        now = datetime.utcnow().replace(tzinfo=pytz.UTC)
+        start = now - timedelta(hours=20)
+
+        for i in range(20):
+            timestamp = start + timedelta(hours=i)
+            for db in (self.db, inmemory):
+                db.incr(TSDBModel.project, 1, timestamp, count=i)
+                db.incr(TSDBModel.project, 2, timestamp, count=1, environment_id=i % 3)
+                db.incr_multi(
+                    [(TSDBModel.project, 1), (TSDBModel.project, 3)],
+                    timestamp, count=2, environment_id=1,
+                )
+
+        keys = [1, 2, 3, 4]
+        for environment_ids in (None, [0], [1], [1, 2]):
+            expected = inmemory.get_range_rollup(
+                TSDBModel.project, keys, start, now, 6 * ONE_HOUR, rollup=ONE_HOUR,
+                environment_ids=environment_ids)
+            assert self.db.get_range_rollup(
+                TSDBModel.project, keys, start, now, 6 * ONE_HOUR, rollup=ONE_HOUR,
+                environment_ids=environment_ids) == expected
+
+        for environment_id in (None, 0, 1, 5):
+            expected = inmemory.get_sums(
+                TSDBModel.project, keys, start, now, rollup=ONE_HOUR,
+                environment_id=environment_id)
+            assert self.db.get_sums(
+                TSDBModel.project, keys, start, now, rollup=ONE_HOUR,
+                environment_id=environment_id) == expected
+
+            self.db.enable_server_side_aggregation = False
+            assert self.db.get_sums(
+                TSDBModel.project, keys, start, now, rollup=ONE_HOUR,
+                environment_id=environment_id) == expected
+            self.db.enable_server_side_aggregation = True
+
+    def test_write_session(self):
+        inmemory = InMemoryTSDB(rollups=self.db.rollups.items())
+        now = datetime.utcnow().replace(tzinfo=pytz.UTC)
+        start = now - timedelta(hours=4)
+        frequency_model = TSDBModel.frequent_projects_by_organization
+
+        session = self.db.write_session()
+        for i in range(16):
+            # Every bucket is written twice.
+            timestamp = start + timedelta(minutes=30 * (i // 2))
+            for db in (session, inmemory):
+                db.incr(TSDBModel.project, 1, timestamp, count=i)
+                db.incr_multi(
+                    [(TSDBModel.project, 1), (TSDBModel.project, 2)],
+                    timestamp, count=2, environment_id=1,
+                )
+                db.record(TSDBModel.users_affected_by_project, 1, ['a', 'b'], timestamp)
+                db.record(
+                    TSDBModel.users_affected_by_project, 1, ['b', 'c%s' % i], timestamp,
+                    environment_id=1,
+                )
+                db.record_frequency_multi(
+                    [(frequency_model, {'organization:1': {
+                        'project:1': 1,
+                        'project:%s' % (i % 3): 2,
+                    }})],
+                    timestamp,
+                )
+
+        # Writes in the same buckets are coalesced (into 3 counters, 2 distinct
+        # counters and 1 frequency table per bucket), and nothing is written
+        # until the session is flushed.
+        assert len(session) == 8 * 6
+        assert self.db.get_sums(TSDBModel.project, [1, 2], start, now) == {1: 0, 2: 0}
+
+        session.flush()
+        assert len(session) == 0
+
+        for environment_ids in (None, [1]):
+            assert self.db.get_range(
+                TSDBModel.project, [1, 2], start, now, environment_ids=environment_ids,
+            ) == inmemory.get_range(
+                TSDBModel.project, [1, 2], start, now, environment_ids=environment_ids,
+            )
+
+        for environment_id in (None, 1):
+            assert self.db.get_distinct_counts_totals(
+                TSDBModel.users_affected_by_project, [1], start, now,
+                environment_id=environment_id,
+            ) == inmemory.get_distinct_counts_totals(
+                TSDBModel.users_affected_by_project, [1], start, now,
+                environment_id=environment_id,
+            )
+
+        assert self.db.get_most_frequent(
+            frequency_model, ['organization:1'], start, now,
+        ) == inmemory.get_most_frequent(
+            frequency_model, ['organization:1'], start, now,
+        )
+
     def test_count_distinct(self):
         now = datetime.utcnow().replace(tzinfo=pytz.UTC) - timedelta(hours=4)
         dts = [now + timedelta(hours=i) for i in range(4)]
@@ -384,6 +500,22 @@ class RedisTSDBTest(TestCase):
             2: 0,
         }
 
+    def test_count_distinct_union_large(self):
+        now = datetime.utcnow().replace(tzinfo=pytz.UTC)
+        model = TSDBModel.users_affected_by_project
+
+        # Odd and even keys share their values, so there are 2000 distinct
+        # values in total. (Large enough that the HyperLogLogs are dense.)
+        for key in range(1, 6):
+            self.db.record(model, key, [u'{}:{}'.format(key % 2, i) for i in range(1000)], now)
+
+        result = self.db.get_distinct_counts_union(
+            model, list(range(1, 6)), now - timedelta(hours=1), now)
+        assert abs(result - 2000) < 2000 * 0.05
+
+        assert self.db.get_distinct_counts_union(
+            model, [6, 7], now - timedelta(hours=1), now) == 0
+
     def test_frequency_tables(self):
         now = datetime.utcnow().replace(tzinfo=pytz.UTC)
         model = TSDBModel.frequent_projects_by_organization
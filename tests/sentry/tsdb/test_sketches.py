@@ -0,0 +1,112 @@
+from __future__ import absolute_import
+
+import pytest
+
+from sentry.tsdb.sketches import CountMinSketch, HyperLogLog, ranked
+from sentry.utils.compat import pickle
+
+
+def test_hyperloglog():
+    hll = HyperLogLog()
+    assert hll.cardinality() == 0
+
+    hll.update(['foo', 'bar', 'foo'])
+    assert hll.cardinality() == 2
+
+    hll.update(range(10000))
+    assert isinstance(hll.registers, bytearray)
+    assert abs(hll.cardinality() - 10002) < 10002 * 0.05
+
+
+def test_hyperloglog_merge():
+    a = HyperLogLog()
+    a.update(range(500))
+    b = HyperLogLog()
+    b.update(range(300, 1000))
+
+    a.merge(b)
+    assert abs(a.cardinality() - 1000) < 1000 * 0.05
+
+    restored = pickle.loads(pickle.dumps(a, pickle.HIGHEST_PROTOCOL))
+    assert restored.cardinality() == a.cardinality()
+
+
+def test_count_min_sketch():
+    sketch = CountMinSketch(3, 128, 3)
+    assert not sketch
+
+    sketch.increment([('foo', 1), ('bar', 2)])
+    assert sketch.estimators is None
+    assert sketch.ranked() == [('bar', 2.0), ('foo', 1.0)]
+
+    sketch.increment([('baz', 3), ('foo', 3)])
+    assert sketch.estimators is not None
+    assert sketch.ranked() == [('foo', 4.0), ('baz', 3.0), ('bar', 2.0)]
+
+    sketch.increment([('qux', 1)])
+    assert sketch.ranked(2) == [('foo', 4.0), ('baz', 3.0)]
+    assert sketch.estimate('qux') >= 1.0
+
+
+def test_count_min_sketch_merge():
+    a = CountMinSketch(3, 128, 50)
+    a.increment([('foo', 1), ('bar', 2)])
+    b = CountMinSketch(3, 128, 50)
+    b.increment([('bar', 1), ('baz', 5)])
+
+    assert ranked([a, b]) == [('baz', 5.0), ('bar', 3.0), ('foo', 1.0)]
+
+    a.merge(b)
+    assert a.ranked() == [('baz', 5.0), ('bar', 3.0), ('foo', 1.0)]
+
+
+def make_redis_header(encoding):
+    return b'HYLL' + bytearray([encoding, 0, 0, 0]) + b'\x00' * 8
+
+
+def test_hyperloglog_from_redis_sparse():
+    # An empty HyperLogLog: a single XZERO opcode covering all registers.
+    hll = HyperLogLog.from_redis(make_redis_header(1) + b'\x7f\xff')
+    assert hll.cardinality() == 0
+
+    # ZERO(3), VAL(2) x 2, XZERO(16379)
+    value = make_redis_header(1) + bytearray([0x02, 0x85, 0x7f, 0xfa])
+    hll = HyperLogLog.from_redis(value)
+    assert hll.precision == HyperLogLog.REDIS_PRECISION
+    assert hll.registers == {3: 2, 4: 2}
+
+
+def test_hyperloglog_from_redis_dense():
+    expected = HyperLogLog(HyperLogLog.REDIS_PRECISION)
+    expected.update(range(5000))
+    assert isinstance(expected.registers, bytearray)
+
+    data = bytearray(len(expected.registers) * 6 // 8)
+    for index, register in enumerate(expected.registers):
+        offset = index * 6
+        word = register << (offset % 8)
+        data[offset // 8] |= word & 0xff
+        if offset // 8 + 1 < len(data):
+            data[offset // 8 + 1] |= word >> 8
+
+    hll = HyperLogLog.from_redis(make_redis_header(0) + data)
+    assert hll.registers == expected.registers
+    assert hll.cardinality() == expected.cardinality()
+
+
+def test_hyperloglog_from_redis_is_not_merged_with_local():
+    hll = HyperLogLog.from_redis(make_redis_header(1) + b'\x7f\xff')
+    assert hll.redis
+
+    local = HyperLogLog(HyperLogLog.REDIS_PRECISION)
+    local.add('foo')
+    with pytest.raises(ValueError):
+        local.merge(hll)
+    with pytest.raises(ValueError):
+        hll.merge(local)
+    with pytest.raises(ValueError):
+        hll.add('foo')
+
+    union = HyperLogLog(HyperLogLog.REDIS_PRECISION, redis=True)
+    union.merge(hll)
+    assert union.cardinality() == 0
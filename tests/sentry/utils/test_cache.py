@@ -0,0 +1,139 @@
+from __future__ import absolute_import
+
+import time
+
+from django.core.cache import cache
+
+from sentry.testutils import TestCase
+from sentry.utils.cache import LocalCache, RequestCache, request_cache
+
+
+def wait_for(func, timeout=5):
+    deadline = time.time() + timeout
+    while not func():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+class RequestCacheTest(TestCase):
+    def test_scope(self):
+        cache = RequestCache()
+        cache.set('foo', 1)
+        assert cache.get('foo') is None
+
+        cache.start()
+        cache.set('foo', 1)
+        assert cache.get('foo') == 1
+
+        # Tasks that run within a request share its scope.
+        cache.start()
+        assert cache.get('foo') == 1
+        cache.finish()
+        assert cache.get('foo') == 1
+
+        cache.delete('foo')
+        assert cache.get('foo', 2) == 2
+        cache.set('foo', 1)
+
+        cache.finish()
+        assert cache.get('foo') is None
+
+        cache.start()
+        assert cache.get('foo') is None
+        cache.finish()
+
+
+class LocalCacheTest(TestCase):
+    def setUp(self):
+        self.a = LocalCache()
+        self.b = LocalCache()
+
+    def test_disabled(self):
+        self.a.set('foo', 1, 60)
+        cache.set('foo', 2, 60)
+        assert self.a.get('foo') == 2
+
+    def test_add(self):
+        assert self.a.add('foo', 1, None)
+        assert not self.b.add('foo', 2, None)
+        assert self.b.get('foo') == 1
+
+        request_cache.start()
+        try:
+            self.a.delete('foo')
+            assert self.a.get('foo') is None
+            cache.set('foo', 3, 60)
+            # The miss cached for the request is dropped.
+            assert not self.a.add('foo', 4, None)
+            assert self.a.get('foo') == 3
+        finally:
+            request_cache.finish()
+
+    def test_request_cache(self):
+        request_cache.start()
+        try:
+            self.a.set('foo', 1, 60)
+            cache.set('foo', 2, 60)
+            assert self.a.get('foo') == 1
+            assert self.b.get('foo') == 1
+
+            assert self.a.get('bar') is None
+            cache.set('bar', 1, 60)
+            assert self.a.get('bar') is None
+
+            self.b.delete('foo')
+            cache.set('foo', 3, 60)
+            assert self.a.get('foo') == 3
+        finally:
+            request_cache.finish()
+
+        cache.set('foo', 4, 60)
+        assert self.a.get('foo') == 4
+
+    def test_invalidation(self):
+        with self.settings(SENTRY_LOCAL_CACHE_SIZE=10):
+            wait_for(lambda: self.a._get_local() is not None)
+            wait_for(lambda: self.b._get_local() is not None)
+
+            self.a.set('foo', 1, 60)
+            assert self.b.get('foo') == 1
+
+            # Values are served from the local cache ...
+            cache.set('foo', 2, 60)
+            assert self.a.get('foo') == 1
+            assert self.b.get('foo') == 1
+
+            # ... until another process changes them.
+            self.a.set('foo', 3, 60)
+            assert self.a.get('foo') == 3
+            wait_for(lambda: self.b.get('foo') == 3)
+
+            self.a.delete('foo')
+            wait_for(lambda: self.b.get('foo') is None)
+
+    def test_negative(self):
+        with self.settings(SENTRY_LOCAL_CACHE_SIZE=10):
+            wait_for(lambda: self.a._get_local() is not None)
+            wait_for(lambda: self.b._get_local() is not None)
+
+            assert self.b.get('bar') is None
+            cache.set('bar', 1, 60)
+            assert self.b.get('bar') is None
+
+            self.a.set('bar', 2, 60)
+            wait_for(lambda: self.b.get('bar') == 2)
+
+    def test_fork(self):
+        with self.settings(SENTRY_LOCAL_CACHE_SIZE=10):
+            wait_for(lambda: self.a._get_local() is not None)
+
+            # A forked process starts with a copy of its parent's cache.
+            self.b._origin = self.a._origin
+            wait_for(lambda: self.b._get_local() is not None)
+            assert self.b._origin != self.a._origin
+
+            self.a.set('foo', 1, 60)
+            assert self.b.get('foo') == 1
+
+            self.a.set('foo', 2, 60)
+            wait_for(lambda: self.b.get('foo') == 2)
@@ -0,0 +1,77 @@
+from __future__ import absolute_import
+
+import pytest
+
+from datetime import datetime
+
+from sentry.utils.codecs import FieldCodec, TYPES, zstandard
+from sentry.utils.compat import pickle
+from sentry.utils.strings import compress, decompress
+
+DATA = {
+    'message': u'Hello ☃',
+    'tags': [['level', 'error'], ['environment', 'production']],
+    'count': 2 ** 40,
+    'extra': {'nested': [1, 2.5, None, True]},
+}
+
+
+def test_round_trip():
+    codec = FieldCodec()
+    value = codec.encode(DATA)
+    assert codec.get_type(value) == TYPES[('msgpack', 'zlib')]
+    assert codec.decode(value) == DATA
+
+
+def test_legacy():
+    codec = FieldCodec()
+    value = compress(pickle.dumps(DATA))
+    assert codec.get_type(value) is None
+    assert codec.decode(value) == DATA
+
+
+def test_pickle_fallback():
+    codec = FieldCodec()
+    data = {'timestamp': datetime(2019, 1, 1)}
+    value = codec.encode(data)
+    assert codec.get_type(value) == TYPES[('pickle', 'zlib')]
+    assert codec.decode(value) == data
+
+
+def test_legacy_writes():
+    codec = FieldCodec(serializer='legacy')
+    value = codec.encode(DATA)
+    assert codec.get_type(value) is None
+    # as read by versions that predate the codec
+    assert pickle.loads(decompress(value)) == DATA
+    assert codec.decode(value) == DATA
+
+    with pytest.raises(ValueError):
+        FieldCodec(serializer='legacy', compressor='zstd')
+
+
+def test_tuples_are_pickled():
+    codec = FieldCodec()
+    data = {'foo': ('bar', 1)}
+    value = codec.encode(data)
+    assert codec.get_type(value) == TYPES[('pickle', 'zlib')]
+    assert codec.decode(value) == data
+
+
+def test_reads_other_formats():
+    value = FieldCodec(serializer='pickle').encode(DATA)
+    assert FieldCodec().decode(value) == DATA
+
+
+def test_unknown_type():
+    with pytest.raises(ValueError):
+        FieldCodec().loads(b'\x7f' + b'foo')
+
+
+@pytest.mark.skipif(zstandard is None, reason='requires zstandard')
+def test_zstd():
+    codec = FieldCodec(compressor='zstd')
+    value = codec.encode(DATA)
+    assert codec.get_type(value) == TYPES[('msgpack', 'zstd')]
+    assert codec.decode(value) == DATA
+    assert FieldCodec().decode(value) == DATA